@@ -23,25 +23,15 @@
 ####################################################################
 
 import os # for listdir
-import platform # for platform.system
 import os.path # for isfile and join and path
-import sys
-import zipfile
-import shutil  # For deleting plugin directories;
 import stat    # For setting file permissions correctly;
 import re #For escaping characters in the settings.
 import json
-import copy
-import struct
 import time
-import configparser
-import urllib.request
-import requests
-import ssl
-import json
-import traceback
 
-from distutils.version import StrictVersion # for upgrade installations
+# zipfile, shutil, configparser, requests and the Upgrader are only needed while installing,
+# uninstalling or talking to GitHub, so they are imported where they are used
+# to keep them off Cura's startup path.
 
 from UM.Application import Application
 from UM.i18n import i18nCatalog
@@ -49,19 +39,15 @@ from UM.Extension import Extension
 from UM.Message import Message
 from UM.Resources import Resources
 from UM.Logger import Logger
-from UM.Preferences import Preferences
 from UM.Mesh.MeshWriter import MeshWriter
-from UM.Settings.InstanceContainer import InstanceContainer
-from UM.Qt.Duration import DurationFormat
-from UM.Qt.Bindings.Theme import Theme
-from UM.PluginRegistry import PluginRegistry
+from UM.Version import Version # for upgrade installations
 from . import NautilusDuet
-from . import Upgrader
+from . import NautilusStartupJob
+from .NautilusDialogs import NautilusDialogs
 from cura.CuraApplication import CuraApplication
 
-from PyQt5.QtWidgets import QApplication, QFileDialog
-from PyQt5.QtGui import QPixmap, QScreen, QColor, qRgb, QImageReader, QImage, QDesktopServices
-from PyQt5.QtCore import QByteArray, QBuffer, QIODevice, QRect, Qt, QSize, pyqtSlot, QObject, QUrl, pyqtProperty
+from PyQt5.QtGui import QDesktopServices
+from PyQt5.QtCore import pyqtSlot, QObject, QUrl, pyqtProperty
 
 
 
@@ -86,8 +72,12 @@ class Nautilus(QObject, MeshWriter, Extension):
         re.escape("\r"): "\\r"    # Carriage return. Windows users may need this for visualisation in their editors.
     }
 
+    __instance = None
+
     def __init__(self):
+        registrationStart = time.perf_counter()
         super().__init__()
+        Nautilus.__instance = self
         self._application = CuraApplication.getInstance()
         self._setting_keyword = ";SETTING_"
         #self._application.initializationFinished.connect(self._onInitialized)
@@ -96,6 +86,11 @@ class Nautilus(QObject, MeshWriter, Extension):
         self._preferences_window = None
         self._guides = None
         self._ready = False
+        self._installPending = False
+        self._startupJob = None
+        self._startupMessage = None
+        self._startupDone = False
+        self._activationPending = False
 
         self.local_meshes_path = None
         self.local_printer_def_path = None
@@ -134,6 +129,12 @@ class Nautilus(QObject, MeshWriter, Extension):
 
         self._application.getPreferences().addPreference("Nautilus/uptodate","yes")
 
+        # g-code post-processing done before uploads, off by default
+        self._application.getPreferences().addPreference("Nautilus/arc_fitting", False)
+        self._application.getPreferences().addPreference("Nautilus/arc_tolerance", 0.05)
+        self._application.getPreferences().addPreference("Nautilus/compact_gcode", False)
+        self._application.getPreferences().addPreference("Nautilus/preheat_while_uploading", False)
+
         # if something got messed up, force installation
         if not self.isInstalled() and self._application.getPreferences().getValue("Nautilus/install_status") is "installed":
             self._application.getPreferences().setValue("Nautilus/install_status", "unknown")
@@ -153,8 +154,8 @@ class Nautilus(QObject, MeshWriter, Extension):
         # if so don't automatically install them
         if self._application.getPreferences().getValue("Nautilus/install_status") is "unknown":
             # if the user never installed the files, then automatically install it
-            Logger.log("i","Time to install!")
-            self.installPluginFiles()
+            # once the engine is up, see _onStartup
+            self._installPending = True
 
         #if not self.configVersionsMatch():
         #    self.messageMaker() #RETOOL WITH NEW UPDATING PROCEDURES
@@ -163,8 +164,9 @@ class Nautilus(QObject, MeshWriter, Extension):
 
             #This is the signal for machines changing
         self._application.globalContainerStackChanged.connect(self.updateMachineName)
-        Duet=NautilusDuet.NautilusDuet()
+        Duet=NautilusDuet.NautilusDuet.getInstance()
         self.addMenuItem(catalog.i18nc("@item:inmenu","Nautilus Connections"), Duet.showSettingsDialog)
+        self.addMenuItem(catalog.i18nc("@item:inmenu", "Farm Queue"), Duet.showQueueDialog)
         self.addMenuItem(catalog.i18nc("@item:inmenu", "Resources and Guides"), self.showGuides)
         self.addMenuItem(catalog.i18nc("@item:inmenu", "Preferences"), self.showPreferences)
 
@@ -172,13 +174,17 @@ class Nautilus(QObject, MeshWriter, Extension):
         #self._application.getPreferences().writeToFile(Resources.getStoragePath(Resources.Preferences, self._application.getApplicationName() + ".cfg"))
 
         Application.getInstance().engineCreatedSignal.connect(self._onStartup)
+        Logger.log("i", "Nautilus startup | plugin registered in {:.3f}s".format(time.perf_counter() - registrationStart))
 
             #Application.getInstance().engineCreatedSignal.connect(self.createPreferencesWindow)
 
+    @classmethod
+    def getInstance(cls):
+        return cls.__instance
+
     def createPreferencesWindow(self):
-        path = os.path.join(PluginRegistry.getInstance().getPluginPath(self.getPluginId()), "qml", "Nautilusprefs.qml")
-        Logger.log("i", "Creating Nautilus preferences UI "+path)
-        self._preferences_window = self._application.createQmlComponent(path, {"manager": self})
+        Logger.log("i", "Creating Nautilus preferences UI")
+        self._preferences_window = NautilusDialogs.getInstance().getDialog("Nautilusprefs.qml", self)
 
     def showPreferences(self):
         if self._preferences_window is None:
@@ -187,9 +193,8 @@ class Nautilus(QObject, MeshWriter, Extension):
         self._preferences_window.show()
 
     def createGuidesWindow(self):
-        path = os.path.join(PluginRegistry.getInstance().getPluginPath(self.getPluginId()), "qml", "Nautilusguides.qml")
-        Logger.log("i", "Creating Nautilus guides UI "+path)
-        self._guides = self._application.createQmlComponent(path, {"manager": self})
+        Logger.log("i", "Creating Nautilus guides UI")
+        self._guides = NautilusDialogs.getInstance().getDialog("Nautilusguides.qml", self)
 
     def showGuides(self):
         if self._guides is None:
@@ -203,17 +208,23 @@ class Nautilus(QObject, MeshWriter, Extension):
             #This is the function
     def updateMachineName(self):
         self.MachineName = CuraApplication.getInstance().getMachineManager().activeMachine.definition.name
+        if "Nautilus" in self.MachineName and not self._startupDone:
+            # the install and upgrade work has to land before a Nautilus is used
+            Logger.log("d", "Nautilus startup | activation waits for the startup job")
+            self._activationPending = True
+            return
         #Logger.log("i", "updating this machine to "+self.MachineName)
         if "Nautilus" in self.MachineName:
-            NautilusDuet.NautilusDuet().start()
+            NautilusDuet.NautilusDuet.getInstance().start()
         elif self.MachineName != None:
-            NautilusDuet.NautilusDuet().stop()
+            NautilusDuet.NautilusDuet.getInstance().stop()
 
     def setFirmVers(self, versno):
         self.firmwareVersion = str(versno)
         self._application.getPreferences().addPreference("Nautilus/configversion",self.firmwareVersion)
 
     def checkGit(self): #eventually move htis process to NautilusOutputDevice
+        import requests
         try:
             gitInfo = requests.get(self.gitUrl).text
             Logger.log('i', "!!!"+str(gitInfo))
@@ -306,20 +317,152 @@ class Nautilus(QObject, MeshWriter, Extension):
         return str(numba)
 
     @pyqtSlot()
-    def addMatCosts(self):
+    # Merge the shipped spool costs (matCosts.txt, keyed by material GUID) into
+    # cura/material_settings. Only runs when the shipped table changed, keeps
+    # entries for other materials and any cost the user edited since the last
+    # merge, and leaves the preference alone if nothing would change. With
+    # force the shipped costs and currency are written back regardless.
+    def addMatCosts(self, force = False):
+        import hashlib
+        preferences = self._application.getPreferences()
+        preferences.addPreference("cura/material_settings", "{}")
+        preferences.addPreference("cura/currency", "$")
+        preferences.addPreference("Nautilus/matcosts_hash", "")
+        preferences.addPreference("Nautilus/matcosts_applied", "{}")
+
+        with open(os.path.join(self.this_plugin_path, "matCosts.txt"), 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        if not force and digest == preferences.getValue("Nautilus/matcosts_hash"):
+            return
         Logger.log("i","Setting Material costs and currency!")
-        matCosts = open(os.path.join(self.this_plugin_path,"matCosts.txt"),'r').read()
-        matCosts = matCosts.replace("[","").replace("]","")
-        self._application.getPreferences().addPreference("cura/material_settings",matCosts)
-        self._application.getPreferences().setValue("cura/material_settings",matCosts)
-        self._application.getPreferences().addPreference("cura/currency","$")
-        self._application.getPreferences().setValue("cura/currency","$")
+        table = json.loads(raw.decode('utf-8'))
+
+        try:
+            current = json.loads(preferences.getValue("cura/material_settings"))
+        except ValueError:
+            Logger.log("w", "cura/material_settings is not valid JSON, replacing it")
+            current = {}
+        applied = json.loads(preferences.getValue("Nautilus/matcosts_applied"))
+        merged = dict(current)
+        for guid, costs in table.items():
+            # before the first merge every entry was ours, older versions overwrote them all
+            userEdited = not force and applied and guid in current and current[guid] != applied.get(guid)
+            if not userEdited:
+                merged[guid] = costs
+        if merged != current:
+            preferences.setValue("cura/material_settings", json.dumps(merged))
+        if (force or not applied) and preferences.getValue("cura/currency") != "$":
+            preferences.setValue("cura/currency", "$")
+        appliedValue = json.dumps(table, separators=(',', ':'))
+        if appliedValue != preferences.getValue("Nautilus/matcosts_applied"):
+            preferences.setValue("Nautilus/matcosts_applied", appliedValue)
+        preferences.setValue("Nautilus/matcosts_hash", digest)
+
+    # The "Reset Material Prices" button, puts back the shipped costs even where
+    # the user changed them
+    @pyqtSlot()
+    def resetMatCosts(self):
+        self.addMatCosts(force = True)
+
+    # The base IDs of the materials bundled with Cura, and whether they differ from
+    # the last time this was asked. The listing is cached in a preference together
+    # with the directory's path and mtime, so it is only re-read after Cura's
+    # materials change (including when a Cura upgrade moves them).
+    def curaMaterialIds(self):
+        preferences = self._application.getPreferences()
+        preferences.addPreference("Nautilus/material_listing", "{}")
+        try:
+            cached = json.loads(preferences.getValue("Nautilus/material_listing"))
+        except ValueError:
+            cached = {}
+        try:
+            cura_dir = os.path.dirname(Resources.getPath(CuraApplication.getInstance().ResourceTypes.MaterialInstanceContainer, 'ultimaker_pla_black.xml.fdm_material'))
+            mtime = os.stat(cura_dir).st_mtime_ns
+        except Exception:
+            Logger.log("i","unable to exclude materials")
+            return [], False
+        if cached.get("path") == cura_dir and cached.get("mtime") == mtime:
+            return cached["ids"], False
+        ids = sorted(set(name.split('.', 1)[0] for name in os.listdir(cura_dir) if name.endswith(".fdm_material")))
+        preferences.setValue("Nautilus/material_listing", json.dumps({"path": cura_dir, "mtime": mtime, "ids": ids}, separators=(',', ':')))
+        changed = cached.get("ids") != ids
+        Logger.log("i", "Cura material listing refreshed, {} materials{}".format(len(ids), " (changed)" if changed else ""))
+        return ids, changed
+
+    # Write the excluded materials definition with the given material IDs, unless
+    # the file on disk already says exactly that.
+    def writeExcludedMaterials(self, definition, ids):
+        definition['metadata']['exclude_materials'] = ids
+        data = json.dumps(definition, separators=(',', ':'))
+        path = os.path.join(self.local_printer_def_path, 'hydra_research_excluded_materials.def.json')
+        try:
+            with open(path, 'r') as f:
+                if f.read() == data:
+                    return False
+        except OSError:
+            pass
+        with open(path, 'w') as f:
+            f.write(data)
+        return True
+
+    # Bring an installed excluded materials definition up to date after Cura's own
+    # material set changed, e.g. when Cura was upgraded but the plugin wasn't.
+    def refreshExcludedMaterials(self):
+        path = os.path.join(self.local_printer_def_path, 'hydra_research_excluded_materials.def.json')
+        if not os.path.isfile(path):
+            return
+        ids, changed = self.curaMaterialIds()
+        if not changed:
+            return
+        try:
+            with open(path, 'r') as f:
+                definition = json.load(f)
+        except ValueError:
+            Logger.logException("w", "Unable to read the installed excluded materials definition")
+            return
+        if self.writeExcludedMaterials(definition, ids):
+            Logger.log("i", "Nautilus Plugin updated the excluded materials for Cura's new material set")
 
     def _onStartup(self):
-        self.addMatCosts()
+        if self._installPending:
+            # only the files are installed off the main thread, the preferences
+            # and messages wait for _onStartupJobFinished
+            self._startupJob = NautilusStartupJob.NautilusStartupJob(self, self.curaMaterialIds()[0])
+            self._startupJob.finished.connect(self._onStartupJobFinished)
+            self._startupMessage = Message(catalog.i18nc("@info:progress", "Installing Nautilus printer files"), 0, False, 0)
+            self._startupMessage.show()
+            self._startupJob.progress.connect(self._onStartupJobProgress)
+            self._startupJob.start()
+        else:
+            self._finishStartup()
+        # compile the dialogs while nobody is waiting for them
+        NautilusDialogs.getInstance().precompile(["UploadFilename.qml", "NautilusDuet.qml", "Nautilusprefs.qml", "Nautilusguides.qml", "NautilusQueue.qml"])
         #self.checkGit()
         #self._application.getMachineManager().removeMachineAction("UpgradeFirmware")
 
+    def _onStartupJobProgress(self, job, progress):
+        if self._startupMessage:
+            self._startupMessage.setProgress(progress)
+
+    def _onStartupJobFinished(self, job):
+        if self._startupMessage:
+            self._startupMessage.hide()
+            self._startupMessage = None
+        self._finishInstall(job.getResult())
+        self._finishStartup()
+
+    # The material costs and the excluded materials write preferences, so they
+    # run on the main thread. Both are cached and cheap when nothing changed.
+    def _finishStartup(self):
+        self.addMatCosts()
+        self.refreshExcludedMaterials()
+        self._startupDone = True
+        self._installPending = False
+        if self._activationPending:
+            self._activationPending = False
+            self.updateMachineName()
+
     # returns true if the versions match and false if they don't
     def versionsMatch(self):
         # get the currently installed plugin version number
@@ -327,7 +470,7 @@ class Nautilus(QObject, MeshWriter, Extension):
 
         installedVersion = self._application.getPreferences().getValue("Nautilus/curr_version")
 
-        if StrictVersion(installedVersion) == StrictVersion(Nautilus.version):
+        if Version(installedVersion) == Version(Nautilus.version):
             # if the version numbers match, then return true
             Logger.log("i", "Nautilus Plugin versions match: "+installedVersion+" matches "+Nautilus.version)
             return True
@@ -385,7 +528,8 @@ class Nautilus(QObject, MeshWriter, Extension):
     @pyqtSlot(bool)
     def changePluginInstallStatus(self, bInstallFiles):
         if bInstallFiles and not self.isInstalled():
-            self.installPluginFiles()
+            self.addMatCosts()
+            self._finishInstall(self.installPluginFiles())
             message = Message(catalog.i18nc("@info:status", "Nautilus config files have been installed. Restart cura to complete installation"))
             message.show()
         elif self.isInstalled():
@@ -393,8 +537,18 @@ class Nautilus(QObject, MeshWriter, Extension):
             self.uninstallPluginFiles(False)
 
     # Install the plugin files.
-    def installPluginFiles(self):
-        self.addMatCosts()
+    # progress is an optional callable taking the fraction of the zip installed,
+    # materialIds Cura's own material IDs for the excluded materials file.
+    # This only writes files, so it can run on a worker thread. It returns
+    # "installed", "unchanged" or "failed" for _finishInstall, which does the
+    # preferences and messages on the main thread.
+    def installPluginFiles(self, progress=None, materialIds=None):
+        import configparser
+        import zipfile
+        from . import Upgrader
+        from .NautilusValidator import NautilusValidator
+        if materialIds is None:
+            materialIds = self.curaMaterialIds()[0]
         Logger.log("i", "Nautilus Plugin installing printer files")
         upper = Upgrader.Upgrader()
         value = upper.configFixer()
@@ -408,11 +562,46 @@ class Nautilus(QObject, MeshWriter, Extension):
             Logger.log("i","Nautilus Plugin installing from: " + zipdata)
 
             with zipfile.ZipFile(zipdata, "r") as zip_ref:
-                for info in zip_ref.infolist():
+                # check the archive before anything is written, a broken reference
+                # only shows up later as Cura quietly hiding the profile
+                problems = NautilusValidator.fromZip(zip_ref).validate()
+                for problem in problems:
+                    if problem.severity == "error":
+                        Logger.log("w", "Nautilus Plugin: " + problem.file + " " + problem.message)
+                Logger.log("i", "Nautilus Plugin: archive check found {} problems".format(len(problems)))
+
+                memberIndex = Upgrader.archiveIndex(zip_ref)
+                destinations = {
+                    "definitions": self.local_printer_def_path,
+                    "excluded": self.local_printer_def_path,
+                    "extruders": self.local_extruder_path,
+                    "setting_visibility": self.local_setvis_path,
+                    "materials": self.local_materials_path,
+                    "variants": self.local_variants_path,
+                    "intent": self.local_intent_path,
+                    "quality": self.local_quality_path,
+                    "meshes": self.local_meshes_path
+                }
+                members = zip_ref.infolist()
+                for index, info in enumerate(members):
+                    if progress:
+                        progress(index / len(members))
                     Logger.log("i", "Nautilus Plugin: found in zipfile: " + info.filename )
                     folder = None
                     flag = False
-                    if info.filename == "hydra_research_nautilus.def.json" or info.filename == "hrfdmprinter.def.json" or info.filename == "hrfdmextruder.def.json":
+                    if memberIndex is not None:
+                        # releaser.py already worked out where every member goes
+                        entry = memberIndex.get(info.filename)
+                        destination = entry["destination"] if entry else None
+                        folder = destinations.get(destination)
+                        flag = destination == "excluded"
+                        if destination == "meshes" and not os.path.exists(folder):
+                            os.mkdir(folder)
+                        if folder is not None and not flag and self._memberUnchanged(os.path.join(folder, info.filename), entry):
+                            Logger.log("d", "Nautilus Plugin: " + info.filename + " is already installed")
+                            restartRequired = True
+                            continue
+                    elif info.filename == "hydra_research_nautilus.def.json" or info.filename == "hrfdmprinter.def.json" or info.filename == "hrfdmextruder.def.json":
                         folder = self.local_printer_def_path
                     elif info.filename == "hydra_research_excluded_materials.json":
                         folder = self.local_printer_def_path
@@ -438,24 +627,8 @@ class Nautilus(QObject, MeshWriter, Extension):
                             os.mkdir(folder)
 
                     if flag == True: #create the excluded materials file on install so all native Cura materials are blocked
-                        try:
-                            cura_dir=os.path.normpath(os.path.join(Resources.getPath(CuraApplication.getInstance().ResourceTypes.MaterialInstanceContainer, 'ultimaker_pla_black.xml.fdm_material'),'..'))
-                            #os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])),"resources","materials")
-                            materiallist = os.listdir(cura_dir)
-                        except:
-                            Logger.log("i","unable to exclude materials")
-                            materiallist = ''
-                        #print(materiallist)
-                        with zip_ref.open(info,'r') as f:
-                            data = f.read()
-                            obj=json.loads(data.decode('utf-8'))
-                            entry = {}
-                            obj['metadata']['exclude_materials'] = str(materiallist)
-                            Logger.log("i", "Nautilus Plugin installing excluded materials to " + folder)
-                            with open(os.path.join(folder,'hydra_research_excluded_materials.def.json'),'w') as g:
-                                g.write(json.dumps(obj,indent=4))
-                                g.close()
-                            f.close()
+                        Logger.log("i", "Nautilus Plugin installing excluded materials to " + folder)
+                        self.writeExcludedMaterials(json.loads(zip_ref.read(info).decode('utf-8')), materialIds)
                         folder = None
                     if folder is not None:
                         extracted_path = zip_ref.extract(info.filename, path = folder)
@@ -475,22 +648,41 @@ class Nautilus(QObject, MeshWriter, Extension):
 
                         restartRequired = True
 
-            if restartRequired and self.isInstalled():
-                # either way, the files are now installed, so set the prefrences value
-                self._application.getPreferences().setValue("Nautilus/install_status", "installed")
-                self._application.getPreferences().setValue("Nautilus/curr_version",Nautilus.version)
-                Logger.log("i", "Nautilus Plugin is now installed - Please restart ")
+            return "installed" if restartRequired else "unchanged"
 
         except: # Installing a new plugin should never crash the application.
             Logger.logException("d", "An exception occurred in Nautilus Plugin while installing the files")
+            return "failed"
+
+    # The main thread half of installPluginFiles, result is what it returned.
+    def _finishInstall(self, result):
+        if result == "failed":
             message = Message(catalog.i18nc("@info:status", "Nautilus Plugin experienced an error installing the files"))
             message.show()
+        elif result == "installed" and self.isInstalled():
+            # either way, the files are now installed, so set the prefrences value
+            self._application.getPreferences().setValue("Nautilus/install_status", "installed")
+            self._application.getPreferences().setValue("Nautilus/curr_version",Nautilus.version)
+            Logger.log("i", "Nautilus Plugin is now installed - Please restart ")
+
 
 
 
+    # Whether the file at path is byte for byte the archive member the index entry describes.
+    # Variants and intents never match because install rewrites their setting_version.
+    def _memberUnchanged(self, path, entry):
+        import hashlib
+        try:
+            if os.path.getsize(path) != entry["size"]:
+                return False
+            with open(path, "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest() == entry["sha256"]
+        except OSError:
+            return False
 
     # Uninstall the plugin files.
     def uninstallPluginFiles(self, quiet):
+        import shutil  # For deleting plugin directories;
         Logger.log("i", "Nautilus Plugin uninstalling plugin files")
         restartRequired = False
         # remove the printer definition file
@@ -0,0 +1,329 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import os
+import re
+
+import numpy
+
+# Firmware limits of a stock Nautilus, named like the machine_* settings
+# without the prefix. The output device passes the active machine's values.
+DefaultLimits = {
+    "max_feedrate_x": 300.0,
+    "max_feedrate_y": 300.0,
+    "max_feedrate_z": 40.0,
+    "max_feedrate_e": 4000.0,
+    "acceleration": 2000.0,
+    "max_acceleration_x": 9000.0,
+    "max_acceleration_y": 9000.0,
+    "max_acceleration_z": 800.0,
+    "max_acceleration_e": 10000.0,
+    "max_jerk_xy": 10.0,
+    "max_jerk_z": 0.4,
+    "max_jerk_e": 1.5
+}
+
+# seconds spent in the system macros the start and end g-code call
+MacroTimes = {
+    "probeauto.g": 150.0,
+    "wipe.g": 20.0
+}
+HomingTime = 10.0
+
+# heater model: everything starts at room temperature and heats or cools at
+# a constant rate in degrees per second
+AmbientTemperature = 25.0
+HeatingRates = {"bed": 0.5, "tool": 2.5}
+CoolingRates = {"bed": 0.05, "tool": 1.0}
+
+# the commands besides G0/G1 that affect the estimate
+CommandPattern = re.compile(r"^\s*([GMT])(\d+)\s*(.*?)\s*$")
+WordPattern = re.compile(r"([A-Z])\s*(-?\d*\.?\d+)")
+
+Axes = "XYZEF"
+
+# the comment Cura writes at the start of every layer
+LayerMarker = b";LAYER:"
+
+
+##  Predicts how long a Nautilus takes to run a G-code file.
+#
+#   Moves are pulled out of the text with array operations rather than a
+#   regex per line, then timed with a trapezoidal velocity profile under the
+#   firmware's feedrate, acceleration and jerk limits. Dwells, macros and
+#   heater waits are added from the few remaining commands.
+class NautilusAnalyzer:
+    def __init__(self, limits = None):
+        self._limits = dict(DefaultLimits)
+        self._limits.update({key: float(value) for key, value in (limits or {}).items() if value is not None})
+
+    ##  Analyze the g-code text and return a dict with the predicted
+    #   "duration" (seconds) split into "motion", "dwell", "macros" and
+    #   "heating", the net "filament" length (mm), the first "temperatures"
+    #   the bed and tool are heated to, "layers" as [layer, z, elapsed
+    #   seconds] where each layer starts, and "moves" and "lines".
+    def analyze(self, text):
+        buf = numpy.frombuffer(text.encode("utf-8", "replace") + b"\n", dtype = numpy.uint8)
+        ends = numpy.flatnonzero(buf == ord("\n"))
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+
+        motionLines, columns = self._extractMoves(buf, starts, ends)
+        commands = self._extractCommands(buf, starts, ends, motionLines)
+
+        # G92 rows join the moves so they reset the position at the right place
+        resets = [(line, words) for line, code, words in commands if code == "G92"]
+        resetLines = numpy.array([line for line, words in resets], dtype = numpy.int64)
+        order = numpy.argsort(numpy.concatenate((motionLines, resetLines)), kind = "mergesort")
+        lines = numpy.concatenate((motionLines, resetLines))[order]
+        isReset = numpy.concatenate((numpy.zeros(len(motionLines), dtype = bool), numpy.ones(len(resetLines), dtype = bool)))[order]
+        rows = {}
+        for axis in Axes:
+            # G92 sets positions, never the feedrate
+            resetValues = numpy.array([float(words[axis]) if axis in words and axis != "F" else numpy.nan for line, words in resets])
+            rows[axis] = numpy.concatenate((columns[axis], resetValues))[order]
+
+        relativeE = self._modeAt(lines, commands, {"M83": True, "M82": False, "G91": True, "G90": False}, False)
+        relativeXYZ = self._modeAt(lines, commands, {"G91": True, "G90": False}, False)
+
+        times, filament = self._motionTimes(rows, isReset, relativeE, relativeXYZ)
+        cumulative = numpy.concatenate(([0.0], numpy.cumsum(times)))
+        motion = float(cumulative[-1])
+
+        dwell, macros, heating, waits = self._commandTimes(commands, lines, cumulative)
+        return {
+            "duration": motion + dwell + macros + heating,
+            "motion": motion,
+            "dwell": dwell,
+            "macros": macros,
+            "heating": heating,
+            "filament": filament,
+            "temperatures": self._firstTargets(commands),
+            "layers": self._layerStarts(buf, starts, ends, lines, rows["Z"], cumulative, waits),
+            "moves": int(len(motionLines)),
+            "lines": int(len(starts))
+        }
+
+    def _extractMoves(self, buf, starts, ends):
+        # G0/G1 lines: 'G', '0' or '1', then a space, comment or line end
+        padded = numpy.concatenate((buf, numpy.frombuffer(b"\n\n\n", dtype = numpy.uint8)))
+        isMotion = (padded[starts] == ord("G")) & ((padded[starts + 1] == ord("0")) | (padded[starts + 1] == ord("1"))) \
+            & numpy.isin(padded[starts + 2], numpy.frombuffer(b" \n;\r\t", dtype = numpy.uint8))
+        motionLines = numpy.flatnonzero(isMotion)
+
+        # blank out comments on move lines, numbers in them aren't parameters
+        text = buf.copy()
+        semicolons = numpy.flatnonzero(text == ord(";"))
+        commented = numpy.searchsorted(starts, semicolons, "right") - 1
+        for semicolon, line in zip(semicolons, commented):
+            if isMotion[line]:
+                text[semicolon:ends[line]] = ord(" ")
+
+        # every run of number characters on a move line is one parameter, and
+        # belongs to the letter right before it
+        onMotion = numpy.repeat(isMotion, ends - starts + 1)
+        isNumber = onMotion & (((text - ord("0")) < 10) | (text == ord(".")) | (text == ord("-")))
+        runs = numpy.flatnonzero(isNumber[1:] & ~isNumber[:-1]) + 1
+        letters = text[runs - 1]
+        rows = numpy.searchsorted(motionLines, numpy.searchsorted(starts, runs, "right") - 1)
+        values = numpy.fromstring(numpy.where(isNumber, text, ord(" ")).tobytes().decode("ascii"), sep = " ")
+
+        columns = {}
+        for axis in Axes:
+            column = numpy.full(len(motionLines), numpy.nan)
+            mine = letters == ord(axis)
+            column[rows[mine]] = values[mine]
+            columns[axis] = column
+        return motionLines, columns
+
+    def _extractCommands(self, buf, starts, ends, motionLines):
+        # the handful of non-move commands are parsed line by line
+        first = buf[starts]
+        candidates = numpy.flatnonzero((first == ord("G")) | (first == ord("M")) | (first == ord("T")) | (first == ord(" ")) | (first == ord("\t")))
+        candidates = numpy.setdiff1d(candidates, motionLines, assume_unique = True)
+        commands = []
+        for line in candidates:
+            text = buf[starts[line]:ends[line]].tobytes().decode("utf-8", "replace").split(";", 1)[0]
+            match = CommandPattern.match(text)
+            if not match:
+                continue
+            code = match.group(1) + str(int(match.group(2)))
+            if code in ("G0", "G1"):
+                continue
+            words = dict(WordPattern.findall(match.group(3)))
+            if code == "M98":
+                words["P"] = match.group(3)[1:].strip().strip('"') if match.group(3).startswith("P") else ""
+            commands.append((int(line), code, words))
+        return commands
+
+    def _modeAt(self, lines, commands, modes, default):
+        # the positioning mode in effect at every row
+        changes = [(line, modes[code]) for line, code, words in commands if code in modes]
+        if not changes:
+            return numpy.full(len(lines), default)
+        changeLines = numpy.array([line for line, mode in changes])
+        values = numpy.array([default] + [mode for line, mode in changes])
+        return values[numpy.searchsorted(changeLines, lines)]
+
+    def _fill(self, values):
+        # carry the last given value forward over rows that don't set it
+        index = numpy.where(numpy.isnan(values), 0, numpy.arange(len(values)))
+        numpy.maximum.accumulate(index, out = index)
+        return values[index]
+
+    def _motionTimes(self, rows, isReset, relativeE, relativeXYZ):
+        count = len(isReset)
+        if count == 0:
+            return numpy.zeros(0), 0.0
+        limits = self._limits
+        deltas = []
+        for axis in "XYZ":
+            values = rows[axis]
+            absolute = numpy.where(relativeXYZ & ~isReset, numpy.nan, values)
+            delta = numpy.diff(numpy.concatenate(([numpy.nan], self._fill(absolute))))
+            delta = numpy.where(relativeXYZ & ~isReset, numpy.nan_to_num(values), numpy.nan_to_num(delta))
+            deltas.append(numpy.where(isReset, 0.0, delta))
+        values = rows["E"]
+        absolute = numpy.where(relativeE & ~isReset, numpy.nan, values)
+        delta = numpy.diff(numpy.concatenate(([numpy.nan], self._fill(absolute))))
+        # a move after a reset counts from the reset value, not the old position
+        delta = numpy.where(relativeE & ~isReset, numpy.nan_to_num(values), numpy.nan_to_num(delta))
+        de = numpy.where(isReset, 0.0, delta)
+        dx, dy, dz = deltas
+
+        length = numpy.sqrt(dx * dx + dy * dy + dz * dz)
+        extrudeOnly = length == 0
+        distance = numpy.where(extrudeOnly, numpy.abs(de), length)
+        moving = distance > 0
+        safe = numpy.where(moving, distance, 1.0)
+
+        feedrate = self._fill(rows["F"])
+        feedrate = numpy.where(numpy.isnan(feedrate), 3000.0, feedrate)
+        speed = feedrate / 60.0
+        acceleration = numpy.full(count, limits["acceleration"])
+        jerk = numpy.where(extrudeOnly, limits["max_jerk_e"], limits["max_jerk_xy"])
+        for d, axis in ((dx, "x"), (dy, "y"), (dz, "z"), (de, "e")):
+            share = numpy.abs(d) / safe
+            withAxis = share > 0
+            speed = numpy.where(withAxis, numpy.minimum(speed, limits["max_feedrate_" + axis] / numpy.where(withAxis, share, 1.0)), speed)
+            acceleration = numpy.where(withAxis, numpy.minimum(acceleration, limits["max_acceleration_" + axis] / numpy.where(withAxis, share, 1.0)), acceleration)
+        jerk = numpy.where(numpy.abs(dz) > 0, numpy.minimum(jerk, limits["max_jerk_z"] * safe / numpy.where(numpy.abs(dz) > 0, numpy.abs(dz), 1.0)), jerk)
+
+        # junction speeds: full speed straight on, the jerk limit when turning back
+        ux, uy, uz = (numpy.where(extrudeOnly, 0.0, d / safe) for d in (dx, dy, dz))
+        moveIndex = numpy.flatnonzero(moving)
+        entry = numpy.zeros(count)
+        exit = numpy.zeros(count)
+        if len(moveIndex) > 1:
+            a, b = moveIndex[:-1], moveIndex[1:]
+            cosine = ux[a] * ux[b] + uy[a] * uy[b] + uz[a] * uz[b]
+            slower = numpy.minimum(speed[a], speed[b])
+            junction = numpy.minimum(slower, numpy.maximum(numpy.minimum(jerk[a], jerk[b]), slower * numpy.clip(cosine, 0.0, 1.0)))
+            exit[a] = junction
+            entry[b] = junction
+
+        # per move trapezoid: accelerate from entry, cruise, decelerate to exit
+        d = distance
+        entry = numpy.minimum(entry, numpy.sqrt(exit * exit + 2 * acceleration * d))
+        exit = numpy.minimum(exit, numpy.sqrt(entry * entry + 2 * acceleration * d))
+        peak = numpy.minimum(speed, numpy.sqrt((2 * acceleration * d + entry * entry + exit * exit) / 2))
+        peak = numpy.maximum(peak, numpy.maximum(entry, exit))
+        accelerating = (peak * peak - entry * entry) / (2 * acceleration)
+        decelerating = (peak * peak - exit * exit) / (2 * acceleration)
+        cruising = numpy.maximum(d - accelerating - decelerating, 0.0)
+        times = (peak - entry) / acceleration + (peak - exit) / acceleration + cruising / numpy.where(peak > 0, peak, 1.0)
+        times = numpy.where(moving, times, 0.0)
+        return times, max(float(numpy.sum(de)), 0.0)
+
+    def _layerStarts(self, buf, starts, ends, lines, z, cumulative, waits):
+        last = len(buf) - 1
+        isLayer = numpy.ones(len(starts), dtype = bool)
+        for offset, character in enumerate(LayerMarker):
+            isLayer &= buf[numpy.minimum(starts + offset, last)] == character
+        layerLines = numpy.flatnonzero(isLayer)
+
+        # a layer's height is where the first move after its marker goes,
+        # Cura always writes absolute Z
+        heights = self._fill(z)
+        firstRows = numpy.searchsorted(lines, layerLines)
+        waitLines, waitTimes = waits
+        waited = numpy.concatenate(([0.0], waitTimes))[numpy.searchsorted(waitLines, layerLines)]
+        layers = []
+        for line, row, extra in zip(layerLines, firstRows, waited):
+            try:
+                number = int(buf[starts[line] + len(LayerMarker):ends[line]].tobytes().decode("ascii", "replace").split(";")[0])
+            except ValueError:
+                continue
+            height = float(heights[row]) if row < len(heights) and not numpy.isnan(heights[row]) else None
+            layers.append([number, height, float(cumulative[row]) + float(extra)])
+        return layers
+
+    def _firstTargets(self, commands):
+        targets = {"bed": None, "tool": None}
+        for line, code, words in commands:
+            heater = {"M104": "tool", "M109": "tool", "M140": "bed", "M190": "bed"}.get(code)
+            if heater and targets[heater] is None and float(words.get("S", 0)) > 0:
+                targets[heater] = float(words["S"])
+        return targets
+
+    # dwell, macro and heating seconds, and the (lines, seconds) where those
+    # times add up, so a line's elapsed time can include the waits before it
+    def _commandTimes(self, commands, lines, cumulative):
+        dwell = macros = heating = 0.0
+        waitLines = []
+        waitTimes = []
+        heaters = {name: {"temperature": AmbientTemperature, "since": 0.0, "target": AmbientTemperature} for name in HeatingRates}
+
+        def temperatureAt(heater, now):
+            state = heaters[heater]
+            change = state["target"] - state["temperature"]
+            rate = HeatingRates[heater] if change > 0 else CoolingRates[heater]
+            reached = abs(change) <= rate * (now - state["since"])
+            return state["target"] if reached else state["temperature"] + rate * (now - state["since"]) * (1 if change > 0 else -1)
+
+        def setTarget(heater, target, now):
+            heaters[heater]["temperature"] = temperatureAt(heater, now)
+            heaters[heater]["since"] = now
+            heaters[heater]["target"] = target
+
+        def waitFor(heater, now):
+            state = heaters[heater]
+            current = temperatureAt(heater, now)
+            change = state["target"] - current
+            rate = HeatingRates[heater] if change > 0 else CoolingRates[heater]
+            # heaters that are switched off aren't waited for
+            if state["target"] <= AmbientTemperature:
+                return 0.0
+            return abs(change) / rate
+
+        for line, code, words in commands:
+            # everything before this command, including earlier waits
+            now = float(cumulative[numpy.searchsorted(lines, line)]) + dwell + macros + heating
+            heater = {"M104": "tool", "M109": "tool", "M140": "bed", "M190": "bed"}.get(code)
+            if heater:
+                target = words.get("S", words.get("R"))
+                if target is not None:
+                    setTarget(heater, max(float(target), AmbientTemperature), now)
+                if code in ("M109", "M190"):
+                    heating += waitFor(heater, now)
+            elif code == "M116":
+                heating += max(waitFor(name, now) for name in heaters)
+            elif code == "G4":
+                dwell += float(words.get("S", 0)) + float(words.get("P", 0)) / 1000.0
+            elif code == "G28":
+                macros += HomingTime
+            elif code == "M98":
+                macros += MacroTimes.get(os.path.basename(words.get("P", "")), 0.0)
+            else:
+                continue
+            waitLines.append(line)
+            waitTimes.append(dwell + macros + heating)
+        return dwell, macros, heating, (numpy.array(waitLines, dtype = numpy.int64), numpy.array(waitTimes))
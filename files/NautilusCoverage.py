@@ -0,0 +1,89 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import json
+import os
+
+from UM.Logger import Logger
+
+# releaser.py writes the coverage table into Nautilus.zip under this name
+CoverageIndex = "nautilus_coverage.json"
+
+
+##  Which material, tool cartridge, quality type and intent combinations the
+#   shipped profiles cover.
+#
+#   The table is precomputed at release time and read from Nautilus.zip once,
+#   so lookups never have to look at profile file names or metadata.
+class NautilusCoverage:
+    __instance = None
+
+    def __init__(self, zipdata = None):
+        if zipdata is None:
+            zipdata = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Nautilus.zip")
+        self._zipdata = zipdata
+        self._coverage = None
+
+    @classmethod
+    def getInstance(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def _load(self):
+        if self._coverage is None:
+            import zipfile
+            self._coverage = {"global": {}, "profiles": {}}
+            try:
+                with zipfile.ZipFile(self._zipdata, "r") as zip_ref:
+                    self._coverage = json.loads(zip_ref.read(CoverageIndex).decode("utf-8"))
+            except KeyError:
+                Logger.log("w", "Nautilus.zip has no profile coverage table")
+            except (OSError, ValueError, zipfile.BadZipFile):
+                Logger.logException("w", "Unable to read the Nautilus profile coverage table")
+        return self._coverage
+
+    ##  Whether the archive had a coverage table to read.
+    def isAvailable(self):
+        return bool(self._load()["profiles"])
+
+    ##  The archive member holding the profile for this combination, or None.
+    def getProfile(self, material, variant, quality_type, intent = "default"):
+        return self._load()["profiles"].get(material, {}).get(variant, {}).get(quality_type, {}).get(intent)
+
+    def isSupported(self, material, variant, quality_type, intent = "default"):
+        return self.getProfile(material, variant, quality_type, intent) is not None
+
+    ##  Quality types with a profile for this material on this cartridge.
+    def getQualityTypes(self, material, variant):
+        return sorted(self._load()["profiles"].get(material, {}).get(variant, {}))
+
+    ##  Materials and tool cartridges that have at least one profile.
+    def getMaterials(self):
+        return sorted(self._load()["profiles"])
+
+    def getVariants(self):
+        return sorted({variant for variants in self._load()["profiles"].values() for variant in variants})
+
+    ##  Base names (no extension) of every shipped profile of one kind,
+    #   "quality" or "intent", as Upgrader compares them with installed files.
+    def getProfileNames(self, kind):
+        names = set()
+        for variants in self._load()["profiles"].values():
+            for qualities in variants.values():
+                for intents in qualities.values():
+                    for intent, member in intents.items():
+                        if (intent == "default") == (kind == "quality"):
+                            names.add(os.path.basename(member).split('.', 1)[0])
+        if kind == "quality":
+            names.update(os.path.basename(member).split('.', 1)[0] for member in self._load()["global"].values())
+        return names
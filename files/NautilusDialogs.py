@@ -0,0 +1,99 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import os
+
+from PyQt5.QtCore import QObject, QUrl
+from PyQt5.QtQml import QQmlComponent, QQmlContext
+
+from UM.Logger import Logger
+
+from cura.CuraApplication import CuraApplication
+
+
+##  Shared factory for the plugin's QML dialogs.
+#
+#   Components are compiled once, asynchronously when precompile() is called
+#   after startup, and every dialog instance is kept and handed out again the
+#   next time the same manager asks for it. Callers reset whatever state the
+#   dialog shows before showing it again.
+class NautilusDialogs(QObject):
+    __instance = None
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self._qmlPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "qml")
+        self._components = {}
+        # (qml, manager) -> (dialog, context); the context has to outlive the dialog
+        self._dialogs = {}
+
+    @classmethod
+    def getInstance(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def _engine(self):
+        # Uranium has no public accessor for its engine, every plugin that builds
+        # components itself reads it from here
+        return CuraApplication.getInstance()._qml_engine
+
+    ##  Start compiling components in the background, so the first dialog
+    #   doesn't have to wait for it.
+    def precompile(self, names):
+        for name in names:
+            if name not in self._components:
+                component = QQmlComponent(self._engine(), self)
+                component.loadUrl(QUrl.fromLocalFile(os.path.join(self._qmlPath, name)), QQmlComponent.Asynchronous)
+                self._components[name] = component
+
+    def _component(self, name):
+        component = self._components.get(name)
+        if component is None or component.isLoading():
+            # not asked for in advance, or still compiling: compile it now
+            component = QQmlComponent(self._engine(), QUrl.fromLocalFile(os.path.join(self._qmlPath, name)), self)
+            self._components[name] = component
+        return component
+
+    ##  The dialog built from qml for this manager, created on first use.
+    #
+    #   setup(dialog) runs once, right after the dialog is created, and is the
+    #   place to connect signals and look up child items.
+    def getDialog(self, name, manager, setup = None):
+        key = (name, manager)
+        if key in self._dialogs:
+            return self._dialogs[key][0]
+
+        component = self._component(name)
+        if component.isError():
+            for error in component.errors():
+                Logger.log("e", "Nautilus dialog {}: {}".format(name, error.toString()))
+            del self._components[name]
+            return None
+        context = QQmlContext(self._engine().rootContext())
+        context.setContextProperty("manager", manager)
+        dialog = component.create(context)
+        if dialog is None:
+            Logger.log("e", "Unable to create Nautilus dialog " + name)
+            return None
+        self._dialogs[key] = (dialog, context)
+        if setup:
+            setup(dialog)
+        return dialog
+
+    ##  Hide and forget every dialog created for manager, e.g. when a printer
+    #   is removed.
+    def releaseDialogs(self, manager):
+        for key in [key for key in self._dialogs if key[1] is manager]:
+            dialog, context = self._dialogs.pop(key)
+            dialog.setProperty("visible", False)
+            dialog.deleteLater()
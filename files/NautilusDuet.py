@@ -16,21 +16,25 @@
 
 import re
 import os.path
-import json
-from distutils.version import StrictVersion
+import time
 
-from PyQt5.QtCore import QObject, QUrl, QTimer, pyqtProperty, pyqtSignal, pyqtSlot
-from PyQt5.QtQml import QQmlComponent, QQmlContext
+from PyQt5.QtCore import QObject, pyqtProperty, pyqtSignal, pyqtSlot
 
 from UM.Message import Message
 from UM.Logger import Logger
 
 from UM.Resources import Resources
+from UM.Version import Version
 from UM.Extension import Extension
 from UM.PluginRegistry import PluginRegistry
 from UM.OutputDevice.OutputDevicePlugin import OutputDevicePlugin
 
 from . import NautilusOutputDevice
+from .NautilusDialogs import NautilusDialogs
+from .NautilusInstances import NautilusInstance, NautilusInstances
+from .NautilusJobCache import NautilusJobCache
+from .NautilusPrinterModel import NautilusPrinterModel
+from .NautilusStatus import NautilusStatusPoller
 from UM.i18n import i18nCatalog
 catalog = i18nCatalog("cura")
 
@@ -39,62 +43,172 @@ from cura.MachineAction import MachineAction
 
 
 class NautilusDuet(MachineAction, QObject, Extension, OutputDevicePlugin):
+    # the output devices every saved printer gets
+    DeviceTypes = [NautilusOutputDevice.DeviceType.print, NautilusOutputDevice.DeviceType.simulate, NautilusOutputDevice.DeviceType.upload]
+
+    __instance = None
+
     def __init__(self, parent=None):
         super().__init__("NautilusConnections", catalog.i18nc("@action", "Connect via Network"))
+        NautilusDuet.__instance = self
 
         self._qml_url = os.path.join(Resources.getStoragePath(Resources.Resources), "plugins","Nautilus","Nautilus",'qml','NautilusAction.qml')
-        self._dialogs = {}
-        self._dialogView = None
 
-        CuraApplication.getInstance().getPreferences().addPreference("Nautilus/instances", json.dumps({}))
-        self._instances = json.loads(CuraApplication.getInstance().getPreferences().getValue("Nautilus/instances"))
-        Logger.log('d','bigmoney')
+        # output devices are long lived, keyed by instance name together with
+        # the settings they were built from so a machine switch only touches
+        # the printers that actually changed
+        self._devices = {}
+        self._deviceConfigs = {}
+        self._active = False
+
+        self._registry = NautilusInstances.getInstance()
+        self._registry.instanceAdded.connect(self._onInstancesChanged)
+        self._registry.instanceChanged.connect(self._onInstancesChanged)
+        self._registry.instanceRemoved.connect(self._onInstancesChanged)
+
+        # keys of the jobs listed in recentJobs, in the same order
+        self._recentKeys = []
+        NautilusJobCache.getInstance().jobsChanged.connect(self.recentJobsChanged)
 
+        # the farm queue and its output device pull in the upload pipeline,
+        # they are built on first use rather than while Cura loads the plugin
+        self._queueDevice = None
+
+    @classmethod
+    def getInstance(cls):
+        return cls.__instance
 
     def start(self):
-        manager = self.getOutputDeviceManager()
-        for name, instance in self._instances.items():
-            manager.addOutputDevice(NautilusOutputDevice.NautilusOutputDevice(name, instance["url"], instance["duet_password"], instance["http_user"], instance["http_password"], instance["firmware_version"], device_type=NautilusOutputDevice.DeviceType.upload))
-            #QTimer.singleShot(15000, NautilusOutputDevice.NautilusOutputDevice(name, instance["url"], instance["duet_password"], instance["http_user"], instance["http_password"], device_type=NautilusOutputDevice.DeviceType.upload).updateCheck)
+        self._active = True
+        self._syncOutputDevices()
+        NautilusStatusPoller.getInstance().start()
+        from .NautilusQueue import NautilusQueue
+        NautilusQueue.getInstance().start(self._getPrintDevice)
 
     def stop(self):
+        self._active = False
+        self._syncOutputDevices()
+        NautilusStatusPoller.getInstance().stop()
+        from .NautilusQueue import NautilusQueue
+        NautilusQueue.getInstance().stop()
+
+    ##  Bring the registered output devices in line with the saved instances,
+    #   adding or removing only the difference. Devices are kept around while
+    #   another machine is active so switching back doesn't rebuild them.
+    def _syncOutputDevices(self):
         manager = self.getOutputDeviceManager()
-        for name in self._instances.keys():
-            manager.removeOutputDevice(name + "-upload")
 
-    def _createDialog(self, qml):
-        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),'qml', qml)
-        dialog = CuraApplication.getInstance().createQmlComponent(path, {"manager": self})
-        return dialog
+        for name in list(self._devices.keys()):
+            printer = self._registry.getPrinter(name)
+            if printer is None or self._deviceConfigs[name] != self._connectionConfig(printer):
+                devices = self._devices.pop(name)
+                del self._deviceConfigs[name]
+                for device in devices.values():
+                    NautilusDialogs.getInstance().releaseDialogs(device)
+                    if manager.getOutputDevice(device.getId()):
+                        manager.removeOutputDevice(device.getId())
+
+        for name in self._registry.getNames():
+            for deviceType in self.DeviceTypes:
+                device = self._getDevice(name, deviceType)
+                registered = manager.getOutputDevice(device.getId()) is not None
+                if self._active and not registered:
+                    manager.addOutputDevice(device)
+                elif not self._active and registered:
+                    manager.removeOutputDevice(device.getId())
+
+        # the farm queue is offered while there is a printer to dispatch to
+        wanted = self._active and bool(self._registry.getNames())
+        if wanted and self._queueDevice is None:
+            from .NautilusQueueDevice import NautilusQueueDevice
+            self._queueDevice = NautilusQueueDevice()
+        if self._queueDevice is None:
+            return
+        registered = manager.getOutputDevice(self._queueDevice.getId()) is not None
+        if wanted and not registered:
+            manager.addOutputDevice(self._queueDevice)
+        elif not wanted and registered:
+            manager.removeOutputDevice(self._queueDevice.getId())
+
+    # the firmware version is bookkeeping only, a device doesn't need to be
+    # rebuilt when an update check records a new one
+    def _connectionConfig(self, printer):
+        return (printer.url, printer.duet_password, printer.http_user, printer.http_password)
+
+    ##  Return the shared output device of one type for an instance, building
+    #   the instance's devices the first time one is asked for.
+    def _getDevice(self, name, deviceType = NautilusOutputDevice.DeviceType.upload):
+        if name not in self._devices:
+            printer = self._registry.getPrinter(name)
+            self._devices[name] = {deviceType: NautilusOutputDevice.NautilusOutputDevice(name, printer.url, printer.duet_password, printer.http_user, printer.http_password, printer.firmware_version, device_type=deviceType)
+                                   for deviceType in self.DeviceTypes}
+            self._deviceConfigs[name] = self._connectionConfig(printer)
+            from .NautilusQueue import NautilusQueue
+            NautilusQueue.getInstance().watch(self._devices[name][NautilusOutputDevice.DeviceType.print])
+        return self._devices[name][deviceType]
+
+    def _getPrintDevice(self, name):
+        return self._getDevice(name, NautilusOutputDevice.DeviceType.print)
+
+    def _onInstancesChanged(self, name):
+        self._syncOutputDevices()
+        self.serverListChanged.emit()
 
     def _showDialog(self, qml):
-        if not qml in self._dialogs:
-            self._dialogs[qml] = self._createDialog(qml)
-        self._dialogs[qml].show()
+        dialog = NautilusDialogs.getInstance().getDialog(qml, self)
+        if dialog:
+            dialog.show()
 
     def showSettingsDialog(self):
         self._showDialog("NautilusDuet.qml")
 
+    def showQueueDialog(self):
+        from .NautilusQueue import NautilusQueue
+        dialog = NautilusDialogs.getInstance().getDialog("NautilusQueue.qml", NautilusQueue.getInstance())
+        if dialog:
+            dialog.show()
+
     def statusCheck(self, name):
-        if name in self._instances.keys():
-            return NautilusOutputDevice.NautilusOutputDevice(name, self._instances[name]["url"], self._instances[name]["duet_password"], self._instances[name]["http_user"], self._instances[name]["http_password"], self._instances[name]["firmware_version"], device_type=NautilusOutputDevice.DeviceType.upload).checkPrinterStatus()
+        if self._registry.hasPrinter(name):
+            return NautilusStatusPoller.getInstance().isConnected(name)
 
     serverListChanged = pyqtSignal()
     @pyqtProperty("QVariantList", notify=serverListChanged)
     def serverList(self):
-        return list(self._instances.keys())
+        return self._registry.getNames()
+
+    recentJobsChanged = pyqtSignal()
+    @pyqtProperty("QVariantList", notify=recentJobsChanged)
+    def recentJobs(self):
+        jobs = NautilusJobCache.getInstance().recentJobs()
+        self._recentKeys = [key for key, entry in jobs]
+        return ["{} ({}, {:.1f} MB)".format(entry["name"], time.strftime("%b %d %H:%M", time.localtime(entry["stored"])), entry["size"] / 1000000.0)
+                for key, entry in jobs]
+
+    ##  Send one of recentJobs, by its index, to a printer straight from the cache.
+    @pyqtSlot(str, int)
+    def resendJob(self, name, index):
+        if not self._registry.hasPrinter(name) or not 0 <= index < len(self._recentKeys):
+            return
+        if not self._getDevice(name).sendCachedJob(self._recentKeys[index]):
+            message = Message(catalog.i18nc("@info:status", "Unable to resend the job to {}, the printer is busy or the job is no longer cached.").format(name))
+            message.show()
+
+    @pyqtProperty(QObject, constant=True)
+    def printerModel(self):
+        return NautilusPrinterModel.getInstance()
 
     @pyqtSlot(str)
     def updateButton(self, name):
         Logger.log('i','we go!')
-        if name in self._instances.keys():
-            NautilusOutputDevice.NautilusOutputDevice(name, self._instances[name]["url"], self._instances[name]["duet_password"], self._instances[name]["http_user"], self._instances[name]["http_password"], self._instances[name]["firmware_version"], device_type=NautilusOutputDevice.DeviceType.upload).beginUpdate(None, None)
+        if self._registry.hasPrinter(name):
+            self._getDevice(name).beginUpdate(None, None)
         return None
 
     @pyqtSlot(str)
     def updateFirmwareCheck(self,name):
-        if name in self._instances.keys():
-            NautilusOutputDevice.NautilusOutputDevice(name, self._instances[name]["url"], self._instances[name]["duet_password"], self._instances[name]["http_user"], self._instances[name]["http_password"], self._instances[name]["firmware_version"], device_type=NautilusOutputDevice.DeviceType.upload).updateCheck()
+        if self._registry.hasPrinter(name):
+            self._getDevice(name).updateCheck()
         else:
             message = Message(catalog.i18nc("@info:status", "Error finding \"{}\" to update firmware").format(name))
             message.show()
@@ -103,62 +217,53 @@ class NautilusDuet(MachineAction, QObject, Extension, OutputDevicePlugin):
 
     @pyqtSlot(str, result=str)
     def instanceUrl(self, name):
-        if name in self._instances.keys():
-            return self._instances[name]["url"]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            return printer.url
         return None
 
     @pyqtSlot(str, result=str)
     def instanceDuetPassword(self, name):
-        if name in self._instances.keys():
-            return self._instances[name]["duet_password"]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            return printer.duet_password
         return None
 
     @pyqtSlot(str, result=str)
     def instanceHTTPUser(self, name):
-        if name in self._instances.keys():
-            return self._instances[name]["http_user"]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            return printer.http_user
         return None
 
     @pyqtSlot(str, result=str)
     def instanceHTTPPassword(self, name):
-        if name in self._instances.keys():
-            return self._instances[name]["http_password"]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            return printer.http_password
         return None
 
     @pyqtSlot(str, result=str)
     def instanceFirmwareVersion(self, name):
-        if name in self._instances.keys():
-            return self._instances[name]["firmware_version"]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            return printer.firmware_version
 
     @pyqtSlot(str, str, str, str, str, str, str)
     def saveInstance(self, oldName, name, url, duet_password, http_user, http_password, firmware_version):
-        if oldName:
-            # this is a edit operation, delete the old instance before saving the new one
+        if oldName and oldName != name:
+            # this is a rename, delete the old instance before saving the new one
             self.removeInstance(oldName)
 
         if not url.endswith('/'):
             url += '/'
 
-        self._instances[name] = {
-            "url": url,
-            "duet_password": duet_password,
-            "http_user": http_user,
-            "http_password": http_password,
-            "firmware_version": firmware_version
-        }
-        manager = self.getOutputDeviceManager()
-        manager.addOutputDevice(NautilusOutputDevice.NautilusOutputDevice(name, url, duet_password, http_user, http_password, firmware_version, device_type=NautilusOutputDevice.DeviceType.upload))
-        CuraApplication.getInstance().getPreferences().setValue("Nautilus/instances", json.dumps(self._instances))
-        self.serverListChanged.emit()
+        self._registry.setPrinter(NautilusInstance(name, url, duet_password, http_user, http_password, firmware_version))
         Logger.log("d", "Instance saved: " + name)
 
     @pyqtSlot(str)
     def removeInstance(self, name):
-        manager = self.getOutputDeviceManager()
-        manager.removeOutputDevice(name + "-upload")
-        del self._instances[name]
-        CuraApplication.getInstance().getPreferences().setValue("Nautilus/instances", json.dumps(self._instances))
-        self.serverListChanged.emit()
+        self._registry.removePrinter(name)
         Logger.log("d", "Instance removed: " + name)
 
     @pyqtSlot(str, str, result = bool)
@@ -171,7 +276,7 @@ class NautilusDuet(MachineAction, QObject, Extension, OutputDevicePlugin):
             return True
 
         # duplicates not allowed
-        return (not newName in self._instances.keys())
+        return (not self._registry.hasPrinter(newName))
 
     @pyqtSlot(str, str, result = bool)
     def validUrl(self, oldName, newUrl):
@@ -189,10 +294,10 @@ class NautilusDuet(MachineAction, QObject, Extension, OutputDevicePlugin):
 
     @pyqtSlot(str, result = str)
     def needsUpdate(self, name):
-        if name in self._instances.keys():
+        if self._registry.hasPrinter(name):
             Logger.log('i','returning: '+str(name))
             firmVersion = CuraApplication.getInstance().getPreferences().getValue("Nautilus/configversion")
-            if StrictVersion(self._instances[name]["firmware_version"])<StrictVersion(firmVersion):
+            if Version(self._registry.getPrinter(name).firmware_version)<Version(firmVersion):
                 return "Version "+firmVersion+" available!"
             else:
                 return "Up-to-Date"
@@ -0,0 +1,97 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import datetime
+import json
+import zlib
+
+from UM.Logger import Logger
+
+from cura.CuraApplication import CuraApplication
+
+from .NautilusInstances import NautilusInstances
+
+
+##  Size and CRC32 of a file's bytes, as stored in the fingerprint cache.
+def fingerprint(data):
+    return {"size": len(data), "crc32": zlib.crc32(data) & 0xffffffff}
+
+
+##  Whether the modification time rr_fileinfo reports matches the one a
+#   record holds. The SD card is FAT, which keeps times to 2 seconds, so
+#   an upload stamped with an odd second comes back a second off.
+def sameModifiedTime(recorded, reported):
+    try:
+        recorded, reported = [datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S") for value in (recorded, reported)]
+    except (TypeError, ValueError):
+        return False
+    return abs((recorded - reported).total_seconds()) <= 2
+
+
+##  Remembers what was uploaded to every printer, so a file the printer
+#   already holds isn't sent again.
+#
+#   RepRapFirmware can't checksum a file for us, so each record also keeps
+#   the modification time the upload set. A record is only trusted while
+#   rr_fileinfo still reports that time (see sameModifiedTime) and the same
+#   size for the file.
+class NautilusFingerprints:
+    # records kept per printer, the oldest are dropped first
+    MaxFiles = 100
+
+    __instance = None
+
+    def __init__(self):
+        self._preferences = CuraApplication.getInstance().getPreferences()
+        self._preferences.addPreference("Nautilus/upload_fingerprints", "{}")
+        try:
+            self._records = json.loads(self._preferences.getValue("Nautilus/upload_fingerprints"))
+        except ValueError:
+            Logger.logException("w", "Nautilus/upload_fingerprints preference is not valid JSON, starting empty")
+            self._records = {}
+        NautilusInstances.getInstance().instanceRemoved.connect(self.forgetPrinter)
+
+    @classmethod
+    def getInstance(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def _persist(self):
+        self._preferences.setValue("Nautilus/upload_fingerprints", json.dumps(self._records))
+
+    def getRecord(self, printer, path):
+        return self._records.get(printer, {}).get(path)
+
+    ##  Paths on the printer that were uploaded with these bytes, the wanted
+    #   path first if it is one of them.
+    def findCopies(self, printer, print_fingerprint, path):
+        copies = [name for name, record in self._records.get(printer, {}).items()
+                  if record["size"] == print_fingerprint["size"] and record["crc32"] == print_fingerprint["crc32"]]
+        return sorted(copies, key=lambda name: name != path)
+
+    def record(self, printer, path, print_fingerprint, lastModified):
+        records = self._records.setdefault(printer, {})
+        # re-inserting keeps the dict ordered from oldest to newest
+        records.pop(path, None)
+        records[path] = dict(print_fingerprint, lastModified=lastModified)
+        while len(records) > self.MaxFiles:
+            del records[next(iter(records))]
+        self._persist()
+
+    def forget(self, printer, path):
+        if self._records.get(printer, {}).pop(path, None) is not None:
+            self._persist()
+
+    def forgetPrinter(self, printer):
+        if self._records.pop(printer, None) is not None:
+            self._persist()
@@ -0,0 +1,140 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import json
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from UM.Logger import Logger
+
+from cura.CuraApplication import CuraApplication
+
+
+##  One saved Nautilus connection, as stored in the Nautilus/instances preference.
+class NautilusInstance:
+    def __init__(self, name, url, duet_password="", http_user="", http_password="", firmware_version="1.0"):
+        self.name = name
+        self.url = url
+        self.duet_password = duet_password
+        self.http_user = http_user
+        self.http_password = http_password
+        self.firmware_version = firmware_version
+
+    @classmethod
+    def fromDict(cls, name, data):
+        return cls(name, data["url"], data.get("duet_password", ""), data.get("http_user", ""), data.get("http_password", ""), data.get("firmware_version", "1.0"))
+
+    def toDict(self):
+        return {
+            "url": self.url,
+            "duet_password": self.duet_password,
+            "http_user": self.http_user,
+            "http_password": self.http_password,
+            "firmware_version": self.firmware_version
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, NautilusInstance) and self.name == other.name and self.toDict() == other.toDict()
+
+
+##  Process-wide owner of the saved Nautilus connections.
+#
+#   The preference is parsed once, lookups are served from memory and edits
+#   are written back at most once per debounce window.
+class NautilusInstances(QObject):
+    instanceAdded = pyqtSignal(str)
+    instanceChanged = pyqtSignal(str)
+    instanceRemoved = pyqtSignal(str)
+
+    # milliseconds to wait for more edits before writing the preference
+    PersistDelay = 500
+
+    __instance = None
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self._preferences = CuraApplication.getInstance().getPreferences()
+        self._preferences.addPreference("Nautilus/instances", json.dumps({}))
+
+        self._printers = {}
+        try:
+            stored = json.loads(self._preferences.getValue("Nautilus/instances"))
+        except ValueError:
+            Logger.logException("w", "Nautilus/instances preference is not valid JSON, starting empty")
+            stored = {}
+        for name, data in stored.items():
+            self._printers[name] = NautilusInstance.fromDict(name, data)
+        self._names = list(self._printers.keys())
+
+        self._persistTimer = QTimer()
+        self._persistTimer.setSingleShot(True)
+        self._persistTimer.setInterval(self.PersistDelay)
+        self._persistTimer.timeout.connect(self.flush)
+        CuraApplication.getInstance().applicationShuttingDown.connect(self.flush)
+
+    @classmethod
+    def getInstance(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def getNames(self):
+        return self._names
+
+    def hasPrinter(self, name):
+        return name in self._printers
+
+    def getPrinter(self, name):
+        return self._printers.get(name)
+
+    def getPrinters(self):
+        return [self._printers[name] for name in self._names]
+
+    ##  Add a printer or replace the record stored under the same name.
+    def setPrinter(self, printer):
+        existing = self._printers.get(printer.name)
+        if existing == printer:
+            return
+        self._printers[printer.name] = printer
+        if existing is None:
+            self._names = self._names + [printer.name]
+            self.instanceAdded.emit(printer.name)
+        else:
+            self.instanceChanged.emit(printer.name)
+        self._schedulePersist()
+
+    def setFirmwareVersion(self, name, firmware_version):
+        printer = self._printers.get(name)
+        if printer is None or printer.firmware_version == firmware_version:
+            return
+        printer.firmware_version = firmware_version
+        self.instanceChanged.emit(name)
+        self._schedulePersist()
+
+    def removePrinter(self, name):
+        if name not in self._printers:
+            return
+        del self._printers[name]
+        self._names = [n for n in self._names if n != name]
+        self.instanceRemoved.emit(name)
+        self._schedulePersist()
+
+    def _schedulePersist(self):
+        self._persistTimer.start()
+
+    ##  Write pending edits to the preference right away.
+    def flush(self):
+        self._persistTimer.stop()
+        data = json.dumps({name: self._printers[name].toDict() for name in self._names})
+        if data != self._preferences.getValue("Nautilus/instances"):
+            self._preferences.setValue("Nautilus/instances", data)
+            Logger.log("d", "Saved {} Nautilus instances".format(len(self._names)))
@@ -0,0 +1,200 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from UM.Logger import Logger
+from UM.Resources import Resources
+from UM.Settings.ContainerRegistry import ContainerRegistry
+from UM.Scene.Iterator.DepthFirstIterator import DepthFirstIterator
+
+from cura.CuraApplication import CuraApplication
+
+from . import Nautilus
+from .NautilusLayerIndex import Suffix
+
+
+##  Keeps the g-code of recent uploads on disk, so the same job can go to
+#   another printer without serializing or slicing it again.
+#
+#   Jobs are keyed by a hash of the scene and the settings they were sliced
+#   with. The cache holds at most Nautilus/job_cache_mb megabytes and drops
+#   the least recently used jobs first, never pinned ones. store() is called
+#   from the upload job's thread, everything that touches the index holds
+#   the lock.
+class NautilusJobCache(QObject):
+    jobsChanged = pyqtSignal()
+
+    IndexName = "index.json"
+
+    __instance = None
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self._preferences = CuraApplication.getInstance().getPreferences()
+        self._preferences.addPreference("Nautilus/job_cache_mb", 512)
+        self._path = os.path.join(Resources.getCacheStoragePath(), "nautilus_jobs")
+        self._lock = threading.Lock()
+        # content hashes of read-only containers, they can't change while Cura runs
+        self._readOnlyHashes = {}
+        self._index = {}
+        try:
+            with open(os.path.join(self._path, self.IndexName), "r") as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            Logger.logException("w", "Nautilus job cache index is unreadable, starting empty")
+        # forget entries whose file was cleaned up behind our back
+        self._index = {key: entry for key, entry in self._index.items() if os.path.exists(self._file(key))}
+
+    @classmethod
+    def getInstance(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def _file(self, key):
+        return os.path.join(self._path, key + ".gcode")
+
+    def _sidecar(self, key):
+        return os.path.join(self._path, key + Suffix)
+
+    ##  Hash of everything the current job's g-code depends on: the meshes
+    #   and where they are, per object settings, the contents of every
+    #   container on the machine and extruder stacks, the Cura and plugin
+    #   versions and the upload settings in extra. Call this on the main thread.
+    def jobKey(self, extra):
+        hasher = hashlib.sha256()
+        application = CuraApplication.getInstance()
+        hasher.update("{} {}".format(application.getVersion(), Nautilus.Nautilus.version).encode())
+        for node in DepthFirstIterator(application.getController().getScene().getRoot()):
+            if not node.callDecoration("isSliceable") or node.getMeshData() is None:
+                continue
+            vertices = node.getMeshData().getVertices()
+            if vertices is not None:
+                hasher.update(vertices.tobytes())
+            hasher.update(node.getWorldTransformation().getData().tobytes())
+            stack = node.callDecoration("getStack")
+            if stack:
+                hasher.update(stack.getTop().serialize().encode())
+        global_stack = application.getGlobalContainerStack()
+        for stack in [global_stack] + list(global_stack.extruderList):
+            for container in stack.getContainers():
+                # by content, a quality_changes or material edited in place keeps its id
+                hasher.update(container.getId().encode())
+                hasher.update(self._containerHash(container))
+        hasher.update(json.dumps(extra, sort_keys=True).encode())
+        return hasher.hexdigest()[:32]
+
+    def _containerHash(self, container):
+        readOnly = ContainerRegistry.getInstance().isReadOnly(container.getId())
+        if readOnly and container.getId() in self._readOnlyHashes:
+            return self._readOnlyHashes[container.getId()]
+        digest = hashlib.sha256(container.serialize().encode()).digest()
+        if readOnly:
+            self._readOnlyHashes[container.getId()] = digest
+        return digest
+
+    ##  The cached entry for key, or None. Looking a job up counts as using it.
+    def lookup(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or not os.path.exists(self._file(key)):
+                return None
+            entry["used"] = time.time()
+            self._saveIndex()
+            return dict(entry)
+
+    def read(self, key):
+        with open(self._file(key), "rb") as f:
+            return f.read()
+
+    ##  The job's layer index sidecar, or None if it was cached without one.
+    def readLayerIndex(self, key):
+        try:
+            with open(self._sidecar(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    ##  Add or refresh a job, then evict until the cache fits its cap.
+    def store(self, key, name, data, metadata, layerIndex = None):
+        with self._lock:
+            os.makedirs(self._path, exist_ok = True)
+            partial = self._file(key) + ".partial"
+            with open(partial, "wb") as f:
+                f.write(data)
+            os.replace(partial, self._file(key))
+            if layerIndex is not None:
+                with open(self._sidecar(key), "wb") as f:
+                    f.write(layerIndex)
+            elif os.path.exists(self._sidecar(key)):
+                os.remove(self._sidecar(key))
+            now = time.time()
+            pinned = self._index.get(key, {}).get("pinned", False)
+            self._index[key] = {"name": name, "size": len(data), "stored": now, "used": now, "metadata": metadata, "pinned": pinned}
+            self._evict(float(self._preferences.getValue("Nautilus/job_cache_mb")) * 1000000)
+            self._saveIndex()
+        self.jobsChanged.emit()
+
+    def _evict(self, limit):
+        total = sum(entry["size"] for entry in self._index.values())
+        for key in sorted(self._index, key = lambda key: self._index[key]["used"]):
+            if total <= limit:
+                break
+            if self._index[key].get("pinned"):
+                continue
+            total -= self._index.pop(key)["size"]
+            try:
+                os.remove(self._file(key))
+                if os.path.exists(self._sidecar(key)):
+                    os.remove(self._sidecar(key))
+            except OSError:
+                Logger.logException("w", "Unable to remove cached Nautilus job " + key)
+
+    def _saveIndex(self):
+        try:
+            partial = os.path.join(self._path, self.IndexName + ".partial")
+            with open(partial, "w") as f:
+                json.dump(self._index, f)
+            os.replace(partial, os.path.join(self._path, self.IndexName))
+        except OSError:
+            Logger.logException("w", "Unable to save the Nautilus job cache index")
+
+    ##  Keep a job out of eviction, e.g. while it waits in the farm queue.
+    #   Returns False if the job isn't cached.
+    def pin(self, key):
+        return self._setPinned(key, True)
+
+    def unpin(self, key):
+        return self._setPinned(key, False)
+
+    def _setPinned(self, key, pinned):
+        with self._lock:
+            if key not in self._index:
+                return False
+            self._index[key]["pinned"] = pinned
+            self._saveIndex()
+            return True
+
+    ##  The most recently stored jobs, newest first, as (key, entry) pairs.
+    def recentJobs(self, count = 10):
+        with self._lock:
+            keys = sorted(self._index, key = lambda key: self._index[key]["stored"], reverse = True)[:count]
+            return [(key, dict(self._index[key])) for key in keys]
@@ -0,0 +1,46 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import json
+import os
+import re
+
+# a layer marker, the offset of the line is one past the newline
+LayerPattern = re.compile(rb"\n;LAYER:(-?\d+)")
+
+# the index is saved next to the job as <file name without .gcode> + Suffix
+Suffix = ".layers.json"
+Columns = ["layer", "offset", "z", "elapsed"]
+
+
+##  Where every layer starts in a file, as compact JSON bytes: the layer
+#   number, the byte offset of its ;LAYER: line, its Z and the estimated
+#   seconds into the print, so resuming or mapping progress to a layer is a
+#   seek instead of a rescan of the file.
+#
+#   layers are the analyzer's [layer, z, elapsed] rows. They are joined by
+#   layer number, the offsets have to come from the bytes that are sent
+#   because post-processing moves everything after the first change.
+def layerIndex(data, layers, print_fingerprint):
+    estimates = {layer: (z, elapsed) for layer, z, elapsed in layers}
+    rows = []
+    for match in LayerPattern.finditer(data):
+        layer = int(match.group(1))
+        z, elapsed = estimates.get(layer, (None, None))
+        rows.append([layer, match.start() + 1, None if z is None else round(z, 3), None if elapsed is None else round(elapsed, 1)])
+    index = {"version": 1, "size": print_fingerprint["size"], "crc32": print_fingerprint["crc32"], "columns": Columns, "layers": rows}
+    return json.dumps(index, separators = (",", ":")).encode()
+
+
+##  The sidecar's path for a job uploaded to path.
+def sidecarPath(path):
+    return os.path.splitext(path)[0] + Suffix
@@ -1,23 +1,21 @@
 import os
 import datetime
 import base64
-import urllib
+import urllib.parse
 import json
 from io import StringIO, BytesIO
 from time import time, sleep
 from typing import cast
-import requests
-import zipfile
-import tempfile
 import traceback
 import stat
 
-from distutils.version import StrictVersion
+# requests, zipfile and tempfile are only used by the firmware update flow
+# and are imported there. NautilusUploadJob brings numpy and the g-code
+# pipeline along, it is imported when the first job is sent.
 
 from PyQt5 import QtNetwork
-from PyQt5.QtCore import QFile, QUrl, QObject, QCoreApplication, QByteArray, QTimer, QEventLoop, pyqtProperty, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QUrl, QObject, QByteArray, QTimer, QEventLoop
 from PyQt5.QtGui import QDesktopServices
-from PyQt5.QtQml import QQmlComponent, QQmlContext
 
 from UM.Application import Application
 from UM.Logger import Logger
@@ -27,32 +25,59 @@ from UM.PluginRegistry import PluginRegistry
 from UM.OutputDevice.OutputDevice import OutputDevice
 from UM.OutputDevice import OutputDeviceError
 from UM.Resources import Resources
+from UM.Signal import Signal
+from UM.Version import Version
 
 from . import Nautilus
 from . import NautilusDuet
 from . import NautilusUpdate
+from .NautilusCoverage import NautilusCoverage
+from .NautilusDialogs import NautilusDialogs
+from .NautilusFingerprints import NautilusFingerprints, sameModifiedTime
+from .NautilusInstances import NautilusInstances
+from .NautilusJobCache import NautilusJobCache
+from .NautilusLayerIndex import sidecarPath
+from .NautilusSimulations import NautilusSimulations, parseSimulationReply
+from .NautilusStatus import NautilusStatusPoller
 
 from UM.i18n import i18nCatalog
 catalog = i18nCatalog("cura")
 
 from cura.CuraApplication import CuraApplication
-from cura.MachineAction import MachineAction
 
 
 from enum import Enum
 class OutputStage(Enum):
     ready = 0
     writing = 1
+    # waiting for the printer to turn off the preheated heaters
+    closing = 2
 
 class DeviceType(Enum):
-
+    print = 0
+    simulate = 1
     upload = 2
 
 
 class NautilusOutputDevice(OutputDevice):
+    # emitted with the device and the job's profile when a print starts
+    printStarted = Signal()
+
+    # seconds a simulation may go without word from the printer, e.g. when
+    # the status poller stopped for a machine switch, before it is given up
+    SimulationTimeout = 60
+
     def __init__(self, name, url, duet_password, http_user, http_password, firmware_version, device_type):
         self._device_type = device_type
-        if device_type == DeviceType.upload:
+        if device_type == DeviceType.print:
+            description = catalog.i18nc("@action:button", "Print on {0}").format(name)
+            name_id = name + "-print"
+            priority = 30
+        elif device_type == DeviceType.simulate:
+            description = catalog.i18nc("@action:button", "Simulate on {0}").format(name)
+            name_id = name + "-simulate"
+            priority = 20
+        elif device_type == DeviceType.upload:
             description = catalog.i18nc("@action:button", "Send to {0}").format(name)
             name_id = name + "-upload"
             priority = 10
@@ -76,7 +101,6 @@ class NautilusOutputDevice(OutputDevice):
         self.gitUrl = 'https://api.github.com/repos/HydraResearchLLC/Nautilus-Configuration-Macros/releases/latest'
         self.path = os.path.join(Resources.getStoragePath(Resources.Resources), "plugins","Nautilus","Nautilus")
         #RESOLVE FLAG ISSUE
-        self.Nauti = Nautilus.Nautilus()
 
 
 
@@ -89,6 +113,8 @@ class NautilusOutputDevice(OutputDevice):
         self._qnam = QtNetwork.QNetworkAccessManager()
 
         self._stream = None
+        self._dialog = None
+        self._nameField = None
         self._cleanupRequest()
 
 
@@ -104,6 +130,9 @@ class NautilusOutputDevice(OutputDevice):
 
 
 
+    def getPrinterName(self):
+        return self._name
+
     def _timestamp(self):
         return ("time", datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'))
 
@@ -147,6 +176,21 @@ class NautilusOutputDevice(OutputDevice):
         fileName = base + " - " +  mat + " - " + noz + " - " + layerheight
         return fileName
 
+    ##  The material, tool cartridge, quality type and intent of the job being
+    #   sent, and whether a shipped Nautilus profile covers that combination.
+    @staticmethod
+    def jobProfile():
+        global_stack = Application.getInstance().getGlobalContainerStack()
+        extruder = Application.getInstance().getExtruderManager().getActiveExtruderStacks()[0]
+        profile = {
+            "material": extruder.material.getMetaDataEntry("base_file", extruder.material.getId()),
+            "variant": extruder.variant.getName(),
+            "quality_type": global_stack.quality.getMetaDataEntry("quality_type", ""),
+            "intent": extruder.intent.getMetaDataEntry("intent_category", "default")
+        }
+        profile["supported"] = NautilusCoverage.getInstance().isSupported(profile["material"], profile["variant"], profile["quality_type"], profile["intent"])
+        return profile
+
     def requestWrite(self, node, fileName=None, *args, **kwargs):
         if self._stage != OutputStage.ready:
             raise OutputDeviceError.DeviceBusyError()
@@ -157,14 +201,18 @@ class NautilusOutputDevice(OutputDevice):
             fileName = "%s.gcode" % Application.getInstance().getPrintInformation().jobName
         self._fileName = fileName
         self._baseLength = len(Application.getInstance().getPrintInformation().baseName)
-        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qml', 'UploadFilename.qml')
-        self._dialog = CuraApplication.getInstance().createQmlComponent(path, {"manager": self})
-        self._dialog.textChanged.connect(self.onFilenameChanged)
-        self._dialog.accepted.connect(self.onFilenameAccepted)
+        self._dialog = NautilusDialogs.getInstance().getDialog('UploadFilename.qml', self, self._setupFilenameDialog)
+        # the dialog is reused, so put back everything the last upload changed
+        self._nameField.setProperty('text', self._fileName)
+        self._dialog.setProperty('validName', len(self._fileName) > 0)
         self._dialog.show()
-        self._dialog.findChild(QObject, "nameField").setProperty('text', self._fileName)
-        self._dialog.findChild(QObject, "nameField").select(0, self._baseLength)
-        self._dialog.findChild(QObject, "nameField").setProperty('focus', True)
+        self._nameField.select(0, self._baseLength)
+        self._nameField.setProperty('focus', True)
+
+    def _setupFilenameDialog(self, dialog):
+        self._nameField = dialog.findChild(QObject, "nameField")
+        dialog.textChanged.connect(self.onFilenameChanged)
+        dialog.accepted.connect(self.onFilenameAccepted)
 
     def fileLister(self, url, dir):
         try:
@@ -261,6 +309,7 @@ class NautilusOutputDevice(OutputDevice):
 
 
     def githubRequest(self):
+        import requests
         #self.writeError.connect(self.updateError())
         self._progress = Message(catalog.i18nc("@info:progress", "Do not power off printer or close Cura until updates complete \n Updating {} \n").format(self._name), 0, False, 1)
         self._progress.show()
@@ -317,6 +366,8 @@ class NautilusOutputDevice(OutputDevice):
         self.updateMacros()
 
     def updateMacros(self):
+        import tempfile
+        import zipfile
         self._stage = OutputStage.writing
         self.writeStarted.emit(self)
 
@@ -373,6 +424,8 @@ class NautilusOutputDevice(OutputDevice):
         loop.exec()
 
     def updateConfig(self, url):
+        import tempfile
+        import zipfile
         self._stage = OutputStage.ready
         self.writeStarted.emit(self)
 
@@ -514,7 +567,7 @@ class NautilusOutputDevice(OutputDevice):
         self._message.show()
 
     def updateCheck(self):
-        self.Nauti.checkGit()
+        Nautilus.Nautilus.getInstance().checkGit()
         self._send('download', [("name", "0:/private/firmware_version")])
         loop = QEventLoop()
         getTimer = QTimer()
@@ -525,18 +578,16 @@ class NautilusOutputDevice(OutputDevice):
             reply_body = bytes(self._reply.readAll()).decode().strip()
             if len(reply_body)>0:
                 newestVersion = CuraApplication.getInstance().getPreferences().getValue("Nautilus/configversion")
-                if StrictVersion(newestVersion)>StrictVersion(reply_body):
+                if Version(newestVersion)>Version(reply_body):
                     #CuraApplication.getInstance().getPreferences().addPreference("Nautilus/uptodate","no")
                     self._onUpdateRequired()
-                    NautilusUpdate.NautilusUpdate().thingsChanged()
+                    NautilusUpdate.NautilusUpdate.getInstance().thingsChanged()
                 #self._testmess = Message(catalog.i18nc("@info:status","{} has firmware version: {}").format(self._name,reply_body))
                 #self._testmess.show()
                 else:
                     Logger.log('i', str(self._name) + " is up to date"+str(self.updateFlag))
                     #CuraApplication.getInstance().getPreferences().addPreference("Nautilus/uptodate","yes")
-                    NautilusDuet.NautilusDuet().saveInstance(self._name, self._name, self._url, self._duet_password, self._http_user, self._http_password, reply_body)
-                    sleep(.5)
-                    NautilusUpdate.NautilusUpdate().thingsChanged()
+                    NautilusInstances.getInstance().setFirmwareVersion(self._name, reply_body)
                     if self.updateFlag == 0:
                         mess = Message(catalog.i18nc("@info:status",'Nautilus is up to date!'))
                         mess.show()
@@ -548,25 +599,34 @@ class NautilusOutputDevice(OutputDevice):
             Logger.log('i','unknown error')
 
     def onFilenameChanged(self):
-        fileName = self._dialog.findChild(QObject, "nameField").property('text')
+        fileName = self._nameField.property('text')
         self._dialog.setProperty('validName', len(fileName) > 0)
 
     def onFilenameAccepted(self):
-        self._fileName = self._dialog.findChild(QObject, "nameField").property('text')
+        self._fileName = self._nameField.property('text')
         if not self._fileName.endswith('.gcode') and '.' not in self._fileName:
             self._fileName += '.gcode'
         Logger.log("d", self._name_id + " | Filename set to: " + self._fileName)
 
-        self._dialog.deleteLater()
+        self._jobProfile = self.jobProfile()
+        if not self._jobProfile["supported"]:
+            Logger.log("w", self._name_id + " | No Nautilus profile for {material} on {variant} at {quality_type} ({intent})".format(**self._jobProfile))
+
+        self._dialog.hide()
+
+        from .NautilusUploadJob import NautilusUploadJob
+
+        # a job sent before with the same scene and settings comes from the cache
+        preferences = Application.getInstance().getPreferences()
+        jobCache = NautilusJobCache.getInstance()
+        cacheKey = jobCache.jobKey(NautilusUploadJob.stageSettings(preferences))
+        if jobCache.lookup(cacheKey) and self.sendCachedJob(cacheKey, self._fileName):
+            Logger.log("d", self._name_id + " | Sent the cached job " + cacheKey)
+            return
 
         # create the temp file for the gcode
         self._stream = StringIO()
-        self._stage = OutputStage.writing
-        self.writeStarted.emit(self)
-
-        # show a progress message
-        self._message = Message(catalog.i18nc("@info:progress", "Sending to {}").format(self._name), 0, False, -1)
-        self._message.show()
+        self._beginSending()
 
         Logger.log("d", self._name_id + " | Loading gcode...")
 
@@ -578,19 +638,246 @@ class NautilusOutputDevice(OutputDevice):
             Logger.log("e", "GCodeWrite failed.")
             return
 
+        # estimate the print in the background, then connect
+        limits = NautilusUploadJob.machineLimits(Application.getInstance().getGlobalContainerStack())
+        stages = NautilusUploadJob.uploadStages(preferences)
+        self._uploadJob = NautilusUploadJob(self._stream.getvalue(), limits, stages, cacheKey, self._fileName, self._jobProfile)
+        self._uploadJob.finished.connect(self.onGcodeAnalyzed)
+        self._uploadJob.start()
+
+    def _beginSending(self):
+        self._stage = OutputStage.writing
+        self.writeStarted.emit(self)
+
+        # show a progress message
+        self._message = Message(catalog.i18nc("@info:progress", "Sending to {}").format(self._name), 0, False, -1)
+        self._message.show()
+
+    ##  Send a job from the job cache, without serializing the scene.
+    #   Returns False if the device is busy or the job isn't cached anymore.
+    def sendCachedJob(self, cacheKey, fileName = None):
+        if self._stage != OutputStage.ready:
+            Logger.log("w", self._name_id + " | Busy, not sending the cached job " + cacheKey)
+            return False
+        entry = NautilusJobCache.getInstance().lookup(cacheKey)
+        if entry is None:
+            Logger.log("w", self._name_id + " | Job " + cacheKey + " is no longer cached")
+            return False
+        try:
+            data = NautilusJobCache.getInstance().read(cacheKey)
+        except OSError:
+            Logger.logException("w", "Unable to read the cached Nautilus job " + cacheKey)
+            return False
+
+        self._fileName = fileName or entry["name"]
+        self._jobProfile = entry["metadata"].get("profile")
+        self._beginSending()
+        self._startUpload(data, entry["metadata"], NautilusJobCache.getInstance().readLayerIndex(cacheKey))
+        return True
+
+    def onGcodeAnalyzed(self, job):
+        if self._stage != OutputStage.writing or job is not self._uploadJob:
+            return
+
+        if job.getResult() is None:
+            Logger.log("e", self._name_id + " | Unable to prepare " + self._fileName + ": " + str(job.getError()))
+            if self._message:
+                self._message.hide()
+            self._message = None
+            message = Message(catalog.i18nc("@info:status", "Unable to prepare {} for {}: {}").format(self._fileName, self._name, job.getError()), 0, False)
+            message.show()
+            self.writeError.emit(self)
+            self._cleanupRequest()
+            return
+
+        # the post-processed and encoded file replaces what GCodeWriter wrote
+        self._stream.close()
+        self._stream = None
+        self._startUpload(job.getData(), job.getResult(), job.getLayerIndex())
+
+    def _startUpload(self, data, metadata, layerIndex = None):
+        self._uploadData = data
+        self._layerIndex = layerIndex
+        # a duration measured by simulating these bytes beats any estimate
+        self._uploadMetadata = NautilusSimulations.getInstance().applyTo(dict(metadata))
+        if "duration" in self._uploadMetadata:
+            Logger.log("d", self._name_id + " | Estimated {} and {:.0f}mm of filament".format(self.formatDuration(self._uploadMetadata["duration"]), self._uploadMetadata["filament"]))
+
         # start
         Logger.log("d", self._name_id + " | Connecting...")
         self._send('connect', [("password", self._duet_password), self._timestamp()], self.onUploadReady)
 
+    def formatDuration(self, seconds):
+        minutes = int(round(seconds / 60.0))
+        if minutes < 60:
+            return "{}m".format(minutes)
+        return "{}h {}m".format(minutes // 60, minutes % 60)
+
     def onUploadReady(self):
         if self._stage != OutputStage.writing:
             return
 
+        # the printer may already hold these bytes, under this or another name
+        self._uploadPath = "0:/gcodes/" + self._fileName
+        self._copies = NautilusFingerprints.getInstance().findCopies(self._name, self._uploadMetadata["fingerprint"], self._uploadPath)
+
+        if self.preheat():
+            return
+        self.uploadLayerIndex()
+
+    ##  With Nautilus/preheat_while_uploading on, start heating the bed and
+    #   tool to the job's first targets so they heat while the file is sent.
+    #   Only the print device preheats, and only an idle printer. Returns True
+    #   if a preheat was sent.
+    def preheat(self):
+        temperatures = self._uploadMetadata.get("temperatures") or {}
+        if not Application.getInstance().getPreferences().getValue("Nautilus/preheat_while_uploading"):
+            return False
+        if self._device_type != DeviceType.print:
+            # nothing is going to print after an upload or a simulation
+            return False
+        if not NautilusStatusPoller.getInstance().isIdle(self._name):
+            Logger.log("d", self._name_id + " | Not idle, skipping the preheat")
+            return False
+        commands = []
+        if temperatures.get("bed"):
+            commands.append("M140 S{:g}".format(temperatures["bed"]))
+        if temperatures.get("tool"):
+            commands.append("M104 S{:g} T0".format(temperatures["tool"]))
+        if not commands:
+            return False
+        Logger.log("d", self._name_id + " | Preheating: " + ", ".join(commands))
+        self._send('gcode', [("gcode", "\n".join(commands))], self.onPreheated)
+        return True
+
+    def onPreheated(self):
+        if self._stage != OutputStage.writing:
+            return
+        try:
+            result = json.loads(bytes(self._reply.readAll()).decode())
+        except ValueError:
+            result = {}
+        # rr_gcode answers with the free buffer space, and err if it refused
+        self._preheated = result.get("err", 0) == 0 and "buff" in result
+        if not self._preheated:
+            Logger.log("w", self._name_id + " | The printer didn't accept the preheat")
+        self.uploadLayerIndex()
+
+    ##  Turn off what preheat() turned on, when the job isn't going to run,
+    #   then call done. The device stays busy until the printer answered, so
+    #   whatever done sends next (the disconnect) can't overtake it.
+    def _preheatOff(self, done):
+        if not self._preheated:
+            done()
+            return
+        self._preheated = False
+        self._preheatOffDone = done
+        self._stage = OutputStage.closing
+        Logger.log("d", self._name_id + " | Turning the preheated heaters off")
+        self._send('gcode', [("gcode", "M140 S0\nM104 S0 T0")], self.onPreheatOff)
+        # onPreheatOff reports a failure, it isn't a failed job
+        self._reply.error.disconnect(self._onNetworkError)
+
+    def onPreheatOff(self):
+        if self._stage != OutputStage.closing:
+            return
+        try:
+            result = json.loads(bytes(self._reply.readAll()).decode())
+        except ValueError:
+            result = {}
+        if self._reply.error() != QtNetwork.QNetworkReply.NoError or result.get("err", 0) != 0 or "buff" not in result:
+            Logger.log("e", self._name_id + " | Unable to turn off the preheated heaters: " + self._reply.errorString())
+            message = Message(catalog.i18nc("@info:status", "Unable to turn off the heaters on {}, they may still be heating. Turn them off from Duet Web Control.").format(self._name), 0, False)
+            message.show()
+        done = self._preheatOffDone
+        self._preheatOffDone = None
+        done()
+
+    ##  Send the job's layer index ahead of the job itself. It is small, so it
+    #   is sent even when the printer already holds the job.
+    def uploadLayerIndex(self):
+        if self._stage != OutputStage.writing:
+            return
+        if not self._layerIndex:
+            self.checkNextCopy()
+            return
+        Logger.log("d", self._name_id + " | Uploading the layer index...")
+        self._postData = QByteArray(self._layerIndex)
+        self._send('upload', [("name", sidecarPath(self._uploadPath)), self._timestamp()], self.onLayerIndexUploaded, self._postData)
+
+    def onLayerIndexUploaded(self):
+        if self._stage != OutputStage.writing:
+            return
+        try:
+            result = json.loads(bytes(self._reply.readAll()).decode())
+        except ValueError:
+            result = {}
+        if result.get("err") != 0:
+            # the job is still worth sending without it
+            Logger.log("w", self._name_id + " | The printer didn't confirm the layer index upload")
+        self.checkNextCopy()
+
+    def checkNextCopy(self):
+        if not self._copies:
+            self.upload()
+            return
+        Logger.log("d", self._name_id + " | Checking the copy at " + self._copies[0])
+        self._send('fileinfo', [("name", self._copies[0])], self.onCopyInfo)
+
+    def onCopyInfo(self):
+        if self._stage != OutputStage.writing:
+            return
+
+        path = self._copies.pop(0)
+        try:
+            info = json.loads(bytes(self._reply.readAll()).decode())
+        except ValueError:
+            info = {}
+        fingerprints = NautilusFingerprints.getInstance()
+        record = fingerprints.getRecord(self._name, path)
+        if info.get("err") != 0 or info.get("size") != record["size"] or not sameModifiedTime(record["lastModified"], info.get("lastModified")):
+            # gone or changed since we uploaded it
+            Logger.log("d", self._name_id + " | " + path + " no longer matches")
+            fingerprints.forget(self._name, path)
+            self.checkNextCopy()
+            return
+
+        if path == self._uploadPath:
+            Logger.log("d", self._name_id + " | " + path + " is already on the printer, skipping the upload")
+            self._uploadMetadata["transfer"] = "skipped"
+            self.onUploadDone()
+            return
+
+        Logger.log("d", self._name_id + " | Renaming " + path + " instead of uploading")
+        self._uploadMetadata["transfer"] = "renamed"
+        self._renamedFrom = path
+        self._send('move', [("old", path), ("new", self._uploadPath), ("deleteexisting", "yes")], self.onCopyRenamed)
+
+    def onCopyRenamed(self):
+        if self._stage != OutputStage.writing:
+            return
+
+        try:
+            result = json.loads(bytes(self._reply.readAll()).decode())
+        except ValueError:
+            result = {}
+        fingerprints = NautilusFingerprints.getInstance()
+        record = fingerprints.getRecord(self._name, self._renamedFrom)
+        fingerprints.forget(self._name, self._renamedFrom)
+        if result.get("err") != 0:
+            Logger.log("w", self._name_id + " | Unable to rename " + self._renamedFrom + ", uploading instead")
+            self._uploadMetadata.pop("transfer", None)
+            self.upload()
+            return
+        fingerprints.record(self._name, self._uploadPath, self._uploadMetadata["fingerprint"], record["lastModified"])
+        self.onUploadDone()
+
+    def upload(self):
         Logger.log("d", self._name_id + " | Uploading...")
-        self._stream.seek(0)
-        self._postData = QByteArray()
-        self._postData.append(self._stream.getvalue().encode())
-        self._send('upload', [("name", "0:/gcodes/" + self._fileName), self._timestamp()], self.onUploadDone, self._postData)
+        self._uploadMetadata["transfer"] = "uploaded"
+        self._uploadTime = self._timestamp()
+        self._postData = QByteArray(self._uploadData)
+        self._send('upload', [("name", self._uploadPath), self._uploadTime], self.onUploadDone, self._postData)
 
     def onUploadDone(self):
         if self._stage != OutputStage.writing:
@@ -598,22 +885,194 @@ class NautilusOutputDevice(OutputDevice):
 
         Logger.log("d", self._name_id + " | Upload done")
 
-        self._stream.close()
-        self.stream = None
+        verified = self._uploadMetadata.get("transfer") in ("skipped", "renamed")
+        if self._uploadMetadata.get("transfer") == "uploaded":
+            try:
+                result = json.loads(bytes(self._reply.readAll()).decode())
+            except ValueError:
+                result = {}
+            verified = result.get("err") == 0
+            if verified:
+                # the upload's time parameter becomes the file's modification time
+                NautilusFingerprints.getInstance().record(self._name, self._uploadPath, self._uploadMetadata["fingerprint"], self._uploadTime[1])
+
+        note = ""
+        if self._device_type in (DeviceType.print, DeviceType.simulate):
+            action = "print" if self._device_type == DeviceType.print else "simulation"
+            if not verified:
+                note = " The printer didn't confirm the upload, the {} was not started.".format(action)
+            elif not NautilusStatusPoller.getInstance().isIdle(self._name):
+                note = " {} is not idle, start the {} from Duet Web Control.".format(self._name, action)
+            elif self._device_type == DeviceType.print:
+                # still connected, start right away
+                Logger.log("d", self._name_id + " | Starting the print")
+                self._send('gcode', [("gcode", 'M32 "' + self._uploadPath + '"')], self.onPrintStarted)
+                return
+            else:
+                Logger.log("d", self._name_id + " | Starting the simulation")
+                self._send('gcode', [("gcode", 'M37 P"' + self._uploadPath + '"')], self.onSimulationStarted)
+                return
 
-        if self._device_type == DeviceType.upload:
-            self._send('disconnect')
-            if self._message:
-                self._message.hide()
+        # no print is starting, don't leave the heaters on
+        self._preheatOff(lambda: self._finishUpload(note))
+
+    def _finishUpload(self, note):
+        self._send('disconnect')
+        self._showDone(self._transferText() + note)
+        self.writeSuccess.emit(self)
+        self._cleanupRequest()
+        self.updateCheck()
+
+    def onPrintStarted(self):
+        if self._stage != OutputStage.writing:
+            return
+
+        Logger.log("d", self._name_id + " | Print started")
+        self._send('disconnect')
+        text = "Print started on {} with file {}.".format(self._name, os.path.basename(self._fileName))
+        if "duration" in self._uploadMetadata:
+            text += " Estimated print time {}.".format(self.formatDuration(self._uploadMetadata["duration"]))
+        self._showDone(text)
+        self.printStarted.emit(self, self._jobProfile)
+        self.writeSuccess.emit(self)
+        self._cleanupRequest()
+
+    def onSimulationStarted(self):
+        if self._stage != OutputStage.writing:
+            return
+
+        Logger.log("d", self._name_id + " | Simulation started")
+        self._send('disconnect')
+        if self._message:
+            self._message.setText(catalog.i18nc("@info:progress", "Simulating {} on {}").format(os.path.basename(self._fileName), self._name))
+            self._message.setProgress(0)
+
+        # follow the simulation through the shared status poller
+        self._simulating = True
+        self._simulationSeen = False
+        self._simulationStarted = time()
+        self._simulationHeard = time()
+        poller = NautilusStatusPoller.getInstance()
+        poller.statusChanged.connect(self.onSimulationStatus)
+        self._simulationWatchdog = QTimer()
+        self._simulationWatchdog.setInterval(poller.PollInterval)
+        self._simulationWatchdog.timeout.connect(self._checkSimulationTimeout)
+        self._simulationWatchdog.start()
+        # a short simulation can start and end between two polls, look again
+        # once it should have shown up
+        QTimer.singleShot(3 * poller.PollInterval, lambda: self.onSimulationStatus(self._name))
+
+    def onSimulationStatus(self, name):
+        if self._stage != OutputStage.writing or not self._simulating or name != self._name:
+            return
+
+        poller = NautilusStatusPoller.getInstance()
+        status = poller.getStatus(name)
+        if status.get("status") is not None:
+            self._simulationHeard = time()
+        # RRF 1.21RC2 and earlier report P while simulating, later versions M
+        if status.get("status") in ("M", "P"):
+            self._simulationSeen = True
+            if "fractionPrinted" in status:
+                self._onProgress(float(status["fractionPrinted"]))
+            return
+        if status.get("status") is None:
+            # not answering, keep waiting
+            return
+        if not self._simulationSeen and time() - self._simulationStarted < 3 * poller.PollInterval / 1000:
+            # not started yet
+            return
+
+        Logger.log("d", self._name_id + " | Simulation finished")
+        self._stopFollowingSimulation()
+        self._send('connect', [("password", self._duet_password), self._timestamp()], self.onSimulationDone)
+
+    def _stopFollowingSimulation(self):
+        if self._simulating:
+            self._simulating = False
+            NautilusStatusPoller.getInstance().statusChanged.disconnect(self.onSimulationStatus)
+            self._simulationWatchdog.stop()
+            self._simulationWatchdog = None
+
+    def _checkSimulationTimeout(self):
+        if self._stage != OutputStage.writing or not self._simulating:
+            return
+        if time() - self._simulationHeard < self.SimulationTimeout:
+            return
+
+        Logger.log("w", self._name_id + " | No status for {}s, giving up on the simulation".format(self.SimulationTimeout))
+        if self._message:
+            self._message.hide()
+        self._message = None
+        message = Message(catalog.i18nc("@info:status", "Lost track of the simulation of {} on {}, no simulated print time was recorded. Check Duet Web Control for the result.").format(os.path.basename(self._fileName), self._name), 0, False)
+        message.show()
+        self.writeError.emit(self)
+        self._cleanupRequest()
+
+    def onSimulationDone(self):
+        if self._stage != OutputStage.writing:
+            return
+
+        # RRF records the simulated time in the file, rr_fileinfo reports it
+        self._send('fileinfo', [("name", self._uploadPath)], self.onSimulatedFileInfo)
+
+    def onSimulatedFileInfo(self):
+        if self._stage != OutputStage.writing:
+            return
+
+        try:
+            info = json.loads(bytes(self._reply.readAll()).decode())
+        except ValueError:
+            info = {}
+        if info.get("simulatedTime"):
+            self._finishSimulation(float(info["simulatedTime"]))
+        else:
+            # older firmware only says it in the reply
+            self._send('reply', [], self.onSimulationReported)
+
+    def onSimulationReported(self):
+        if self._stage != OutputStage.writing:
+            return
+
+        reply_body = bytes(self._reply.readAll()).decode().strip()
+        Logger.log("d", self._name_id + " | Reported | " + reply_body)
+        self._finishSimulation(parseSimulationReply(reply_body), reply_body)
+
+    def _finishSimulation(self, duration, reply_body = ""):
+        self._send('disconnect')
+        if duration is None:
+            text = "Simulation finished on {}:\n\n{}".format(self._name, reply_body)
+        else:
+            NautilusSimulations.getInstance().setDuration(self._uploadMetadata["fingerprint"], duration, self._fileName, self._name)
+            text = "Simulation finished on {}: {} will print in {}.".format(self._name, os.path.basename(self._fileName), self.formatDuration(duration))
+            if "analyzedDuration" in self._uploadMetadata or "duration" in self._uploadMetadata:
+                estimate = self._uploadMetadata.get("analyzedDuration", self._uploadMetadata.get("duration"))
+                text += " The estimate was {}.".format(self.formatDuration(estimate))
+        self._showDone(text)
+        self.writeSuccess.emit(self)
+        self._cleanupRequest()
+
+    ##  What happened to the file, with the estimate and what post-processing saved.
+    def _transferText(self):
+        if self._uploadMetadata.get("transfer") == "skipped":
+            text = "{} already holds {}, nothing was uploaded.".format(self._name, os.path.basename(self._fileName))
+        elif self._uploadMetadata.get("transfer") == "renamed":
+            text = "{} already held this job, renamed it to {}.".format(self._name, os.path.basename(self._fileName))
+        else:
             text = "Uploaded file {} to {}.".format(os.path.basename(self._fileName), self._name)
-            self._message = Message(catalog.i18nc("@info:status", text), 0, False)
-            self._message.addAction("open_browser", catalog.i18nc("@action:button", "Open Browser"), "globe", catalog.i18nc("@info:tooltip", "Open browser to DuetWebControl."))
-            self._message.actionTriggered.connect(self._onMessageActionTriggered)
-            self._message.show()
+        if "duration" in self._uploadMetadata:
+            text += " Estimated print time {}, {:.1f}m of filament.".format(self.formatDuration(self._uploadMetadata["duration"]), self._uploadMetadata["filament"] / 1000.0)
+        for report in self._uploadMetadata.get("postprocessing", []):
+            text += " {} saved {:.1f} kB and {} lines.".format(report["stage"].capitalize(), report["bytes"] / 1000.0, report["lines"])
+        return text
 
-            self.writeSuccess.emit(self)
-            self._cleanupRequest()
-            self.updateCheck()
+    def _showDone(self, text):
+        if self._message:
+            self._message.hide()
+        self._message = Message(catalog.i18nc("@info:status", text), 0, False)
+        self._message.addAction("open_browser", catalog.i18nc("@action:button", "Open Browser"), "globe", catalog.i18nc("@info:tooltip", "Open browser to DuetWebControl."))
+        self._message.actionTriggered.connect(self._onMessageActionTriggered)
+        self._message.show()
 
     def _onUpdateProgress(self,progress):
         if self._progress:
@@ -626,6 +1085,8 @@ class NautilusOutputDevice(OutputDevice):
         self.writeProgress.emit(self, progress)
 
     def _cleanupRequest(self):
+        if getattr(self, "_simulating", False):
+            self._stopFollowingSimulation()
         self._reply = None
         self._request = None
         if self._stream:
@@ -633,6 +1094,18 @@ class NautilusOutputDevice(OutputDevice):
         self._stream = None
         self._stage = OutputStage.ready
         self._fileName = None
+        self._jobProfile = None
+        self._uploadJob = None
+        self._uploadMetadata = {}
+        self._uploadData = None
+        self._layerIndex = None
+        self._uploadPath = None
+        self._uploadTime = None
+        self._copies = []
+        self._renamedFrom = None
+        self._preheated = False
+        self._preheatOffDone = None
+        self._simulating = False
 
     def _onMessageActionTriggered(self, message, action):
         if action == "open_browser":
@@ -668,7 +1141,6 @@ class NautilusOutputDevice(OutputDevice):
         else:
             errorString = ''
 
-
         if '99' in repr(errorCode):
             if self.updateFlag==0:
                 self._unknownError()
@@ -697,6 +1169,16 @@ class NautilusOutputDevice(OutputDevice):
             message.show()
 
         self.writeError.emit(self)
+        if self._preheated:
+            # the job failed, the printer mustn't keep heating for it
+            self._preheatOff(self._closeAfterError)
+        else:
+            self._cleanupRequest()
+
+    def _closeAfterError(self):
+        self._send('disconnect')
+        # best effort, the connection may be what failed
+        self._reply.error.disconnect(self._onNetworkError)
         self._cleanupRequest()
 
     def _unknownError(self):
@@ -712,84 +1194,8 @@ class NautilusOutputDevice(OutputDevice):
         message.show()
 
     def _onUpdateRequired(self):
-        #NautilusUpdate.NautilusUpdate().thingsChanged()
+        #NautilusUpdate.NautilusUpdate.getInstance().thingsChanged()
         message=Message(catalog.i18nc("@info:status", "New features are available for {}! It is recommended to update the firmware on your printer.").format(self._name), 0)
         message.addAction("download_config", catalog.i18nc("@action:button", "Update Firmware"), "globe", catalog.i18nc("@info:tooltip", "Automatically download and install the latest firmware"))
         message.actionTriggered.connect(self.beginUpdate)
         message.show()
-
-"""
-FUNCTION GRAVEYARD
-
-    def onStatusReceived(self):
-        if self._stage != OutputStage.writing:
-            return
-
-        reply_body = bytes(self._reply.readAll()).decode()
-        Logger.log("d", self._name_id + " | Status received | " + reply_body)
-
-        status = json.loads(reply_body)
-        if status["status"] in ['P', 'M'] :
-            # still simulating
-            # RRF 1.21RC2 and earlier used P while simulating
-            # RRF 1.21RC3 and later uses M while simulating
-            if self._message and "fractionPrinted" in status:
-                self._message.setProgress(float(status["fractionPrinted"]))
-            QTimer.singleShot(5000, self.onCheckStatus)
-        else:
-            Logger.log("d", self._name_id + " | Simulation print finished")
-            self._send('reply', [], self.onReported)
-
-    def onReported(self):
-        if self._stage != OutputStage.writing:
-            return
-
-        reply_body = bytes(self._reply.readAll()).decode().strip()
-        Logger.log("d", self._name_id + " | Reported | " + reply_body)
-
-        if self._message:
-            self._message.hide()
-
-        text = "Simulation finished on {}:\n\n{}".format(self._name, reply_body)
-        self._message = Message(catalog.i18nc("@info:status", text), 0, False)
-        self._message.addAction("open_browser", catalog.i18nc("@action:button", "Open Browser"), "globe", catalog.i18nc("@info:tooltip", "Open browser to DuetWebControl."))
-        self._message.actionTriggered.connect(self._onMessageActionTriggered)
-        self._message.show()
-
-        self._send('disconnect')
-        self.writeSuccess.emit(self)
-        self._cleanupRequest()
-
-    def onCheckStatus(self):
-        if self._stage != OutputStage.writing:
-            return
-
-        Logger.log("d", self._name_id + " | Checking status...")
-
-        self._send('status', [("type", "3")], self.onStatusReceived)
-
-    def onReadyToPrint(self):
-        if self._stage != OutputStage.writing:
-            return
-
-        Logger.log("d", self._name_id + " | Ready to print")
-        self._send('gcode', [("gcode", 'M32 "0:/gcodes/' + self._fileName + '"')], self.onPrintStarted)
-
-    def onPrintStarted(self):
-        if self._stage != OutputStage.writing:
-            return
-
-        Logger.log("d", self._name_id + " | Print started")
-
-        self._send('disconnect')
-        if self._message:
-            self._message.hide()
-        text = "Print started on {} with file {}".format(self._name, self._fileName)
-        self._message = Message(catalog.i18nc("@info:status", text), 0, False)
-        self._message.addAction("open_browser", catalog.i18nc("@action:button", "Open Browser"), "globe", catalog.i18nc("@info:tooltip", "Open browser to DuetWebControl."))
-        self._message.actionTriggered.connect(self._onMessageActionTriggered)
-        self._message.show()
-
-        self.writeSuccess.emit(self)
-        self._cleanupRequest()
-"""
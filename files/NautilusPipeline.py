@@ -0,0 +1,361 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+# The stages only rewrite text, so this module doesn't import Uranium or
+# Cura and can be run on a saved g-code file as well.
+
+import math
+import re
+
+WordPattern = re.compile(r"([A-Z])(-?\d*\.?\d+)")
+
+
+##  One step of the g-code post-processing done before an upload.
+#
+#   Subclasses implement process(lines), a generator taking and yielding
+#   lines without their newline, so stages can be chained and the file is
+#   streamed through all of them in one pass. run() wraps it to count what
+#   goes in and comes out.
+class GcodeStage:
+    name = "stage"
+
+    def __init__(self):
+        self.linesIn = 0
+        self.linesOut = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    def process(self, lines):
+        return lines
+
+    def run(self, lines):
+        for line in self.process(self._count(lines)):
+            self.linesOut += 1
+            self.bytesOut += len(line) + 1
+            yield line
+
+    def _count(self, lines):
+        for line in lines:
+            self.linesIn += 1
+            self.bytesIn += len(line) + 1
+            yield line
+
+    def report(self):
+        return {
+            "stage": self.name,
+            "lines": self.linesIn - self.linesOut,
+            "bytes": self.bytesIn - self.bytesOut
+        }
+
+
+##  Replaces runs of short G1 extrusion moves that lie on a circle with a
+#   single G2 or G3 arc.
+#
+#   Points are added to the current run while they stay within tolerance of
+#   one circle, every chord stays within tolerance of the arc, the run turns
+#   one way, extrudes at an even rate and keeps its feedrate. Anything the
+#   fitter doesn't understand (relative XY, Z moves, retractions, comments)
+#   ends the run and is passed through unchanged.
+class ArcFitter(GcodeStage):
+    name = "arc fitting"
+
+    # fewer segments than this aren't worth an arc
+    MinimumSegments = 3
+    # bounds the work per point when a fit has to be checked again
+    MaximumSegments = 64
+    # nearly straight runs are better left as lines
+    MaximumRadius = 1000.0
+    # segments of one arc may extrude this much more or less per mm
+    ExtrusionVariation = 0.1
+
+    def __init__(self, tolerance = 0.05):
+        super().__init__()
+        self._tolerance = tolerance
+        self.arcs = 0
+
+    def process(self, lines):
+        x = y = e = None
+        relativeXY = False
+        relativeE = False
+        run = []
+        # the fitted circle for run: (cx, cy, radius, direction, sweep)
+        circle = None
+        start = None
+
+        for line in lines:
+            move = None
+            command = line.split(" ", 1)[0]
+            if command == "G1" and ";" not in line:
+                words = dict(WordPattern.findall(line[3:]))
+                if "X" in words and "Y" in words and "E" in words and "Z" not in words and len(words) <= 4 \
+                        and not relativeXY and x is not None and y is not None and e is not None:
+                    newX, newY = float(words["X"]), float(words["Y"])
+                    extruded = float(words["E"]) if relativeE else float(words["E"]) - e
+                    length = math.hypot(newX - x, newY - y)
+                    if extruded > 0 and length > 0:
+                        move = (newX, newY, extruded, length, words.get("F"), line, words)
+
+            if move is not None:
+                if run and move[4] is not None:
+                    # a new feedrate starts a new run
+                    for out in self._flush(run, start, circle, relativeE):
+                        yield out
+                    run = []
+                if not run:
+                    start = (x, y)
+                    run = [move]
+                    circle = None
+                else:
+                    fitted = self._extend(run, start, circle, move)
+                    if fitted is not None:
+                        run.append(move)
+                        circle = fitted
+                    else:
+                        for out in self._flush(run, start, circle, relativeE):
+                            yield out
+                        start = (x, y)
+                        run = [move]
+                        circle = None
+                    if len(run) >= self.MaximumSegments:
+                        for out in self._flush(run, start, circle, relativeE):
+                            yield out
+                        run = []
+                x, y = move[0], move[1]
+                e = e if relativeE else float(move[6]["E"])
+                continue
+
+            if run:
+                for out in self._flush(run, start, circle, relativeE):
+                    yield out
+                run = []
+            yield line
+
+            # keep track of the position and modes for the lines passed through
+            if command in ("G0", "G1", "G92"):
+                words = dict(WordPattern.findall(line.split(";", 1)[0][len(command):]))
+                if command != "G92" and relativeXY:
+                    x = y = None
+                if "X" in words:
+                    x = float(words["X"]) if command == "G92" or not relativeXY else None
+                if "Y" in words:
+                    y = float(words["Y"]) if command == "G92" or not relativeXY else None
+                if "E" in words:
+                    e = float(words["E"]) if command == "G92" or not relativeE else e
+            elif command == "G28":
+                x = y = None
+            elif command == "G90":
+                relativeXY = False
+            elif command == "G91":
+                relativeXY = True
+            elif command == "M82":
+                relativeE = False
+            elif command == "M83":
+                relativeE = True
+            if e is None and relativeE:
+                e = 0.0
+
+        if run:
+            for out in self._flush(run, start, circle, relativeE):
+                yield out
+
+    def _points(self, run, start):
+        return [start] + [(move[0], move[1]) for move in run]
+
+    def _extend(self, run, start, circle, move):
+        # the extrusion rate has to match the rest of the run
+        rate = run[0][2] / run[0][3]
+        if abs(move[2] / move[3] - rate) > rate * self.ExtrusionVariation:
+            return None
+        previous = (run[-1][0], run[-1][1])
+        if circle is not None and self._fits(circle, previous, (move[0], move[1])):
+            cx, cy, radius, direction, sweep = circle
+            return (cx, cy, radius, direction, sweep + self._angle(circle, previous, (move[0], move[1])))
+
+        # the current circle doesn't fit, try one through the whole run
+        points = self._points(run, start) + [(move[0], move[1])]
+        circle = self._circle(points[0], points[len(points) // 2], points[-1])
+        if circle is None:
+            return None
+        sweep = 0.0
+        for a, b in zip(points, points[1:]):
+            if not self._fits(circle, a, b):
+                return None
+            sweep += self._angle(circle, a, b)
+        cx, cy, radius, direction, ignored = circle
+        return (cx, cy, radius, direction, sweep)
+
+    def _circle(self, a, b, c):
+        # circumscribed circle of three points, None if they are on a line
+        d = 2 * (a[0] * (b[1] - c[1]) + b[0] * (c[1] - a[1]) + c[0] * (a[1] - b[1]))
+        if abs(d) < 1e-9:
+            return None
+        sa, sb, sc = a[0] ** 2 + a[1] ** 2, b[0] ** 2 + b[1] ** 2, c[0] ** 2 + c[1] ** 2
+        cx = (sa * (b[1] - c[1]) + sb * (c[1] - a[1]) + sc * (a[1] - b[1])) / d
+        cy = (sa * (c[0] - b[0]) + sb * (a[0] - c[0]) + sc * (b[0] - a[0])) / d
+        radius = math.hypot(a[0] - cx, a[1] - cy)
+        if radius > self.MaximumRadius:
+            return None
+        # 1 turns counterclockwise (G3), -1 clockwise (G2)
+        direction = 1 if (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0]) > 0 else -1
+        return (cx, cy, radius, direction, 0.0)
+
+    def _angle(self, circle, a, b):
+        cx, cy = circle[0], circle[1]
+        return abs(math.atan2((a[0] - cx) * (b[1] - cy) - (a[1] - cy) * (b[0] - cx), (a[0] - cx) * (b[0] - cx) + (a[1] - cy) * (b[1] - cy)))
+
+    def _fits(self, circle, a, b):
+        cx, cy, radius, direction, sweep = circle
+        # the end point is on the circle
+        if abs(math.hypot(b[0] - cx, b[1] - cy) - radius) > self._tolerance:
+            return False
+        # the segment turns the same way as the arc, by less than a quarter turn
+        cross = (a[0] - cx) * (b[1] - cy) - (a[1] - cy) * (b[0] - cx)
+        if cross * direction <= 0:
+            return False
+        angle = self._angle(circle, a, b)
+        if angle > math.pi / 2 or sweep + angle > 2 * math.pi - 0.1:
+            return False
+        # the arc doesn't bulge away from the original chord
+        return radius * (1 - math.cos(angle / 2)) <= self._tolerance
+
+    def _flush(self, run, start, circle, relativeE):
+        if circle is None or len(run) < self.MinimumSegments:
+            return [move[5] for move in run]
+        self.arcs += 1
+        cx, cy, radius, direction, sweep = circle
+        last = run[-1]
+        if relativeE:
+            extrusion = "{:.5f}".format(sum(move[2] for move in run))
+        else:
+            extrusion = last[6]["E"]
+        # the end point is written exactly as the slicer wrote it
+        arc = "{} X{} Y{} I{:.3f} J{:.3f} E{}".format("G3" if direction > 0 else "G2", last[6]["X"], last[6]["Y"],
+                                                     cx - start[0], cy - start[1], extrusion)
+        if run[0][4] is not None:
+            arc = arc[:2] + " F" + run[0][4] + arc[2:]
+        return [arc]
+
+
+##  Shrinks the file without changing what the printer does: drops comments
+#   other than the ones the firmware and Duet Web Control read for the file
+#   info, writes numbers without trailing zeros and leaves out G0/G1 words
+#   that repeat the current position or feedrate.
+#
+#   Positions are only tracked in absolute mode and are forgotten after any
+#   command that may move the head on its own (homing, probing, macros, tool
+#   changes). The feedrate is shared by G0 and G1, as in RepRapFirmware.
+class Compactor(GcodeStage):
+    name = "compaction"
+
+    KeptComments = (";FLAVOR:", ";TIME:", ";Filament used:", ";Layer height:", ";LAYER_COUNT:", ";LAYER:",
+                    ";Generated with", ";MINX:", ";MINY:", ";MINZ:", ";MAXX:", ";MAXY:", ";MAXZ:")
+    # commands known not to move the head or change the feedrate
+    Stationary = {"G4", "G21", "G90", "G91", "G92", "M82", "M83", "M84", "M104", "M105", "M106", "M107", "M109",
+                  "M116", "M117", "M140", "M190", "M201", "M203", "M204", "M205", "M220", "M221", "M400", "M566",
+                  "M572", "M73"}
+    Motion = ("G0", "G1", "G2", "G3")
+    Words = re.compile(r"(?:\s*[A-Z]-?\d*\.?\d+)*\s*")
+
+    def process(self, lines):
+        position = {}
+        feedrate = None
+        relativeXYZ = False
+        relativeE = False
+
+        for line in lines:
+            if line.startswith(";"):
+                if line.startswith(self.KeptComments):
+                    yield line
+                continue
+            if '"' in line:
+                # quoted strings may hold semicolons, leave the line alone
+                yield line.rstrip()
+                position = {}
+                feedrate = None
+                continue
+            code = line.split(";", 1)[0].strip()
+            if not code:
+                continue
+            parts = code.split(None, 1)
+            command = parts[0]
+            rest = parts[1] if len(parts) > 1 else ""
+            if not self.Words.fullmatch(rest):
+                # not plain letter/number words, only the comment goes
+                yield code
+                if command not in self.Stationary:
+                    position = {}
+                    feedrate = None
+                continue
+
+            words = []
+            for letter, value in WordPattern.findall(rest):
+                value = self._number(value)
+                if command in ("G0", "G1"):
+                    if letter == "F":
+                        if value == feedrate:
+                            continue
+                    elif letter in "XYZ" and not relativeXYZ or letter == "E" and not relativeE:
+                        if position.get(letter) == value:
+                            continue
+                words.append(letter + value)
+
+            if command in self.Motion:
+                if command in ("G0", "G1") and not words:
+                    # moves to where the head already is
+                    continue
+                for word in words:
+                    letter, value = word[0], word[1:]
+                    if letter == "F":
+                        feedrate = value
+                    elif letter in "XYZ":
+                        if relativeXYZ:
+                            position.pop(letter, None)
+                        else:
+                            position[letter] = value
+                    elif letter == "E":
+                        if relativeE:
+                            position.pop(letter, None)
+                        else:
+                            position[letter] = value
+            elif command == "G92":
+                for word in words or ["X0", "Y0", "Z0", "E0"]:
+                    position[word[0]] = self._number(word[1:])
+            elif command == "G90":
+                relativeXYZ = False
+            elif command == "G91":
+                relativeXYZ = True
+                position = {}
+            elif command == "M82":
+                relativeE = False
+            elif command == "M83":
+                relativeE = True
+                position.pop("E", None)
+            elif command not in self.Stationary:
+                position = {}
+                feedrate = None
+            yield " ".join([command] + words)
+
+    def _number(self, value):
+        # the same number with the fewest characters
+        if "." in value:
+            value = value.rstrip("0").rstrip(".")
+            if value in ("", "-", "-0"):
+                value = "0"
+        return value
+
+
+##  Stream text through the stages in order, returning the new text.
+def runStages(text, stages):
+    lines = iter(text.split("\n"))
+    for stage in stages:
+        lines = stage.run(lines)
+    return "\n".join(lines)
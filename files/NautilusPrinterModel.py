@@ -0,0 +1,112 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+from PyQt5.QtCore import Qt
+
+from UM.Qt.ListModel import ListModel
+from UM.Version import Version
+
+from cura.CuraApplication import CuraApplication
+
+from .NautilusInstances import NautilusInstances
+from .NautilusStatus import NautilusStatusPoller
+
+
+##  List of saved printers for the Connections and Update dialogs.
+#
+#   Rows are kept in step with the instance registry and the status poller
+#   one row at a time, so a change to one printer never rebuilds the list.
+class NautilusPrinterModel(ListModel):
+    NameRole = Qt.UserRole + 1
+    UrlRole = Qt.UserRole + 2
+    FirmwareVersionRole = Qt.UserRole + 3
+    UpdateStatusRole = Qt.UserRole + 4
+    PrinterStateRole = Qt.UserRole + 5
+
+    __instance = None
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.addRoleName(self.NameRole, "name")
+        self.addRoleName(self.UrlRole, "url")
+        self.addRoleName(self.FirmwareVersionRole, "firmwareVersion")
+        self.addRoleName(self.UpdateStatusRole, "updateStatus")
+        self.addRoleName(self.PrinterStateRole, "printerState")
+
+        self._registry = NautilusInstances.getInstance()
+        self._poller = NautilusStatusPoller.getInstance()
+
+        self.setItems([self._createItem(name) for name in self._registry.getNames()])
+
+        self._registry.instanceAdded.connect(self._onInstanceAdded)
+        self._registry.instanceChanged.connect(self._onInstanceChanged)
+        self._registry.instanceRemoved.connect(self._onInstanceRemoved)
+        self._poller.statusChanged.connect(self._onStatusChanged)
+        CuraApplication.getInstance().getPreferences().preferenceChanged.connect(self._onPreferenceChanged)
+
+    @classmethod
+    def getInstance(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def _createItem(self, name):
+        printer = self._registry.getPrinter(name)
+        return {
+            "name": name,
+            "url": printer.url,
+            "firmwareVersion": printer.firmware_version,
+            "updateStatus": self._updateStatus(printer.firmware_version),
+            "printerState": self._poller.getStateName(name)
+        }
+
+    def _updateStatus(self, firmware_version):
+        latest = CuraApplication.getInstance().getPreferences().getValue("Nautilus/configversion")
+        try:
+            if Version(firmware_version) < Version(latest):
+                return "Version " + latest + " available!"
+        except Exception:
+            return "Unknown"
+        return "Up-to-Date"
+
+    def _onInstanceAdded(self, name):
+        self.appendItem(self._createItem(name))
+
+    def _onInstanceChanged(self, name):
+        index = self.find("name", name)
+        if index < 0:
+            return
+        item = self._createItem(name)
+        for key in ("url", "firmwareVersion", "updateStatus", "printerState"):
+            if self.getItem(index)[key] != item[key]:
+                self.setProperty(index, key, item[key])
+
+    def _onInstanceRemoved(self, name):
+        index = self.find("name", name)
+        if index >= 0:
+            self.removeItem(index)
+
+    def _onPreferenceChanged(self, key):
+        if key != "Nautilus/configversion":
+            return
+        for index, item in enumerate(self.items):
+            updateStatus = self._updateStatus(item["firmwareVersion"])
+            if item["updateStatus"] != updateStatus:
+                self.setProperty(index, "updateStatus", updateStatus)
+
+    def _onStatusChanged(self, name):
+        index = self.find("name", name)
+        if index < 0:
+            return
+        state = self._poller.getStateName(name)
+        if self.getItem(index)["printerState"] != state:
+            self.setProperty(index, "printerState", state)
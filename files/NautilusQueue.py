@@ -0,0 +1,351 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import json
+import time
+
+from PyQt5.QtCore import QObject, QTimer, pyqtProperty, pyqtSignal, pyqtSlot
+
+from UM.Logger import Logger
+
+from cura.CuraApplication import CuraApplication
+
+from .NautilusCoverage import NautilusCoverage
+from .NautilusInstances import NautilusInstances
+from .NautilusJobCache import NautilusJobCache
+from .NautilusStatus import NautilusStatusPoller
+
+
+##  Jobs waiting for a free printer in a Nautilus farm.
+#
+#   Every job was sliced for one tool cartridge and material and stays pinned
+#   in the job cache until it starts. Whenever a printer is idle the
+#   dispatcher sends it the highest priority job sliced for what the printer
+#   has loaded, oldest first. What a printer has loaded comes from the last
+#   print started on it, or is set by hand in the queue dialog.
+#
+#   Jobs, loaded cartridges and metrics are kept in the Nautilus/job_queue
+#   preference, so they survive a restart.
+class NautilusQueue(QObject):
+    queueChanged = pyqtSignal()
+
+    # milliseconds between dispatch attempts while no printer changes state,
+    # e.g. to retry a job that didn't start
+    DispatchInterval = 30000
+    PersistDelay = 500
+    # seconds of started jobs that jobsPerHour looks back over
+    MetricsWindow = 24 * 3600
+
+    __instance = None
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self._preferences = CuraApplication.getInstance().getPreferences()
+        self._preferences.addPreference("Nautilus/job_queue", "{}")
+        try:
+            stored = json.loads(self._preferences.getValue("Nautilus/job_queue"))
+        except ValueError:
+            Logger.logException("w", "Nautilus/job_queue preference is not valid JSON, starting empty")
+            stored = {}
+        self._jobs = stored.get("jobs", [])
+        # a job that was being sent when Cura closed waits again
+        for job in self._jobs:
+            job["state"] = "queued"
+            job["printer"] = None
+        self._loaded = stored.get("loaded", {})
+        self._started = stored.get("started", [])
+        self._stateTimes = stored.get("stateTimes", {})
+        self._nextId = stored.get("nextId", 1)
+
+        # printer name -> id of the job being sent to it
+        self._sending = {}
+        # printer name -> (state letter, time.time() it was first seen in)
+        self._states = {}
+        # printer name -> time.monotonic() a print last started, the cached
+        # status is stale until a poll after that
+        self._lastStart = {}
+        self._getDevice = None
+
+        self._registry = NautilusInstances.getInstance()
+        self._registry.instanceRemoved.connect(self._onInstanceRemoved)
+        self._poller = NautilusStatusPoller.getInstance()
+        self._poller.statusChanged.connect(self._onStatusChanged)
+
+        self._timer = QTimer()
+        self._timer.setInterval(self.DispatchInterval)
+        self._timer.timeout.connect(self.dispatch)
+
+        self._persistTimer = QTimer()
+        self._persistTimer.setSingleShot(True)
+        self._persistTimer.setInterval(self.PersistDelay)
+        self._persistTimer.timeout.connect(self.flush)
+        CuraApplication.getInstance().applicationShuttingDown.connect(self.flush)
+
+    @classmethod
+    def getInstance(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    ##  Start dispatching. getDevice(name) returns the print output device of
+    #   a saved printer.
+    def start(self, getDevice):
+        self._getDevice = getDevice
+        self._timer.start()
+        self.dispatch()
+
+    def stop(self):
+        self._timer.stop()
+        self._getDevice = None
+
+    ##  Follow a print device, to learn when a job starts or fails to.
+    def watch(self, device):
+        device.printStarted.connect(self._onPrintStarted)
+        device.writeSuccess.connect(self._onSendFinished)
+        device.writeError.connect(self._onSendFinished)
+
+    def _changed(self):
+        self._persistTimer.start()
+        self.queueChanged.emit()
+
+    ##  Write pending changes to the preference right away.
+    def flush(self):
+        self._persistTimer.stop()
+        self._preferences.setValue("Nautilus/job_queue", json.dumps({
+            "jobs": self._jobs,
+            "loaded": self._loaded,
+            "started": self._started,
+            "stateTimes": self._stateTimes,
+            "nextId": self._nextId
+        }))
+
+    ##  Queue a job from the job cache, for printers with the tool cartridge
+    #   and material in its profile. Returns the job's id, or None if the job
+    #   isn't cached.
+    def addJob(self, cacheKey, name, metadata, priority = 0):
+        if not NautilusJobCache.getInstance().pin(cacheKey):
+            Logger.log("w", "Nautilus queue | Not queueing {}, job {} is not cached".format(name, cacheKey))
+            return None
+        profile = metadata.get("profile") or {}
+        job = {
+            "id": self._nextId,
+            "name": name,
+            "cacheKey": cacheKey,
+            "variant": profile.get("variant"),
+            "material": profile.get("material"),
+            "priority": priority,
+            "added": time.time(),
+            "duration": metadata.get("duration"),
+            "state": "queued",
+            "printer": None
+        }
+        self._nextId += 1
+        self._jobs.append(job)
+        Logger.log("i", "Nautilus queue | Queued {} for {} and {}".format(name, job["variant"], job["material"]))
+        self._changed()
+        self.dispatch()
+        return job["id"]
+
+    def _job(self, jobId):
+        return next((job for job in self._jobs if job["id"] == jobId), None)
+
+    def _release(self, job):
+        self._jobs.remove(job)
+        # the same job can be queued more than once
+        if not any(other["cacheKey"] == job["cacheKey"] for other in self._jobs):
+            NautilusJobCache.getInstance().unpin(job["cacheKey"])
+
+    ##  Queued jobs in the order they are dispatched.
+    def getJobs(self):
+        return sorted(self._jobs, key = lambda job: (-job["priority"], job["added"], job["id"]))
+
+    @pyqtSlot(int, result = bool)
+    def removeJob(self, jobId):
+        job = self._job(jobId)
+        if job is None or job["state"] != "queued":
+            return False
+        self._release(job)
+        self._changed()
+        return True
+
+    def setPriority(self, jobId, priority):
+        job = self._job(jobId)
+        if job is not None and job["priority"] != priority:
+            job["priority"] = priority
+            self._changed()
+            self.dispatch()
+
+    ##  Tell the queue what a printer has loaded, e.g. after swapping its
+    #   tool cartridge.
+    @pyqtSlot(str, str, str)
+    def setLoaded(self, printer, variant, material):
+        self._loaded[printer] = {"variant": variant, "material": material}
+        self._changed()
+        self.dispatch()
+
+    def getLoaded(self, printer):
+        return self._loaded.get(printer)
+
+    def _matches(self, job, printer):
+        loaded = self._loaded.get(printer)
+        return loaded is not None and loaded["variant"] == job["variant"] and loaded["material"] == job["material"]
+
+    def _isFree(self, printer):
+        if printer in self._sending or not self._poller.isIdle(printer):
+            return False
+        return self._poller.getStatus(printer).get("received", 0) > self._lastStart.get(printer, 0)
+
+    ##  Send the next matching job to every idle printer.
+    def dispatch(self):
+        if self._getDevice is None:
+            return
+        for printer in self._registry.getNames():
+            if not self._isFree(printer):
+                continue
+            job = next((job for job in self.getJobs() if job["state"] == "queued" and self._matches(job, printer)), None)
+            if job is None:
+                continue
+            if NautilusJobCache.getInstance().lookup(job["cacheKey"]) is None:
+                Logger.log("w", "Nautilus queue | Dropping {}, it is no longer cached".format(job["name"]))
+                self._release(job)
+                self._changed()
+                continue
+            if not self._getDevice(printer).sendCachedJob(job["cacheKey"], job["name"]):
+                continue
+            Logger.log("i", "Nautilus queue | Sending {} to {}".format(job["name"], printer))
+            job["state"] = "sending"
+            job["printer"] = printer
+            self._sending[printer] = job["id"]
+            self._changed()
+
+    def _onPrintStarted(self, device, profile):
+        printer = device.getPrinterName()
+        self._lastStart[printer] = time.monotonic()
+        if profile:
+            self._loaded[printer] = {"variant": profile["variant"], "material": profile["material"]}
+        job = self._job(self._sending.pop(printer, None))
+        if job is not None:
+            self._release(job)
+            now = time.time()
+            self._started = [entry for entry in self._started if entry[0] >= now - self.MetricsWindow]
+            self._started.append([now, printer, job["name"]])
+        self._changed()
+
+    # the upload ended without the job starting: it failed, or the printer
+    # stopped being idle while the file was sent
+    def _onSendFinished(self, device):
+        job = self._job(self._sending.pop(device.getPrinterName(), None))
+        if job is not None:
+            Logger.log("w", "Nautilus queue | {} did not start on {}, queueing it again".format(job["name"], job["printer"]))
+            job["state"] = "queued"
+            job["printer"] = None
+            self._changed()
+
+    def _onStatusChanged(self, printer):
+        state = self._poller.getStatus(printer).get("status")
+        previous = self._states.get(printer)
+        if previous is None or previous[0] != state:
+            now = time.time()
+            if previous is not None and previous[0] in ("I", "P"):
+                times = self._stateTimes.setdefault(printer, {"I": 0.0, "P": 0.0})
+                times[previous[0]] += now - previous[1]
+            self._states[printer] = (state, now)
+            self._changed()
+        self.dispatch()
+
+    def _onInstanceRemoved(self, printer):
+        self._loaded.pop(printer, None)
+        self._stateTimes.pop(printer, None)
+        self._states.pop(printer, None)
+        job = self._job(self._sending.pop(printer, None))
+        if job is not None:
+            job["state"] = "queued"
+            job["printer"] = None
+        self._changed()
+
+    ##  Jobs started per hour over the last day, and the seconds every printer
+    #   spent idle and printing while Cura was watching it.
+    def getMetrics(self):
+        now = time.time()
+        started = [entry for entry in self._started if entry[0] >= now - self.MetricsWindow]
+        hours = max(1.0, (now - started[0][0]) / 3600.0) if started else 1.0
+        printers = {}
+        for printer in self._registry.getNames():
+            times = dict(self._stateTimes.get(printer, {"I": 0.0, "P": 0.0}))
+            current = self._states.get(printer)
+            if current is not None and current[0] in times:
+                times[current[0]] += now - current[1]
+            total = times["I"] + times["P"]
+            printers[printer] = {"idle": times["I"], "printing": times["P"], "utilization": times["P"] / total if total else 0.0}
+        return {"jobsPerHour": len(started) / hours, "started": len(started), "printers": printers}
+
+    @pyqtSlot()
+    def resetMetrics(self):
+        self._started = []
+        self._stateTimes = {}
+        now = time.time()
+        self._states = {printer: (state[0], now) for printer, state in self._states.items()}
+        self._changed()
+
+    # the queue dialog
+
+    @pyqtProperty("QVariantList", notify = queueChanged)
+    def jobs(self):
+        return [{
+            "id": job["id"],
+            "name": job["name"],
+            "profile": "{} / {}".format(job["variant"], job["material"]),
+            "priority": job["priority"],
+            "state": job["printer"] if job["state"] == "sending" else "",
+            "duration": "{:.1f}h".format(job["duration"] / 3600.0) if job.get("duration") else ""
+        } for job in self.getJobs()]
+
+    @pyqtProperty("QVariantList", notify = queueChanged)
+    def printers(self):
+        metrics = self.getMetrics()["printers"]
+        printers = []
+        for printer in self._registry.getNames():
+            loaded = self._loaded.get(printer) or {"variant": "", "material": ""}
+            printers.append({
+                "name": printer,
+                "state": self._poller.getStateName(printer),
+                "variant": loaded["variant"],
+                "material": loaded["material"],
+                "idle": "{:.1f}h idle, {:.0f}% printing".format(metrics[printer]["idle"] / 3600.0, metrics[printer]["utilization"] * 100)
+            })
+        return printers
+
+    @pyqtProperty(str, notify = queueChanged)
+    def metricsText(self):
+        metrics = self.getMetrics()
+        return "{} jobs started in the last day, {:.2f} jobs per hour".format(metrics["started"], metrics["jobsPerHour"])
+
+    @pyqtProperty("QVariantList", constant = True)
+    def variants(self):
+        return NautilusCoverage.getInstance().getVariants()
+
+    @pyqtProperty("QVariantList", constant = True)
+    def materials(self):
+        return NautilusCoverage.getInstance().getMaterials()
+
+    @pyqtSlot(int)
+    def raisePriority(self, jobId):
+        job = self._job(jobId)
+        if job is not None:
+            self.setPriority(jobId, job["priority"] + 1)
+
+    @pyqtSlot(int)
+    def lowerPriority(self, jobId):
+        job = self._job(jobId)
+        if job is not None:
+            self.setPriority(jobId, job["priority"] - 1)
+
@@ -0,0 +1,103 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+from io import StringIO
+from typing import cast
+
+from UM.Logger import Logger
+from UM.Message import Message
+from UM.Mesh.MeshWriter import MeshWriter
+from UM.OutputDevice import OutputDeviceError
+from UM.OutputDevice.OutputDevice import OutputDevice
+from UM.PluginRegistry import PluginRegistry
+
+from cura.CuraApplication import CuraApplication
+
+from .NautilusJobCache import NautilusJobCache
+from .NautilusOutputDevice import NautilusOutputDevice
+from .NautilusQueue import NautilusQueue
+
+from UM.i18n import i18nCatalog
+catalog = i18nCatalog("cura")
+
+
+##  Adds the current job to the farm queue instead of sending it to one
+#   printer. The job is prepared and cached like an upload, then waits in
+#   NautilusQueue for an idle Nautilus with its tool cartridge and material.
+class NautilusQueueDevice(OutputDevice):
+    def __init__(self):
+        super().__init__("nautilus-queue")
+        description = catalog.i18nc("@action:button", "Add to Nautilus farm queue")
+        self.setShortDescription(description)
+        self.setDescription(description)
+        self.setPriority(5)
+
+        self._uploadJob = None
+        self._cacheKey = None
+        self._fileName = None
+
+    def requestWrite(self, nodes, file_name = None, *args, **kwargs):
+        if self._uploadJob is not None:
+            raise OutputDeviceError.DeviceBusyError()
+
+        from .NautilusUploadJob import NautilusUploadJob
+
+        application = CuraApplication.getInstance()
+        preferences = application.getPreferences()
+        self._fileName = "%s.gcode" % application.getPrintInformation().jobName
+        profile = NautilusOutputDevice.jobProfile()
+        if not profile["supported"]:
+            Logger.log("w", "Nautilus queue | No Nautilus profile for {material} on {variant} at {quality_type} ({intent})".format(**profile))
+
+        self.writeStarted.emit(self)
+        jobCache = NautilusJobCache.getInstance()
+        self._cacheKey = jobCache.jobKey(NautilusUploadJob.stageSettings(preferences))
+        entry = jobCache.lookup(self._cacheKey)
+        if entry:
+            self._queue(entry["metadata"])
+            return
+
+        stream = StringIO()
+        gcode_writer = cast(MeshWriter, PluginRegistry.getInstance().getPluginObject("GCodeWriter"))
+        if not gcode_writer.write(stream, None):
+            Logger.log("e", "GCodeWrite failed.")
+            self.writeError.emit(self)
+            return
+
+        limits = NautilusUploadJob.machineLimits(application.getGlobalContainerStack())
+        stages = NautilusUploadJob.uploadStages(preferences)
+        self._uploadJob = NautilusUploadJob(stream.getvalue(), limits, stages, self._cacheKey, self._fileName, profile)
+        self._uploadJob.finished.connect(self._onJobPrepared)
+        self._uploadJob.start()
+
+    def _onJobPrepared(self, job):
+        if job is not self._uploadJob:
+            return
+        self._uploadJob = None
+        if job.getResult() is None:
+            Logger.log("e", "Nautilus queue | Unable to prepare " + self._fileName + ": " + str(job.getError()))
+            message = Message(catalog.i18nc("@info:status", "Unable to queue {}, the job could not be prepared: {}").format(self._fileName, job.getError()))
+            message.show()
+            self.writeError.emit(self)
+            return
+        self._queue(job.getResult())
+
+    def _queue(self, metadata):
+        if NautilusQueue.getInstance().addJob(self._cacheKey, self._fileName, metadata) is None:
+            message = Message(catalog.i18nc("@info:status", "Unable to queue {}, the job could not be cached.").format(self._fileName))
+            message.show()
+            self.writeError.emit(self)
+            return
+        profile = metadata.get("profile") or {}
+        message = Message(catalog.i18nc("@info:status", "Queued {} for the next idle Nautilus with {} and {} loaded.").format(self._fileName, profile.get("variant"), profile.get("material")))
+        message.show()
+        self.writeSuccess.emit(self)
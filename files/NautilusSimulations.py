@@ -0,0 +1,81 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import json
+import re
+import time
+
+from UM.Logger import Logger
+
+from cura.CuraApplication import CuraApplication
+
+# what RepRapFirmware answers when a simulation ends, if rr_fileinfo has no time
+SimulationReply = re.compile(r"will print in (\d+)h (\d+)m")
+
+
+##  Print times measured by simulating jobs on a printer (M37), keyed by the
+#   fingerprint of the file, so the same bytes never need simulating twice.
+class NautilusSimulations:
+    # durations kept, the oldest are dropped first
+    MaxEntries = 500
+
+    __instance = None
+
+    def __init__(self):
+        self._preferences = CuraApplication.getInstance().getPreferences()
+        self._preferences.addPreference("Nautilus/simulated_durations", "{}")
+        try:
+            self._durations = json.loads(self._preferences.getValue("Nautilus/simulated_durations"))
+        except ValueError:
+            Logger.logException("w", "Nautilus/simulated_durations preference is not valid JSON, starting empty")
+            self._durations = {}
+
+    @classmethod
+    def getInstance(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def _key(self, print_fingerprint):
+        return "{crc32:08x}-{size}".format(**print_fingerprint)
+
+    ##  The simulated duration in seconds for a file, or None.
+    def getDuration(self, print_fingerprint):
+        entry = self._durations.get(self._key(print_fingerprint))
+        return entry["duration"] if entry else None
+
+    def setDuration(self, print_fingerprint, duration, fileName, printer):
+        key = self._key(print_fingerprint)
+        self._durations.pop(key, None)
+        self._durations[key] = {"duration": duration, "file": fileName, "printer": printer, "simulated": time.time()}
+        while len(self._durations) > self.MaxEntries:
+            del self._durations[next(iter(self._durations))]
+        self._preferences.setValue("Nautilus/simulated_durations", json.dumps(self._durations))
+
+    ##  Use a simulated duration, if there is one, as the job's estimate.
+    #   The analyzer's estimate is kept as "analyzedDuration".
+    def applyTo(self, metadata):
+        duration = self.getDuration(metadata["fingerprint"]) if "fingerprint" in metadata else None
+        if duration is not None:
+            if "duration" in metadata:
+                metadata["analyzedDuration"] = metadata["duration"]
+            metadata["duration"] = duration
+            metadata["durationSource"] = "simulation"
+        return metadata
+
+
+##  Seconds from the reply RepRapFirmware gives when a simulation ends, or None.
+def parseSimulationReply(reply):
+    match = SimulationReply.search(reply)
+    if match is None:
+        return None
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60
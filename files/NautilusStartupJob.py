@@ -0,0 +1,42 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import time
+
+from UM.Job import Job
+from UM.Logger import Logger
+
+
+##  Installs the plugin files from Nautilus.zip off the main thread, so the
+#   menus and the main window come up first. It is started once Cura's QML
+#   engine exists. Only files are written here. The result is what
+#   installPluginFiles returned, and the plugin applies the preferences and
+#   messages that go with it from the finished handler on the main thread.
+class NautilusStartupJob(Job):
+    def __init__(self, plugin, materialIds):
+        super().__init__()
+        self._plugin = plugin
+        self._materialIds = materialIds
+
+    def run(self):
+        start = time.perf_counter()
+        self.setProgress(0)
+        Logger.log("i", "Time to install!")
+        # installPluginFiles also runs the Upgrader
+        result = self._plugin.installPluginFiles(self._onInstallProgress, self._materialIds)
+        self.setProgress(100)
+        Logger.log("i", "Nautilus startup | install finished in {:.3f}s".format(time.perf_counter() - start))
+        self.setResult(result)
+
+    def _onInstallProgress(self, fraction):
+        # leave the last few percent for the bookkeeping after the zip is extracted
+        self.setProgress(int(fraction * 95))
@@ -0,0 +1,151 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import base64
+import json
+import time
+
+from PyQt5 import QtNetwork
+from PyQt5.QtCore import QObject, QTimer, QUrl, pyqtSignal
+
+from UM.Logger import Logger
+
+from .NautilusInstances import NautilusInstances
+
+
+##  Single-letter machine states reported by RepRapFirmware in rr_status
+StatusNames = {
+    "I": "Idle",
+    "P": "Printing",
+    "S": "Stopped",
+    "C": "Configuring",
+    "A": "Paused",
+    "D": "Pausing",
+    "R": "Resuming",
+    "B": "Busy",
+    "F": "Updating",
+    "H": "Halted",
+    "O": "Off",
+    "M": "Simulating",
+    "T": "Changing tool"
+}
+
+# what a printer is shown as before it has answered, or after it stops answering
+Disconnected = "Disconnected"
+
+
+##  Polls rr_status for every saved printer and keeps the last answer.
+#
+#   Everything that needs to know whether a printer is idle reads the cache
+#   here instead of opening its own blocking request.
+class NautilusStatusPoller(QObject):
+    statusChanged = pyqtSignal(str)
+
+    # milliseconds between polls of the whole fleet, and per request timeout
+    PollInterval = 5000
+    RequestTimeout = 3000
+
+    __instance = None
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self._registry = NautilusInstances.getInstance()
+        self._registry.instanceChanged.connect(self._onInstanceChanged)
+        self._registry.instanceRemoved.connect(self._onInstanceChanged)
+
+        self._qnam = QtNetwork.QNetworkAccessManager()
+        self._statuses = {}
+        self._replies = {}
+
+        self._timer = QTimer()
+        self._timer.setInterval(self.PollInterval)
+        self._timer.timeout.connect(self.poll)
+
+    @classmethod
+    def getInstance(cls):
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def start(self):
+        if not self._timer.isActive():
+            self._timer.start()
+            self.poll()
+
+    def stop(self):
+        self._timer.stop()
+
+    ##  The last rr_status answer for a printer, or an empty dict.
+    def getStatus(self, name):
+        return self._statuses.get(name, {})
+
+    ##  The printer's state as a readable word, e.g. "Idle" or "Printing".
+    def getStateName(self, name):
+        status = self.getStatus(name).get("status")
+        if status is None:
+            return Disconnected
+        return StatusNames.get(status, status)
+
+    ##  Whether the printer answered the last poll.
+    def isConnected(self, name):
+        return "status" in self.getStatus(name)
+
+    ##  Whether the printer answered within the last few polls and is idle.
+    def isIdle(self, name, maxAge = None):
+        status = self.getStatus(name)
+        if maxAge is None:
+            maxAge = 3 * self.PollInterval / 1000
+        return status.get("status") == "I" and time.monotonic() - status.get("received", 0) < maxAge
+
+    def poll(self):
+        for printer in self._registry.getPrinters():
+            if printer.name in self._replies:
+                # still waiting on the previous answer
+                continue
+            request = QtNetwork.QNetworkRequest(QUrl(printer.url + "rr_status?type=3"))
+            request.setRawHeader(b'User-Agent', b'Cura Plugin Nautilus')
+            request.setRawHeader(b'Accept', b'application/json, text/javascript')
+            if printer.http_user and printer.http_password:
+                request.setRawHeader(b'Authorization', b'Basic ' + base64.b64encode("{}:{}".format(printer.http_user, printer.http_password).encode()))
+            reply = self._qnam.get(request)
+            self._replies[printer.name] = reply
+            reply.finished.connect(lambda name = printer.name, reply = reply: self._onReply(name, reply))
+            QTimer.singleShot(self.RequestTimeout, lambda name = printer.name, reply = reply: self._onTimeout(name, reply))
+
+    def _onTimeout(self, name, reply):
+        if self._replies.get(name) is reply:
+            reply.abort()
+
+    def _onReply(self, name, reply):
+        if self._replies.get(name) is reply:
+            del self._replies[name]
+        status = None
+        if reply.error() == QtNetwork.QNetworkReply.NoError:
+            try:
+                status = json.loads(bytes(reply.readAll()).decode())
+                status["received"] = time.monotonic()
+            except ValueError:
+                Logger.log("w", "Unreadable status from {}".format(name))
+        reply.deleteLater()
+
+        previous = self._statuses.get(name, {}).get("status")
+        if status is None:
+            self._statuses.pop(name, None)
+        else:
+            self._statuses[name] = status
+        if (status or {}).get("status") != previous or (status and "fractionPrinted" in status):
+            self.statusChanged.emit(name)
+
+    def _onInstanceChanged(self, name):
+        # forget what we knew, the next poll uses the new connection settings
+        self._statuses.pop(name, None)
+        self.statusChanged.emit(name)
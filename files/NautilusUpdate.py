@@ -1,22 +1,23 @@
 import re
 import os.path
-import json
-from distutils.version import StrictVersion
 from time import sleep
 
-from PyQt5.QtCore import QObject, QUrl, QTimer, pyqtProperty, pyqtSignal, pyqtSlot
-from PyQt5.QtQml import QQmlComponent, QQmlContext
+from PyQt5.QtCore import QObject, pyqtProperty, pyqtSignal, pyqtSlot
 
 from UM.Message import Message
 from UM.Logger import Logger
 
 from UM.Resources import Resources
+from UM.Version import Version
 from UM.Extension import Extension
 from UM.PluginRegistry import PluginRegistry
 from UM.OutputDevice.OutputDevicePlugin import OutputDevicePlugin
 
 from . import NautilusOutputDevice
 from . import NautilusDuet
+from .NautilusInstances import NautilusInstances
+from .NautilusPrinterModel import NautilusPrinterModel
+from .NautilusStatus import NautilusStatusPoller
 from UM.i18n import i18nCatalog
 catalog = i18nCatalog("cura")
 
@@ -24,31 +25,42 @@ from cura.CuraApplication import CuraApplication
 from cura.MachineAction import MachineAction
 
 class NautilusUpdate(MachineAction, QObject):#, Extension, OutputDevicePlugin):
+    __instance = None
+
     def __init__(self, parent=None):
         super().__init__("NautilusUpdate", catalog.i18nc("@action", "Update Firmware"))
+        NautilusUpdate.__instance = self
         self._qml_url = os.path.join(Resources.getStoragePath(Resources.Resources), "plugins","Nautilus","Nautilus",'qml','NautilusUpdate.qml')
         self.updatePrinter = ''
-        Logger.log('i','jkll')
-        CuraApplication.getInstance().getPreferences().addPreference("Nautilus/instances", json.dumps({}))
-        self._instances = json.loads(CuraApplication.getInstance().getPreferences().getValue("Nautilus/instances"))
+        self._registry = NautilusInstances.getInstance()
+        self._registry.instanceAdded.connect(self._onInstancesChanged)
+        self._registry.instanceChanged.connect(self._onInstancesChanged)
+        self._registry.instanceRemoved.connect(self._onInstancesChanged)
         #self.firmwareListChanged.connect(self.instanceFirmwareVersionString)
         #self.firmwareListChanged.connect(self.needsUpdateString)
 
+    @classmethod
+    def getInstance(cls):
+        return cls.__instance
+
     firmwareListChanged = pyqtSignal()
     @pyqtProperty("QVariantList", notify=firmwareListChanged)
     def serverList(self):
-        #bigguy = json.loads(CuraApplication.getInstance().getPreferences().getValue("Nautilus/instances"))
-        self.data = list(self._instances.keys())
-        #Logger.log('i','This is the guy: '+str(data))
-        self._instances = json.loads(CuraApplication.getInstance().getPreferences().getValue("Nautilus/instances"))
-        return self.data
+        return self._registry.getNames()
+
+    @pyqtProperty(QObject, constant=True)
+    def printerModel(self):
+        return NautilusPrinterModel.getInstance()
+
+    def _onInstancesChanged(self, name):
+        self.firmwareListChanged.emit()
 
     def thingsChanged(self):
         self.firmwareListChanged.emit()
         #path = os.path.join(PluginRegistry.getInstance().getPluginPath(self.getPluginId()), "qml", "NautilusUpdate.qml")
         #Logger.log("i", "Creating Nautilus preferences UI ")
         #self._application.createQmlComponent(path, {"manager": self}).show()
-        NautilusDuet.NautilusDuet().thingsChanged()
+        NautilusDuet.NautilusDuet.getInstance().thingsChanged()
 
     @pyqtSlot(str)
     def setUpdatePrinter(self, name):
@@ -57,56 +69,61 @@ class NautilusUpdate(MachineAction, QObject):#, Extension, OutputDevicePlugin):
     @pyqtSlot()
     def updateConfirm(self):
         Logger.log('i','updateconfirm')
-        if self.updatePrinter in self._instances.keys():
-            NautilusDuet.NautilusDuet().updateButton(self.updatePrinter)
+        if self._registry.hasPrinter(self.updatePrinter):
+            NautilusDuet.NautilusDuet.getInstance().updateButton(self.updatePrinter)
         else:
             mess = Message("@info","There was an error!")
             mess.show()
 
     @pyqtSlot()
     def firmwareCheck(self):
-        for name in self._instances.keys():
-            NautilusDuet.NautilusDuet().updateFirmwareCheck(name)
+        for name in self._registry.getNames():
+            NautilusDuet.NautilusDuet.getInstance().updateFirmwareCheck(name)
         sleep(.5)
         self.firmwareListChanged.emit()
-        NautilusDuet.NautilusDuet().thingsChanged()
+        NautilusDuet.NautilusDuet.getInstance().thingsChanged()
 
     @pyqtSlot(str, result=str)
     def instanceUrl(self, name):
-        if name in self._instances.keys():
-            index = len(self._instances[name]["url"])-1
-            return self._instances[name]["url"][7:index]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            index = len(printer.url)-1
+            return printer.url[7:index]
         return None
 
     @pyqtSlot(str, result=str)
     def instanceDuetPassword(self, name):
-        if name in self._instances.keys():
-            return self._instances[name]["duet_password"]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            return printer.duet_password
         return None
 
     @pyqtSlot(str, result=str)
     def instanceHTTPUser(self, name):
-        if name in self._instances.keys():
-            return self._instances[name]["http_user"]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            return printer.http_user
         return None
 
     @pyqtSlot(str, result=str)
     def instanceHTTPPassword(self, name):
-        if name in self._instances.keys():
-            return self._instances[name]["http_password"]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            return printer.http_password
         return None
 
     @pyqtSlot(str, result=str)
     def instanceFirmwareVersion(self, name):
-        if name in self._instances.keys():
-            return self._instances[name]["firmware_version"]
+        printer = self._registry.getPrinter(name)
+        if printer:
+            return printer.firmware_version
 
     @pyqtSlot(str, result=str)
     def needsUpdate(self, name):
-        if name in self._instances.keys():
-            Logger.log('i','returning: '+str(name))
+        printer = self._registry.getPrinter(name)
+        if printer:
             firmVersion = CuraApplication.getInstance().getPreferences().getValue("Nautilus/configversion")
-            if StrictVersion(self._instances[name]["firmware_version"])<StrictVersion(firmVersion):
+            if Version(printer.firmware_version)<Version(firmVersion):
                 return firmVersion+" available!"
             else:
                 return "Up-to-Date"
@@ -130,13 +147,10 @@ class NautilusUpdate(MachineAction, QObject):#, Extension, OutputDevicePlugin):
 
     @pyqtSlot(str, result = bool)
     def statusCheck(self, name):
-        if len(name)<1:
-            name = self.data[0]
-        Logger.log('d','were gettin '+str(name))
-        try:
-            return NautilusDuet.NautilusDuet().statusCheck(name)
-        except:
-            return False
+        if len(name)<1 and self._registry.getNames():
+            name = self._registry.getNames()[0]
+        # answered from the status poller's cache, this runs on every selection change
+        return NautilusStatusPoller.getInstance().isConnected(name)
 
 """
 
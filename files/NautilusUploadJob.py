@@ -0,0 +1,111 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+import time
+
+from UM.Job import Job
+from UM.Logger import Logger
+
+from .NautilusAnalyzer import NautilusAnalyzer, DefaultLimits
+from .NautilusFingerprints import fingerprint
+from .NautilusJobCache import NautilusJobCache
+from .NautilusLayerIndex import layerIndex
+from .NautilusPipeline import ArcFitter, Compactor, runStages
+
+
+##  Prepares the g-code of an upload off the main thread: runs the print time
+#   and filament analysis, then the post-processing stages, so the window
+#   stays responsive on large files. The result is the metadata dict sent
+#   along with the upload, getData() the encoded file to upload and
+#   getLayerIndex() its layer index sidecar. With a cacheKey both are also
+#   kept in the job cache under that key. If preparing fails the result is
+#   None and getError() holds the exception.
+class NautilusUploadJob(Job):
+    def __init__(self, gcode, limits, stages = None, cacheKey = None, name = None, profile = None):
+        super().__init__()
+        self._gcode = gcode
+        self._limits = limits
+        self._stages = stages or []
+        self._cacheKey = cacheKey
+        self._name = name
+        self._profile = profile
+        self._data = None
+        self._layerIndex = None
+
+    ##  The analyzer limits of the machine on this stack, from its machine_*
+    #   settings. Call this on the main thread, before starting the job.
+    @classmethod
+    def machineLimits(cls, global_stack):
+        return {key: global_stack.getProperty("machine_" + key, "value") for key in DefaultLimits}
+
+    ##  The plugin preferences that decide the post-processing stages.
+    @classmethod
+    def stageSettings(cls, preferences):
+        return {key: preferences.getValue(key) for key in ("Nautilus/arc_fitting", "Nautilus/arc_tolerance", "Nautilus/compact_gcode")}
+
+    ##  The post-processing stages turned on in the plugin preferences.
+    @classmethod
+    def uploadStages(cls, preferences):
+        settings = cls.stageSettings(preferences)
+        stages = []
+        if settings["Nautilus/arc_fitting"]:
+            stages.append(ArcFitter(float(settings["Nautilus/arc_tolerance"])))
+        # compaction goes last so it also shortens the arcs
+        if settings["Nautilus/compact_gcode"]:
+            stages.append(Compactor())
+        return stages
+
+    def getData(self):
+        return self._data
+
+    def getLayerIndex(self):
+        return self._layerIndex
+
+    def run(self):
+        try:
+            self.setResult(self._prepare())
+        except Exception as e:
+            # the result stays None, the device reports getError()
+            Logger.logException("e", "Unable to prepare the g-code for upload")
+            self.setError(e)
+
+    def _prepare(self):
+        start = time.perf_counter()
+        try:
+            metadata = NautilusAnalyzer(self._limits).analyze(self._gcode)
+        except Exception:
+            # the upload shouldn't fail because the estimate did
+            Logger.logException("w", "Unable to analyze the g-code for upload")
+            metadata = {}
+        # the per layer estimates go into the sidecar, not the metadata
+        layers = metadata.pop("layers", [])
+        Logger.log("d", "Nautilus upload | g-code analyzed in {:.3f}s".format(time.perf_counter() - start))
+
+        if self._stages:
+            start = time.perf_counter()
+            self._gcode = runStages(self._gcode, self._stages)
+            metadata["postprocessing"] = [stage.report() for stage in self._stages]
+            for report in metadata["postprocessing"]:
+                Logger.log("i", "Nautilus upload | {stage} removed {lines} lines and {bytes} bytes".format(**report))
+            Logger.log("d", "Nautilus upload | g-code post-processed in {:.3f}s".format(time.perf_counter() - start))
+
+        self._data = self._gcode.encode()
+        self._gcode = None
+        metadata["fingerprint"] = fingerprint(self._data)
+        metadata["profile"] = self._profile
+        self._layerIndex = layerIndex(self._data, layers, metadata["fingerprint"])
+        if self._cacheKey:
+            try:
+                NautilusJobCache.getInstance().store(self._cacheKey, self._name, self._data, metadata, self._layerIndex)
+            except OSError:
+                Logger.logException("w", "Unable to cache the uploaded Nautilus job")
+        return metadata
@@ -0,0 +1,244 @@
+####################################################################
+# Hydra Research Nautilus plugin for Ultimaker Cura
+# A plugin to install config files and Duet functionality
+# for the Nautilus printer
+#
+# Written by Zach Rose
+#
+# This plugin is released under the terms of the LGPLv3 or higher.
+# The full text of the LGPLv3 License can be found here:
+# https://github.com/HydraResearchLLC/Nautilus/blob/master/LICENSE
+####################################################################
+
+# This module must not import Uranium or Cura: releaser.py loads it by
+# file path to check a build before it is zipped.
+
+import configparser
+import json
+import os
+import xml.etree.ElementTree as ElementTree
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+Problem = namedtuple("Problem", ["severity", "file", "message"])
+
+# definitions whose settings tree every other resource refers to
+SettingDefinitions = ["hrfdmprinter", "hrfdmextruder"]
+
+# shipped as plain json, installPluginFiles turns it into a definition
+ExcludedMaterials = "hydra_research_excluded_materials.json"
+
+MaterialNamespace = "{http://www.ultimaker.com/material}"
+
+
+##  Checks a Nautilus resource tree, laid out the way Nautilus.zip is, before
+#   it is shipped or installed.
+#
+#   Every file is parsed once, in parallel, then each cross-reference
+#   (definition, material, variant, quality type) and each setting key is
+#   resolved against what the tree itself provides. Errors are things that
+#   make Cura hide or reject a profile; unknown setting keys, which Cura
+#   ignores, and setting_version drift are warnings.
+class NautilusValidator:
+    def __init__(self, names, read, expectedSettingVersion = None, jobs = None):
+        self._names = sorted(names)
+        self._read = read
+        self._expectedSettingVersion = expectedSettingVersion
+        self._jobs = jobs
+        self._problems = []
+
+    ##  Validate the files below a directory.
+    @classmethod
+    def fromDirectory(cls, root, **kwargs):
+        names = []
+        for (dirpath, dirnames, filenames) in os.walk(root):
+            names += [os.path.relpath(os.path.join(dirpath, file), root).replace(os.sep, "/") for file in filenames]
+
+        def read(name):
+            with open(os.path.join(root, name), "rb") as f:
+                return f.read()
+        return cls(names, read, **kwargs)
+
+    ##  Validate the members of an open zipfile.ZipFile.
+    @classmethod
+    def fromZip(cls, zip_ref, **kwargs):
+        return cls([info.filename for info in zip_ref.infolist() if not info.is_dir()], zip_ref.read, **kwargs)
+
+    def _error(self, file, message):
+        self._problems.append(Problem("error", file, message))
+
+    def _warning(self, file, message):
+        self._problems.append(Problem("warning", file, message))
+
+    def _parse(self, name):
+        base = os.path.basename(name)
+        try:
+            if base.endswith(".def.json") or base == ExcludedMaterials:
+                return "definition", json.loads(self._read(name).decode("utf-8"))
+            if base.endswith(".fdm_material"):
+                return "material", ElementTree.fromstring(self._read(name))
+            if base.endswith(".cfg"):
+                parser = configparser.ConfigParser(interpolation = None, allow_no_value = True)
+                parser.optionxform = str
+                parser.read_string(self._read(name).decode("utf-8"))
+                kind = "profile" if base.endswith(".inst.cfg") else "visibility"
+                return kind, {section: dict(parser[section]) for section in parser.sections()}
+        except Exception as e:
+            return "unreadable", str(e)
+        return None, None
+
+    ##  Parse and check everything, returning a list of Problems.
+    def validate(self):
+        self._problems = []
+        with ThreadPoolExecutor(max_workers = self._jobs) as pool:
+            parsed = dict(zip(self._names, pool.map(self._parse, self._names)))
+
+        files = {}
+        for name, (kind, data) in parsed.items():
+            if kind == "unreadable":
+                self._error(name, "can't be parsed: " + data)
+            elif kind is not None:
+                files.setdefault(kind, {})[name] = data
+
+        definitions = {os.path.basename(name).split(".", 1)[0]: (name, data) for name, data in files.get("definition", {}).items()}
+        settings = self._settingKeys(definitions)
+        self._checkDefinitions(definitions, settings)
+        materials = self._checkMaterials(files.get("material", {}))
+        profiles = files.get("profile", {})
+        variants = self._checkVariants(profiles, definitions, settings)
+        self._checkProfiles(profiles, definitions, materials, variants, settings)
+        self._checkSettingVersions(profiles)
+        self._checkVisibility(files.get("visibility", {}), settings)
+        return self._problems
+
+    def _settingKeys(self, definitions):
+        keys = set()
+        for definitionId in SettingDefinitions:
+            if definitionId not in definitions:
+                self._error(definitionId + ".def.json", "is missing, setting keys can't be checked")
+                continue
+            pending = [definitions[definitionId][1].get("settings", {})]
+            while pending:
+                for key, setting in pending.pop().items():
+                    keys.add(key)
+                    pending.append(setting.get("children", {}))
+        return keys
+
+    def _checkDefinitions(self, definitions, settings):
+        for definitionId, (name, data) in definitions.items():
+            inherits = data.get("inherits")
+            if inherits and inherits not in definitions and inherits not in ("fdmprinter", "fdmextruder"):
+                self._error(name, "inherits unknown definition " + inherits)
+            if settings:
+                for key in data.get("overrides", {}):
+                    if key not in settings:
+                        self._warning(name, "overrides unknown setting " + key)
+
+    def _checkMaterials(self, materials):
+        ids = {}
+        guids = {}
+        for name, root in materials.items():
+            materialId = os.path.basename(name).split(".", 1)[0]
+            ids[materialId] = name
+            guid = root.findtext(MaterialNamespace + "metadata/" + MaterialNamespace + "GUID")
+            if not guid:
+                self._error(name, "has no GUID")
+            elif guid in guids:
+                self._error(name, "shares GUID {} with {}".format(guid, guids[guid]))
+            else:
+                guids[guid] = name
+        return ids
+
+    def _checkVariants(self, profiles, definitions, settings):
+        variants = {}
+        for name, sections in profiles.items():
+            if sections.get("metadata", {}).get("type") != "variant":
+                continue
+            self._checkProfileBase(name, sections, definitions, settings)
+            variantName = sections.get("general", {}).get("name")
+            if variantName in variants:
+                self._error(name, "duplicates variant {} from {}".format(variantName, variants[variantName]))
+            variants[variantName] = name
+        return variants
+
+    def _checkProfileBase(self, name, sections, definitions, settings):
+        for section in ("general", "metadata", "values"):
+            if section not in sections:
+                self._error(name, "has no [{}] section".format(section))
+        definition = sections.get("general", {}).get("definition")
+        if definition not in definitions:
+            self._error(name, "refers to unknown definition {}".format(definition))
+        if settings:
+            for key in sections.get("values", {}):
+                if key not in settings:
+                    self._warning(name, "sets unknown setting " + key)
+
+    def _checkProfiles(self, profiles, definitions, materials, variants, settings):
+        qualities = set()
+        combinations = {}
+        intents = []
+        for name, sections in profiles.items():
+            metadata = sections.get("metadata", {})
+            kind = metadata.get("type")
+            if kind not in ("quality", "intent"):
+                if kind != "variant":
+                    self._error(name, "has unknown profile type {}".format(kind))
+                continue
+            self._checkProfileBase(name, sections, definitions, settings)
+            if not metadata.get("quality_type"):
+                self._error(name, "has no quality_type")
+            if metadata.get("global_quality") == "True":
+                continue
+            material = metadata.get("material")
+            variant = metadata.get("variant")
+            if material not in materials:
+                self._error(name, "refers to unknown material {}".format(material))
+            if variant not in variants:
+                self._error(name, "refers to unknown variant {}".format(variant))
+            combination = (material, variant, metadata.get("quality_type"), metadata.get("intent_category", "default"))
+            if combination in combinations:
+                self._error(name, "covers the same combination as {}".format(combinations[combination]))
+            combinations[combination] = name
+            if kind == "quality":
+                qualities.add(combination[:3])
+            else:
+                intents.append((name, combination[:3]))
+        for name, quality in intents:
+            if quality not in qualities:
+                self._error(name, "has no {} quality profile for {} on {}".format(quality[2], quality[0], quality[1]))
+
+    def _checkSettingVersions(self, profiles):
+        # an empty setting_version is filled in at install time
+        versions = {}
+        for name, sections in profiles.items():
+            metadata = sections.get("metadata", {})
+            if metadata.get("setting_version"):
+                versions.setdefault(metadata.get("type"), {})[name] = metadata["setting_version"]
+        for kind, byFile in sorted(versions.items()):
+            expected = self._expectedSettingVersion
+            if expected is None:
+                # no target given, report files that drifted from the rest of their kind
+                expected = Counter(byFile.values()).most_common(1)[0][0]
+            for name, version in sorted(byFile.items()):
+                if version != str(expected):
+                    self._warning(name, "has setting_version {}, other {} profiles have {}".format(version, kind, expected))
+
+    def _checkVisibility(self, visibility, settings):
+        if not settings:
+            return
+        for name, sections in visibility.items():
+            for section, keys in sections.items():
+                if section == "general":
+                    continue
+                for key in keys:
+                    if key not in settings:
+                        self._warning(name, "shows unknown setting " + key)
+
+
+##  One line per problem (or per error only), followed by a count of both.
+def formatReport(problems, showWarnings = True):
+    lines = ["{}: {} {}".format(problem.severity, problem.file, problem.message) for problem in problems
+             if showWarnings or problem.severity == "error"]
+    errors = sum(1 for problem in problems if problem.severity == "error")
+    lines.append("{} errors, {} warnings".format(errors, len(problems) - errors))
+    return "\n".join(lines)
@@ -1,5 +1,6 @@
 
 import configparser
+import json
 import os
 import zipfile
 
@@ -7,7 +8,20 @@ from UM.Resources import Resources
 from UM.Logger import Logger
 
 from . import Nautilus
+from .NautilusCoverage import NautilusCoverage
 
+# releaser.py lists every member of Nautilus.zip, and where it is installed, in this file
+ArchiveIndex = "nautilus_index.json"
+
+def archiveIndex(zip_ref):
+    #Returns {member: {"destination", "size", "sha256"}} or None for archives without an index
+    try:
+        return json.loads(zip_ref.read(ArchiveIndex).decode("utf-8"))["members"]
+    except KeyError:
+        return None
+    except ValueError:
+        Logger.logException("w", "Nautilus.zip has an unreadable member index")
+        return None
 
 class Upgrader:
     def __init__(self):
@@ -42,7 +56,13 @@ class Upgrader:
         zipdata = os.path.join(path,"Nautilus.zip")
 
         with zipfile.ZipFile(zipdata, "r") as zip_ref:
-            for info in zip_ref.infolist():
+            index = archiveIndex(zip_ref)
+            if index is not None:
+                newSets = {"materials": newMats, "variants": newVars, "quality": newQuals, "intent": newIntents}
+                for name, entry in index.items():
+                    if entry["destination"] in newSets:
+                        newSets[entry["destination"]].add(os.path.basename(name).split('.',1)[0])
+            for info in ([] if index is not None else zip_ref.infolist()):
                 #Logger.log("i","!@!  "+str(info.filename))
                 if info.filename.endswith("fdm_material"):
                     matName = os.path.basename(str(info.filename))
@@ -61,6 +81,12 @@ class Upgrader:
                     newQuals.add(qualName.split('.',1)[0])
                     #Logger.log("i", "Finding New Quality: "+str(os.path.basename(info.filename)))
 
+        coverage = NautilusCoverage(zipdata)
+        if coverage.isAvailable():
+            #the coverage table lists exactly the profiles this release ships
+            newQuals = coverage.getProfileNames("quality")
+            newIntents = coverage.getProfileNames("intent")
+
         oldMats -= newMats
         oldVars -= newVars
         oldQuals -= newQuals
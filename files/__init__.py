@@ -1,26 +1,44 @@
 # Copyright (c) 2015 Ultimaker B.V.
 # Cura is released under the terms of the LGPLv3 or higher.
 
-from . import Nautilus
-from . import NautilusDuet
-from . import NautilusUpdate
-
+import time
 
+from UM.Logger import Logger
 from UM.i18n import i18nCatalog
 catalog = i18nCatalog("cura")
 
+# Every Cura launch pays for importing the plugin modules, so keep the
+# time spent in register() below this many seconds. releaser.py checks
+# the same budget at build time.
+IMPORT_BUDGET = 0.25
+
 def getMetaData():
     return {
 
     }
 
 def register(app):
+    # the plugin modules are imported here rather than at package import so
+    # Cura only loads them once it actually registers the plugin
+    importStart = time.perf_counter()
+    from . import Nautilus
+    from . import NautilusDuet
+    from . import NautilusUpdate
+    importTime = time.perf_counter() - importStart
+    if importTime > IMPORT_BUDGET:
+        Logger.log("w", "Nautilus plugin import took {:.3f}s, over the {:.3f}s budget".format(importTime, IMPORT_BUDGET))
+    else:
+        Logger.log("d", "Nautilus plugin import took {:.3f}s".format(importTime))
+
+    # one NautilusDuet serves as extension, output device plugin and machine
+    # action, the rest of the plugin reaches it through getInstance()
+    duet = NautilusDuet.NautilusDuet()
     return {"extension": [
         Nautilus.Nautilus(),
-        NautilusDuet.NautilusDuet()],
+        duet],
         "output_device":
-        [NautilusDuet.NautilusDuet(),
+        [duet,
         NautilusUpdate.NautilusUpdate()],
         "machine_action":
-        [ NautilusDuet.NautilusDuet()]
+        [ duet]
     }
@@ -104,13 +104,17 @@ Cura.MachineAction
                   left: parent.left;
               }
 
-              model: manager.serverList;
+              model: manager.printerModel;
 
               delegate: Rectangle {
                   width: parent.width;
                   height: 20;
                   color: ListView.isCurrentItem ? palette.highlight : index % 2 ? palette.base : palette.alternateBase;
-                  property string name: modelData.toString();
+                  property string name: model.name;
+                  property string url: model.url;
+                  property string firmwareVersion: model.firmwareVersion;
+                  property string updateStatus: model.updateStatus;
+                  property string printerState: model.printerState;
 
                   Text {
                       text: "   " + name;
@@ -118,6 +122,13 @@ Cura.MachineAction
                       // color: wrapper.ListView.isCurrentItem ? "white" : "black" ##This did not work, but should
                   }
 
+                  Text {
+                      text: printerState + "   ";
+                      anchors.right: parent.right;
+                      anchors.verticalCenter: parent.verticalCenter;
+                      color: palette.mid;
+                  }
+
                   MouseArea {
                       anchors.fill: parent;
                       onClicked: {
@@ -152,7 +163,10 @@ Cura.MachineAction
               }
 
               Label { text: catalog.i18nc("@label", "Nautilus IP Address (url)"); }
-              Text { font.bold: true; text: manager.instanceUrl(dialog.currentName); }
+              Text { font.bold: true; text: instanceList.currentItem ? instanceList.currentItem.url : ""; }
+
+              Label { text: catalog.i18nc("@label", "Status"); }
+              Text { font.bold: true; text: instanceList.currentItem ? instanceList.currentItem.printerState : ""; }
 
               Label { text: catalog.i18nc("@label", "Nautilus Password"); }
               Text { font.bold: true; text: manager.instanceDuetPassword(dialog.currentName); }
@@ -163,6 +177,21 @@ Cura.MachineAction
               Label { text: catalog.i18nc("@label", "HTTP Basic Auth: password"); }
               Text { font.bold: true; text: manager.instanceHTTPPassword(dialog.currentName); }
 
+              Label { text: catalog.i18nc("@label", "Recent jobs"); visible: manager.recentJobs.length > 0; }
+              Row {
+                  spacing: dialog.defaultHorizontalMargin
+                  visible: manager.recentJobs.length > 0
+                  ComboBox {
+                      id: recentJobBox
+                      width: 250 * screenScaleFactor
+                      model: manager.recentJobs
+                  }
+                  Button {
+                      text: catalog.i18nc("@action:button", "Resend recent job")
+                      onClicked: manager.resendJob(dialog.currentName, recentJobBox.currentIndex)
+                  }
+              }
+
               //Label { text: catalog.i18nc("@label", "Firmware Version"); }
               //Text { font.bold: true; text: manager.instanceFirmwareVersion(dialog.currentName); }
 
@@ -0,0 +1,123 @@
+import QtQuick 2.4
+import QtQuick.Controls 2.1
+import QtQuick.Layouts 1.1
+import QtQuick.Window 2.1
+
+import UM 1.2 as UM
+import Cura 1.0 as Cura
+
+UM.Dialog
+{
+    id: dialog
+
+    minimumWidth: 650 * screenScaleFactor
+    minimumHeight: 450 * screenScaleFactor
+    title: catalog.i18nc("@title:window", "Nautilus Farm Queue")
+
+    UM.I18nCatalog { id: catalog; name: "cura"; }
+    SystemPalette { id: palette }
+
+    ColumnLayout {
+        anchors.fill: parent
+        spacing: 10
+
+        Label {
+            text: catalog.i18nc("@label", "Printers")
+            font.bold: true
+        }
+
+        Repeater {
+            model: manager.printers
+
+            RowLayout {
+                Label {
+                    text: modelData.name + " (" + modelData.state + ")"
+                    Layout.preferredWidth: 160 * screenScaleFactor
+                    elide: Text.ElideRight
+                }
+                ComboBox {
+                    id: variantBox
+                    model: manager.variants
+                    currentIndex: manager.variants.indexOf(modelData.variant)
+                    implicitWidth: 100 * screenScaleFactor
+                }
+                ComboBox {
+                    id: materialBox
+                    model: manager.materials
+                    currentIndex: manager.materials.indexOf(modelData.material)
+                    implicitWidth: 200 * screenScaleFactor
+                }
+                Button {
+                    text: catalog.i18nc("@action:button", "Set loaded")
+                    enabled: variantBox.currentIndex != -1 && materialBox.currentIndex != -1
+                    onClicked: manager.setLoaded(modelData.name, variantBox.currentText, materialBox.currentText)
+                }
+                Label {
+                    text: modelData.idle
+                    color: palette.mid
+                }
+            }
+        }
+
+        Label {
+            text: catalog.i18nc("@label", "Queued jobs")
+            font.bold: true
+        }
+
+        ListView {
+            id: jobList
+            Layout.fillWidth: true
+            Layout.fillHeight: true
+            clip: true
+            model: manager.jobs
+
+            delegate: Rectangle {
+                width: jobList.width
+                height: 28 * screenScaleFactor
+                color: index % 2 ? palette.base : palette.alternateBase
+
+                RowLayout {
+                    anchors.fill: parent
+                    anchors.leftMargin: 5
+
+                    Label {
+                        text: modelData.name
+                        Layout.fillWidth: true
+                        elide: Text.ElideRight
+                    }
+                    Label { text: modelData.profile; color: palette.mid }
+                    Label { text: modelData.duration }
+                    Label {
+                        text: modelData.state ? catalog.i18nc("@label", "sending to ") + modelData.state : catalog.i18nc("@label", "priority ") + modelData.priority
+                    }
+                    Button {
+                        text: "+"
+                        implicitWidth: 28 * screenScaleFactor
+                        onClicked: manager.raisePriority(modelData.id)
+                    }
+                    Button {
+                        text: "-"
+                        implicitWidth: 28 * screenScaleFactor
+                        onClicked: manager.lowerPriority(modelData.id)
+                    }
+                    Button {
+                        text: catalog.i18nc("@action:button", "Remove")
+                        enabled: !modelData.state
+                        onClicked: manager.removeJob(modelData.id)
+                    }
+                }
+            }
+        }
+
+        RowLayout {
+            Label {
+                text: manager.metricsText
+                Layout.fillWidth: true
+            }
+            Button {
+                text: catalog.i18nc("@action:button", "Reset metrics")
+                onClicked: manager.resetMetrics()
+            }
+        }
+    }
+}
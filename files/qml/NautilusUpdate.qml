@@ -56,7 +56,8 @@ Cura.MachineAction
           ComboBox{
               id: instanceList
               anchors.verticalCenter: printerRow.verticalCenter;
-              model: manager.serverList;
+              model: manager.printerModel;
+              textRole: "name";
               onCurrentIndexChanged: { dialog.connectedPrinter = manager.statusCheck(currentText);}
             }
 
@@ -15,7 +15,7 @@ UM.Dialog
     property string installStatusText
 
     minimumWidth: 400 * screenScaleFactor
-    minimumHeight: 350 * screenScaleFactor
+    minimumHeight: 510 * screenScaleFactor
     title: catalog.i18nc("@label", "Nautilus Plugin Preferences")
 
     function checkBooleanVals(val) {
@@ -110,7 +110,50 @@ UM.Dialog
             anchors.margins: 10
             anchors.horizontalCenter: parent.horizontalCenter
             text: catalog1.i18nc("@action:button", "Reset Material Prices")
-            onClicked: manager.addMatCosts()
+            onClicked: manager.resetMatCosts()
+          }
+          CheckBox {
+            id: arcFitting
+            anchors.top: resetprice.bottom
+            anchors.margins: 10
+            anchors.horizontalCenter: parent.horizontalCenter
+            text: catalog1.i18nc("@option:check", "Fit arcs (G2/G3) to curves before uploading")
+            checked: checkBooleanVals(UM.Preferences.getValue("Nautilus/arc_fitting"))
+            onClicked: UM.Preferences.setValue("Nautilus/arc_fitting", checked)
+          }
+          RowLayout {
+            id: arcToleranceRow
+            anchors.top: arcFitting.bottom
+            anchors.horizontalCenter: parent.horizontalCenter
+            enabled: arcFitting.checked
+            Label {
+              text: catalog1.i18nc("@label", "Arc tolerance (mm)")
+            }
+            TextField {
+              id: arcTolerance
+              implicitWidth: 80
+              text: UM.Preferences.getValue("Nautilus/arc_tolerance")
+              validator: DoubleValidator { bottom: 0.001; top: 1.0 }
+              onEditingFinished: UM.Preferences.setValue("Nautilus/arc_tolerance", parseFloat(text))
+            }
+          }
+          CheckBox {
+            id: compactGcode
+            anchors.top: arcToleranceRow.bottom
+            anchors.margins: 10
+            anchors.horizontalCenter: parent.horizontalCenter
+            text: catalog1.i18nc("@option:check", "Strip comments and redundant words before uploading")
+            checked: checkBooleanVals(UM.Preferences.getValue("Nautilus/compact_gcode"))
+            onClicked: UM.Preferences.setValue("Nautilus/compact_gcode", checked)
+          }
+          CheckBox {
+            id: preheat
+            anchors.top: compactGcode.bottom
+            anchors.margins: 10
+            anchors.horizontalCenter: parent.horizontalCenter
+            text: catalog1.i18nc("@option:check", "Preheat idle printers while uploading")
+            checked: checkBooleanVals(UM.Preferences.getValue("Nautilus/preheat_while_uploading"))
+            onClicked: UM.Preferences.setValue("Nautilus/preheat_while_uploading", checked)
           }
           Button {
                 id: button
@@ -119,7 +162,7 @@ UM.Dialog
                     id: catalog1
                     name: "cura"
                 }
-                anchors.top: resetprice.bottom
+                anchors.top: preheat.bottom
                 anchors.margins: 10
                 anchors.horizontalCenter: parent.horizontalCenter
                 text: catalog1.i18nc("@action:button", "Report Issue")
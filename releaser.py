@@ -3,10 +3,22 @@
 # for the Nautilus plugin
 
 import os
+import re
+import importlib.util
+import json
+import math
+import struct
+import time
+import configparser
+import argparse
+import filecmp
+import hashlib
+import subprocess
+import sys
 import tempfile
-from distutils.dir_util import copy_tree
 import zipfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 
 path = os.path.dirname(os.path.realpath(__file__))
@@ -27,98 +39,563 @@ try:
 except:
     pass
 
-def filer(filePath):
-    try:
-        os.makedirs(filePath)
-    except OSError:
-        print("error creating folders for path ", str(filePath))
-
 def fileList(fileName):
     files = list()
     for (dirpath, dirnames, filenames) in os.walk(fileName):
         files += [os.path.join(dirpath, file) for file in filenames]
     return files
 
-print("Do you want intent profiles? y or n ")
-flag = str(input())
-
-# Create the resources temp directory in the appropriate structure for the plugin
-with tempfile.TemporaryDirectory() as configDirectory:
-    # Create the plugin temp directory
-    with tempfile.TemporaryDirectory() as pluginDirectory:
-        filer(os.path.join(pluginDirectory, pluginPath))
-        # Build Resources zip
-        for folder in resourceList:
-            # sort through resources: definitions, extruders, meshes,
-            # materials, quality, and variants
-            file = os.path.join(resourcePath, folder)
-            singletons = ['definitions', 'extruders', 'meshes']
-            if os.path.basename(file) in singletons:
-                copy_tree(file, configDirectory)
-            elif os.path.basename(file) == 'materials':
-                filer(os.path.join(configDirectory, matContainer))
-                matList = fileList(file)
-                mats = (mat for mat in matList if mat.endswith('.fdm_material'))
-                for mat in mats:
-                    shutil.copy(mat, os.path.join(configDirectory, matContainer))
-            elif os.path.basename(file) == 'quality':
-                filer(os.path.join(configDirectory, qualContainer))
-                qualList = fileList(file)
-                quals = (qual for qual in qualList if qual.endswith('.inst.cfg'))
-                for qual in quals:
-                    shutil.copy(qual, os.path.join(configDirectory, qualContainer))
-            elif os.path.basename(file) == 'variants':
-                filer(os.path.join(configDirectory, varContainer))
-                varList = fileList(file)
-                vars = (var for var in varList if var.endswith('.inst.cfg'))
-                for var in vars:
-                    shutil.copy(var, os.path.join(configDirectory, varContainer))
-            elif os.path.basename(file) == 'setting_visibility':
-                filer(os.path.join(configDirectory, setvisContainer))
-                setvisList = fileList(file)
-                settings = (set for set in setvisList if set.endswith('.cfg'))
-                for set in settings:
-                    shutil.copy(set,os.path.join(configDirectory, setvisContainer))
-            elif os.path.basename(file) == 'intent':
-                if "y" in flag:
-                    filer(os.path.join(configDirectory,intentContainer))
-                    intentList = fileList(file)
-                    intents = (intent for intent in intentList if intent.endswith('.inst.cfg'))
-                    for intent in intents:
-                        shutil.copy(intent,os.path.join(configDirectory,intentContainer))
-                elif "n" in flag:
-                    print("No intents ")
-                else:
-                    print("something went wrong, neither flag occured")
-
-
-
-        # Zip the resources excluding useless OSX files, this could be adapted to
-        # exclude useless files from other operating systems
-        with zipfile.ZipFile(resourceContainer, 'w') as zipper:
-            finalResources = fileList(configDirectory)
-            for res in finalResources:
-                if res != '.DS_Store' and 'Icon' not in res:
-                    zipper.write(os.path.join(configDirectory, res), os.path.relpath(res,configDirectory))
-        zipper.close()
-        shutil.copy(resourceContainer, os.path.join(pluginDirectory,pluginPath))
-        filer(ultimakerReleasePath)
-        shutil.copy(resourceContainer, ultimakerReleasePath)
-
-        # include the necessary files from the root path
-        copy_tree(sourcePath, os.path.join(pluginDirectory,pluginPath))
-        copy_tree(sourcePath, ultimakerReleasePath)
-        utils = ['icon.png', 'LICENSE', 'package.json']
-        for util in utils:
-            shutil.copy(os.path.join(path, util), pluginDirectory)
-
-        # zip the file as a .curapackage so it's ready to go
-        with zipfile.ZipFile(os.path.join(path, pluginName+'.curapackage'), 'w') as zf:
-            pluginFiles = fileList(pluginDirectory)
-            # add everything relevant
-            for item in pluginFiles:
-                if '.DS_Store' not in item:
-                    zf.write(os.path.join(pluginDirectory, item), os.path.relpath(item, pluginDirectory))
-                    shutil.copy(item,ultimakerReleasePath)
-        zf.close()
-        print("Update version numbers before release!")
+def profileText(template, material, overrides):
+    # one quality or intent file in the layout Cura and the old hand-written files use
+    metadata = dict(template['metadata'], **overrides.get('metadata', {}))
+    metadata['material'] = material
+    metadata['variant'] = template['variant']
+    values = dict(template['values'], **overrides.get('values', {}))
+    lines = ['[general]', 'version = 4', 'name = ' + template['name'], 'definition = hydra_research_nautilus', '', '[metadata]']
+    lines += ['{} = {}'.format(key, val) for key, val in metadata.items()]
+    lines += ['', '[values]']
+    lines += ['{} = {}'.format(key, val) for key, val in values.items()]
+    return '\n'.join(lines) + '\n'
+
+def expandProfiles(source, kind, destination):
+    # write the quality or intent files described by the profile templates;
+    # each material lists the templates it has and any per-profile deltas
+    profiles = json.load(open(source))
+    templates = profiles['templates'][kind]
+    count = 0
+    for material, entry in profiles['materials'].items():
+        for templateId in entry.get(kind, []):
+            overrides = entry.get('overrides', {}).get(templateId, {})
+            fileName = 'hrn_{}_{}.inst.cfg'.format(material[len('hr_'):], templateId)
+            with open(os.path.join(destination, fileName), 'w') as f:
+                f.write(profileText(templates[templateId], material, overrides))
+            count += 1
+    return count
+
+# Setting properties that hold python expressions referring to other settings
+expressionProperties = ['value', 'enabled', 'resolve', 'minimum_value', 'maximum_value',
+                        'minimum_value_warning', 'maximum_value_warning', 'limit_to_extruder']
+# Material profile keys that Cura maps onto settings with a different name
+materialSettingKeys = {'print temperature': 'material_print_temperature',
+                       'heated bed temperature': 'material_bed_temperature',
+                       'standby temperature': 'material_standby_temperature',
+                       'print cooling': 'cool_fan_speed',
+                       'retraction amount': 'retraction_amount',
+                       'retraction speed': 'retraction_speed',
+                       'adhesion tendency': 'material_adhesion_tendency',
+                       'surface energy': 'material_surface_energy',
+                       'shrinkage percentage': 'material_shrinkage_percentage',
+                       'build volume temperature': 'build_volume_temperature'}
+identifierPattern = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+def settingTree(settings, parent=None, tree=None):
+    # flatten a definition's settings into {key: (setting, parent key)}
+    if tree is None:
+        tree = {}
+    for key, setting in settings.items():
+        tree[key] = (setting, parent)
+        settingTree(setting.get('children', {}), key, tree)
+    return tree
+
+def profileSettingKeys(root):
+    # every setting a Nautilus resource mentions, plus the expressions they use
+    keys = set()
+    expressions = []
+    for file in fileList(root):
+        name = os.path.basename(file)
+        if name.endswith('.def.json') and 'hrfdm' not in name:
+            overrides = json.load(open(file)).get('overrides', {})
+            keys.update(overrides.keys())
+            for override in overrides.values():
+                expressions += [str(override[prop]) for prop in expressionProperties if prop in override]
+        elif name.endswith('.inst.cfg'):
+            parser = configparser.ConfigParser(interpolation=None)
+            parser.read(file)
+            if parser.has_section('values'):
+                keys.update(parser['values'].keys())
+                expressions += [val for val in parser['values'].values() if val.startswith('=')]
+        elif name.endswith('.cfg') and 'setting_visibility' in file:
+            parser = configparser.ConfigParser(interpolation=None, allow_no_value=True)
+            parser.read(file)
+            for section in parser.sections():
+                keys.update(parser[section].keys())
+        elif name.endswith('.fdm_material'):
+            for key in re.findall(r'key="([^"]+)"', open(file).read()):
+                keys.add(materialSettingKeys.get(key, key))
+        elif name == 'nautilus_profiles.json':
+            profiles = json.load(open(file))
+            templates = list(profiles['templates']['quality'].values()) + list(profiles['templates']['intent'].values())
+            values = [template['values'] for template in templates]
+            values += [override.get('values', {}) for entry in profiles['materials'].values() for override in entry.get('overrides', {}).values()]
+            for value in values:
+                keys.update(value.keys())
+                expressions += [str(val) for val in value.values() if str(val).startswith('=')]
+    return keys, expressions
+
+def pruneDefinition(definition, roots, expressions):
+    # keep the root settings, everything their expressions reach, and the
+    # categories and parents needed to hold them in the tree
+    tree = settingTree(definition['settings'])
+    keep = set()
+    pending = [key for key in roots if key in tree]
+    pending += [name for text in expressions for name in identifierPattern.findall(text) if name in tree]
+    pending += [key for key, (setting, parent) in tree.items() if setting.get('type') == 'category'
+                or key.startswith('machine_') or key.startswith('material_')]
+    while pending:
+        key = pending.pop()
+        if key in keep:
+            continue
+        keep.add(key)
+        setting, parent = tree[key]
+        if parent:
+            pending.append(parent)
+        for prop in expressionProperties:
+            if prop in setting:
+                pending += [name for name in identifierPattern.findall(str(setting[prop])) if name in tree]
+
+    def prune(settings):
+        kept = {}
+        for key, setting in settings.items():
+            if key not in keep:
+                continue
+            if 'children' in setting:
+                setting = dict(setting, children=prune(setting['children']))
+            kept[key] = setting
+        return kept
+
+    pruned = dict(definition, settings=prune(definition['settings']))
+    return pruned, len(tree), len(keep)
+
+def parseTime(text, runs=5):
+    start = time.perf_counter()
+    for run in range(runs):
+        json.loads(text)
+    return (time.perf_counter() - start) / runs
+
+def optimizeDefinition(configDirectory, prune):
+    # rewrite the shipped hrfdmprinter without whitespace (and optionally pruned)
+    # and report what that saves on every Cura launch
+    defFile = os.path.join(configDirectory, 'hrfdmprinter.def.json')
+    original = open(defFile).read()
+    definition = json.loads(original)
+    if prune:
+        roots, expressions = profileSettingKeys(resourcePath)
+        definition, before, after = pruneDefinition(definition, roots, expressions)
+        print("Pruned hrfdmprinter from {} to {} settings".format(before, after))
+    minified = json.dumps(definition, separators=(',', ':'), ensure_ascii=False)
+    with open(defFile, 'w') as f:
+        f.write(minified)
+    originalTime, minifiedTime = parseTime(original), parseTime(minified)
+    print("hrfdmprinter.def.json: {} -> {} bytes ({:.1f}% saved), parse {:.1f}ms -> {:.1f}ms".format(
+        len(original.encode()), len(minified.encode()), 100 * (1 - len(minified.encode()) / len(original.encode())),
+        originalTime * 1000, minifiedTime * 1000))
+
+def readStl(data):
+    # binary STL: 80 byte header, facet count, then normal, three vertices
+    # and an attribute word per facet
+    count = struct.unpack_from('<I', data, 80)[0]
+    facets = [(values[3:6], values[6:9], values[9:12]) for values in struct.iter_unpack('<12fH', data[84:84 + 50 * count])]
+    return data[:80], facets
+
+def writeStl(header, facets):
+    chunks = [header, struct.pack('<I', len(facets))]
+    for facet in facets:
+        normal = facetNormal(*facet)
+        length = math.sqrt(sum(n * n for n in normal)) or 1.0
+        chunks.append(struct.pack('<12fH', *([n / length for n in normal] + [c for vertex in facet for c in vertex] + [0])))
+    return b''.join(chunks)
+
+def facetNormal(a, b, c):
+    u = [b[i] - a[i] for i in range(3)]
+    w = [c[i] - a[i] for i in range(3)]
+    return (u[1] * w[2] - u[2] * w[1], u[2] * w[0] - u[0] * w[2], u[0] * w[1] - u[1] * w[0])
+
+def decimateMesh(facets, tolerance):
+    # vertex clustering: vertices sharing a grid cell whose diagonal is the
+    # tolerance merge into their mean, so none moves further than that.
+    # Facets that collapse, have no area or repeat another are dropped.
+    if tolerance > 0:
+        cell = tolerance / math.sqrt(3)
+        key = lambda vertex: tuple(math.floor(c / cell) for c in vertex)
+    else:
+        key = lambda vertex: vertex
+    sums = {}
+    for facet in facets:
+        for vertex in facet:
+            total = sums.setdefault(key(vertex), [0.0, 0.0, 0.0, 0])
+            for i in range(3):
+                total[i] += vertex[i]
+            total[3] += 1
+    merged = {cluster: (t[0] / t[3], t[1] / t[3], t[2] / t[3]) for cluster, t in sums.items()}
+    seen = set()
+    kept = []
+    for facet in facets:
+        clusters = tuple(key(vertex) for vertex in facet)
+        if len(set(clusters)) < 3:
+            continue
+        # the same facet starting from a different corner is still a duplicate
+        first = clusters.index(min(clusters))
+        canonical = clusters[first:] + clusters[:first]
+        points = tuple(merged[cluster] for cluster in clusters)
+        if canonical in seen or math.sqrt(sum(n * n for n in facetNormal(*points))) < 1e-9:
+            continue
+        seen.add(canonical)
+        kept.append(points)
+    return kept
+
+def optimizeMesh(configDirectory, tolerance):
+    # ship a lighter build plate mesh unless the full detail one is asked for
+    meshFile = os.path.join(configDirectory, 'hydra_research_nautilus_platform.stl')
+    original = open(meshFile, 'rb').read()
+    header, facets = readStl(original)
+    if tolerance is None:
+        print("Platform mesh: shipping the full detail mesh ({} triangles)".format(len(facets)))
+        return
+    decimated = writeStl(header, decimateMesh(facets, tolerance))
+    with open(meshFile, 'wb') as f:
+        f.write(decimated)
+    originalTime = min(timeCall(readStl, original) for run in range(3))
+    decimatedTime = min(timeCall(readStl, decimated) for run in range(3))
+    print("Platform mesh: {} -> {} triangles, {} -> {} bytes, load {:.1f}ms -> {:.1f}ms (tolerance {}mm)".format(
+        len(facets), (len(decimated) - 84) // 50, len(original), len(decimated), originalTime * 1000, decimatedTime * 1000, tolerance))
+
+def timeCall(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+# Modules that should only be imported on first use, never while Cura loads the plugin
+lazyModules = ['requests', 'ssl', 'zipfile', 'configparser', 'distutils', 'urllib.request', 'tempfile']
+
+# Imports the plugin package the way Cura does (package, then the modules
+# register() pulls in) in a fresh interpreter and prints the elapsed time,
+# the budget and any lazy module the plugin loaded that Cura hadn't already.
+importProbe = '''
+import importlib.util, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("Nautilus", sys.argv[1], submodule_search_locations=[sys.argv[2]])
+package = importlib.util.module_from_spec(spec)
+sys.modules["Nautilus"] = package
+spec.loader.exec_module(package)
+for module in ("Nautilus", "NautilusDuet", "NautilusUpdate"):
+    importlib.import_module("Nautilus." + module)
+print(time.perf_counter() - start)
+print(package.IMPORT_BUDGET)
+print(" ".join(name for name in sys.argv[3:] if name in sys.modules and name not in before))
+'''
+
+def checkImportBudget():
+    # With Cura's python the plugin is measured against the real Uranium and
+    # Cura. Anywhere else tests/test_import_budget.py stands them in with stubs,
+    # which still catches the plugin's own modules going over budget
+    try:
+        import UM, cura
+    except ImportError:
+        print("Cura is not importable from this python, checking the import budget with stubs")
+        result = subprocess.run([sys.executable, '-m', 'unittest', '-q', 'tests.test_import_budget'], cwd=path)
+        if result.returncode != 0:
+            sys.exit("Plugin import is over budget or pulled in modules that should load lazily")
+        return
+    # warm the interpreter's own caches first so only the plugin is measured
+    preload = "import UM.Application, cura.CuraApplication, PyQt5.QtCore, PyQt5.QtNetwork"
+    result = subprocess.run([sys.executable, '-c', preload + importProbe, os.path.join(sourcePath, '__init__.py'), sourcePath] + lazyModules,
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    elapsed, budget, loaded = (result.stdout.strip().split('\n') + [''])[:3]
+    print("Plugin import took {:.3f}s (budget {}s)".format(float(elapsed), budget))
+    if loaded.strip():
+        sys.exit("Plugin import pulled in modules that should load lazily: " + loaded)
+    if float(elapsed) > float(budget):
+        sys.exit("Plugin import is over budget")
+
+# Fixed timestamp and permissions for every archive member, so the same
+# inputs always produce byte-identical archives
+zipDate = (1980, 1, 1, 0, 0, 0)
+zipMode = 0o644 << 16
+cacheFile = os.path.join(path, '.releaser-cache.json')
+singletons = ['definitions', 'extruders', 'meshes']
+utils = ['icon.png', 'LICENSE', 'package.json']
+# Nautilus.zip carries this index of its members at the top level
+archiveIndex = 'nautilus_index.json'
+# and this table of the material, cartridge and quality combinations it has profiles for
+coverageIndex = 'nautilus_coverage.json'
+containerDestinations = {matContainer: 'materials', qualContainer: 'quality', intentContainer: 'intent',
+                         varContainer: 'variants', setvisContainer: 'setting_visibility'}
+compressionMethods = {'stored': zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED, 'lzma': zipfile.ZIP_LZMA}
+storedExtensions = ('.png', '.jpg', '.gz', '.zip')
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Build Nautilus.zip and the Nautilus .curapackage")
+    parser.add_argument('--intents', dest='intents', action='store_true', default=True,
+                        help="include the intent profiles (default)")
+    parser.add_argument('--no-intents', dest='intents', action='store_false',
+                        help="leave the intent profiles out")
+    # Pruning drops every setting the Nautilus resources never reach. CuraEngine
+    # still asks for settings no profile mentions, so it stays opt-in until a
+    # pruned build has been sliced against.
+    parser.add_argument('--prune-definition', action='store_true',
+                        help="drop the hrfdmprinter settings no Nautilus resource uses")
+    parser.add_argument('--mesh-tolerance', type=float, default=0.5,
+                        help="how far (mm) decimation may move a build plate mesh vertex")
+    parser.add_argument('--full-detail-mesh', action='store_true',
+                        help="ship the build plate mesh as it is instead of decimating it")
+    parser.add_argument('--show-warnings', action='store_true',
+                        help="list every validation warning, not just the count")
+    parser.add_argument('--force', action='store_true',
+                        help="rebuild even if no input changed since the last build")
+    # LZMA is smallest but needs a Cura whose python was built with lzma
+    parser.add_argument('--compression', choices=sorted(compressionMethods), default='deflate',
+                        help="how the text members of Nautilus.zip are compressed")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="compare Nautilus.zip size and install time for every compression method")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 4,
+                        help="number of files copied, read and hashed at once")
+    return parser.parse_args()
+
+def shipped(fileName):
+    # skip OSX clutter and bytecode, neither belongs in a release
+    return '.DS_Store' not in fileName and '__pycache__' not in fileName
+
+def readFile(fileName):
+    with open(fileName, 'rb') as f:
+        return f.read()
+
+def fileDigest(fileName):
+    digest = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def inputDigest(pool, roots, options):
+    # one hash over the build options and every input file's path and contents
+    files = sorted(f for root in roots for f in (fileList(root) if os.path.isdir(root) else [root]) if shipped(f))
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode())
+    for fileName, fileHash in zip(files, pool.map(fileDigest, files)):
+        digest.update(os.path.relpath(fileName, path).replace(os.sep, '/').encode() + b'\0' + fileHash.encode() + b'\0')
+    return digest.hexdigest()
+
+def loadCache():
+    try:
+        with open(cacheFile) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def saveCache(cache):
+    with open(cacheFile, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+
+def upToDate(cache, stage, digest, output):
+    # the stage is skipped only if its inputs match the last build and the
+    # archive it wrote is still there, untouched
+    entry = cache.get(stage, {})
+    return entry.get('inputs') == digest and os.path.exists(output) and fileDigest(output) == entry.get('output')
+
+def memberCompression(name, compression):
+    # already compressed data is stored, everything else (profiles,
+    # definitions, the mesh, python) uses the requested method
+    if name.lower().endswith(storedExtensions):
+        return zipfile.ZIP_STORED
+    return compressionMethods[compression]
+
+def writeArchive(archive, members, pool, compression='deflate'):
+    # members maps archive names to source files; the files are read in the
+    # pool and written in sorted order with fixed metadata
+    names = sorted(members)
+    contents = pool.map(readFile, [members[name] for name in names])
+    with zipfile.ZipFile(archive + '.partial', 'w') as zipper:
+        for name, data in zip(names, contents):
+            info = zipfile.ZipInfo(name, zipDate)
+            info.compress_type = memberCompression(name, compression)
+            info.external_attr = zipMode
+            zipper.writestr(info, data)
+    os.replace(archive + '.partial', archive)
+    print("Wrote {} ({} files, {} bytes, {})".format(os.path.basename(archive), len(names), os.path.getsize(archive), compression))
+
+def memberDestination(name):
+    # where installPluginFiles puts a Nautilus.zip member, by the same rules
+    # it has always applied to the file names
+    folder, base = os.path.split(name)
+    if folder in containerDestinations:
+        return containerDestinations[folder]
+    if base == 'hydra_research_excluded_materials.json':
+        return 'excluded'
+    if base == 'hydra_research_nautilus_extruder.def.json':
+        return 'extruders'
+    if base.endswith('.def.json'):
+        return 'definitions'
+    if base.endswith('.stl'):
+        return 'meshes'
+    return None
+
+def writeIndex(configDirectory, members, pool):
+    # precomputed member -> destination, size and hash table, so installing
+    # and upgrading don't have to classify the archive themselves
+    names = sorted(members)
+    index = {}
+    for name, digest in zip(names, pool.map(fileDigest, [members[name] for name in names])):
+        index[name] = {'destination': memberDestination(name), 'size': os.path.getsize(members[name]), 'sha256': digest}
+    indexFile = os.path.join(configDirectory, archiveIndex)
+    with open(indexFile, 'w') as f:
+        json.dump({'version': 1, 'members': index}, f, separators=(',', ':'), sort_keys=True)
+    members[archiveIndex] = indexFile
+
+def installTime(archive, runs=3):
+    # what installPluginFiles does with the archive: read the index, then
+    # extract every member; best of a few runs
+    best = None
+    for run in range(runs):
+        with tempfile.TemporaryDirectory() as target:
+            start = time.perf_counter()
+            with zipfile.ZipFile(archive) as zipper:
+                index = json.loads(zipper.read(archiveIndex).decode())['members']
+                for name in index:
+                    zipper.extract(name, path=target)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def benchmarkArchive(members, pool):
+    # compare the archive size and install time of each compression method
+    print("Benchmarking Nautilus.zip compression")
+    with tempfile.TemporaryDirectory() as scratch:
+        for compression in sorted(compressionMethods):
+            archive = os.path.join(scratch, compression + '.zip')
+            writeArchive(archive, members, pool, compression)
+            print("  {:8} {:>9} bytes  install {:.1f}ms".format(compression, os.path.getsize(archive), installTime(archive) * 1000))
+
+def stageResources(configDirectory, pool, options):
+    # lay the resources out the way Nautilus.zip is installed: definitions,
+    # extruders and meshes at the top, everything else in its container
+    containers = {'materials': (matContainer, '.fdm_material'),
+                  'quality': (qualContainer, '.inst.cfg'),
+                  'variants': (varContainer, '.inst.cfg'),
+                  'setting_visibility': (setvisContainer, '.cfg')}
+    copies = []
+    for folder in resourceList:
+        file = os.path.join(resourcePath, folder)
+        if folder in singletons:
+            copies += [(res, os.path.join(configDirectory, os.path.relpath(res, file))) for res in fileList(file) if shipped(res)]
+        elif folder in containers:
+            container, extension = containers[folder]
+            copies += [(res, os.path.join(configDirectory, container, os.path.basename(res))) for res in fileList(file) if res.endswith(extension)]
+    for directory in set(os.path.dirname(destination) for source, destination in copies) | {os.path.join(configDirectory, qualContainer)}:
+        os.makedirs(directory, exist_ok=True)
+    list(pool.map(lambda copy: shutil.copy(*copy), copies))
+
+    optimizeDefinition(configDirectory, options['prune'])
+    optimizeMesh(configDirectory, options['mesh_tolerance'])
+    # material quality and intent profiles are generated from templates
+    profileSource = os.path.join(resourcePath, 'profiles', 'nautilus_profiles.json')
+    print("Generated {} quality profiles".format(expandProfiles(profileSource, 'quality', os.path.join(configDirectory, qualContainer))))
+    if options['intents']:
+        os.makedirs(os.path.join(configDirectory, intentContainer))
+        print("Generated {} intent profiles".format(expandProfiles(profileSource, 'intent', os.path.join(configDirectory, intentContainer))))
+    else:
+        print("No intents ")
+    writeCoverage(configDirectory)
+
+def writeCoverage(configDirectory):
+    # which profile serves each material, cartridge, quality type and intent,
+    # as {material: {variant: {quality_type: {intent: member}}}}; the global
+    # qualities are listed by quality type alone
+    coverage = {'version': 1, 'global': {}, 'profiles': {}}
+    count = 0
+    for container in (qualContainer, intentContainer):
+        for file in sorted(fileList(os.path.join(configDirectory, container))):
+            parser = configparser.ConfigParser(interpolation=None)
+            parser.read(file)
+            metadata = parser['metadata']
+            member = os.path.relpath(file, configDirectory).replace(os.sep, '/')
+            if metadata.get('global_quality') == 'True':
+                coverage['global'][metadata['quality_type']] = member
+                continue
+            variants = coverage['profiles'].setdefault(metadata['material'], {})
+            intents = variants.setdefault(metadata['variant'], {}).setdefault(metadata['quality_type'], {})
+            intents[metadata.get('intent_category', 'default')] = member
+            count += 1
+    with open(os.path.join(configDirectory, coverageIndex), 'w') as f:
+        json.dump(coverage, f, separators=(',', ':'), sort_keys=True)
+    print("Indexed {} profiles for {} materials".format(count, len(coverage['profiles'])))
+
+def validateResources(configDirectory, jobs, showWarnings):
+    # the plugin's own validator, loaded by path since the plugin package
+    # needs Cura to import
+    spec = importlib.util.spec_from_file_location('NautilusValidator', os.path.join(sourcePath, 'NautilusValidator.py'))
+    validator = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(validator)
+    start = time.perf_counter()
+    problems = validator.NautilusValidator.fromDirectory(configDirectory, jobs=jobs).validate()
+    errors = [problem for problem in problems if problem.severity == 'error']
+    print(validator.formatReport(problems, showWarnings))
+    print("Validated resources in {:.0f}ms".format((time.perf_counter() - start) * 1000))
+    if errors:
+        sys.exit("Resource validation failed")
+
+def packageMembers():
+    # the .curapackage holds the plugin sources and Nautilus.zip under
+    # files/plugins/Nautilus, and the package metadata at the top
+    members = {'/'.join([pluginPath.replace(os.sep, '/'), os.path.relpath(source, sourcePath).replace(os.sep, '/')]): source
+               for source in fileList(sourcePath) if shipped(source)}
+    members['/'.join([pluginPath.replace(os.sep, '/'), os.path.basename(resourceContainer)])] = resourceContainer
+    for util in utils:
+        members[util] = os.path.join(path, util)
+    return members
+
+def syncFile(source, destination):
+    if os.path.exists(destination) and filecmp.cmp(source, destination, shallow=False):
+        return False
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    shutil.copy(source, destination)
+    return True
+
+def syncRelease(pool, members):
+    # mirror the package contents into the Ultimaker release folder, copying
+    # only what changed
+    prefix = pluginPath.replace(os.sep, '/') + '/'
+    destinations = [os.path.join(ultimakerReleasePath, *name[len(prefix):].split('/')) if name.startswith(prefix) else os.path.join(ultimakerReleasePath, name)
+                    for name in members]
+    copied = sum(pool.map(syncFile, list(members.values()), destinations))
+    print("Updated {} of {} files in {}".format(copied, len(members), ultimakerReleasePath))
+
+def build(args):
+    start = time.perf_counter()
+    cache = loadCache()
+    options = {'intents': args.intents, 'prune': args.prune_definition, 'compression': args.compression,
+               'mesh_tolerance': None if args.full_detail_mesh else args.mesh_tolerance}
+    packageFile = os.path.join(path, pluginName + '.curapackage')
+    releaser = os.path.realpath(__file__)
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        validatorSource = os.path.join(sourcePath, 'NautilusValidator.py')
+        resourceDigest = inputDigest(pool, [resourcePath, releaser, validatorSource], options)
+        if not (args.force or args.benchmark) and upToDate(cache, 'resources', resourceDigest, resourceContainer):
+            print("Nautilus.zip is up to date")
+        else:
+            with tempfile.TemporaryDirectory() as configDirectory:
+                stageResources(configDirectory, pool, options)
+                validateResources(configDirectory, args.jobs, args.show_warnings)
+                members = {os.path.relpath(res, configDirectory).replace(os.sep, '/'): res
+                           for res in fileList(configDirectory) if shipped(res) and 'Icon' not in res}
+                writeIndex(configDirectory, members, pool)
+                if args.benchmark:
+                    benchmarkArchive(members, pool)
+                writeArchive(resourceContainer, members, pool, args.compression)
+            cache['resources'] = {'inputs': resourceDigest, 'output': fileDigest(resourceContainer)}
+            saveCache(cache)
+
+        members = packageMembers()
+        packageDigest = inputDigest(pool, sorted(set(members.values())) + [releaser], {})
+        if not args.force and upToDate(cache, 'package', packageDigest, packageFile):
+            print(os.path.basename(packageFile) + " is up to date")
+        else:
+            checkImportBudget()
+            writeArchive(packageFile, members, pool)
+            cache['package'] = {'inputs': packageDigest, 'output': fileDigest(packageFile)}
+            saveCache(cache)
+
+        syncRelease(pool, members)
+    print("Build finished in {:.1f}s".format(time.perf_counter() - start))
+    print("Update version numbers before release!")
+
+build(parseArguments())
@@ -0,0 +1,77 @@
+# Stand-ins for Uranium, Cura and PyQt5, so the plugin's modules can be
+# imported by the tests without Cura.
+
+import importlib.abc
+import importlib.util
+import os
+import sys
+import types
+
+sourcePath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'files')
+
+StubbedPackages = ('UM', 'cura', 'PyQt5')
+
+
+class _StubType(type):
+    def __getattr__(cls, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Stub()
+
+
+# stands in for any class, function, decorator or signal
+class _Stub(metaclass = _StubType):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        # used as a decorator, hand the function back
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return _Stub()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Stub()
+
+    # enum values like Qt.UserRole + 1
+    def __add__(self, other):
+        return _Stub()
+
+    __radd__ = __or__ = __ror__ = __add__
+
+
+class _StubModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        stub = _StubType(name, (_Stub,), {})
+        setattr(self, name, stub)
+        return stub
+
+
+class _StubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def find_spec(self, fullname, path, target = None):
+        if fullname.split('.')[0] in StubbedPackages:
+            return importlib.util.spec_from_loader(fullname, self, is_package = True)
+        return None
+
+    def create_module(self, spec):
+        return _StubModule(spec.name)
+
+    def exec_module(self, module):
+        module.__path__ = []
+
+
+##  Stub out Uranium, Cura and PyQt5 and import files/ as the package
+#   Nautilus, the way Cura loads the plugin. Returns the package.
+def loadPackage():
+    if not any(isinstance(finder, _StubFinder) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _StubFinder())
+    if 'Nautilus' not in sys.modules:
+        spec = importlib.util.spec_from_file_location('Nautilus', os.path.join(sourcePath, '__init__.py'), submodule_search_locations = [sourcePath])
+        package = importlib.util.module_from_spec(spec)
+        sys.modules['Nautilus'] = package
+        spec.loader.exec_module(package)
+    return sys.modules['Nautilus']
@@ -0,0 +1,35 @@
+# Checks how upload records are matched against what the printer reports.
+
+import importlib
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pluginstubs
+
+pluginstubs.loadPackage()
+NautilusFingerprints = importlib.import_module('Nautilus.NautilusFingerprints')
+
+
+class SameModifiedTimeTest(unittest.TestCase):
+    def test_exact_match(self):
+        self.assertTrue(NautilusFingerprints.sameModifiedTime("2026-10-19T12:30:04", "2026-10-19T12:30:04"))
+
+    def test_odd_second_upload(self):
+        # FAT keeps an upload stamped at :05 as :04
+        self.assertTrue(NautilusFingerprints.sameModifiedTime("2026-10-19T12:30:05", "2026-10-19T12:30:04"))
+
+    def test_odd_second_across_a_minute(self):
+        self.assertTrue(NautilusFingerprints.sameModifiedTime("2026-10-19T12:59:59", "2026-10-19T12:59:58"))
+
+    def test_modified_later(self):
+        self.assertFalse(NautilusFingerprints.sameModifiedTime("2026-10-19T12:30:05", "2026-10-19T12:30:10"))
+
+    def test_missing_or_unreadable(self):
+        self.assertFalse(NautilusFingerprints.sameModifiedTime("2026-10-19T12:30:05", None))
+        self.assertFalse(NautilusFingerprints.sameModifiedTime("2026-10-19T12:30:05", "yesterday"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# Checks that importing the plugin, the way Cura's register() does, stays
+# within files/__init__.py's IMPORT_BUDGET and leaves the heavy modules for
+# first use. Uranium, Cura and PyQt5 are replaced by empty stand-ins, so this
+# runs without Cura and measures only the plugin's own modules.
+
+import ast
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pluginstubs
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# plugin modules that must only load when a job is sent or the queue is used
+LazyPluginModules = ['NautilusAnalyzer', 'NautilusPipeline', 'NautilusUploadJob', 'NautilusQueue', 'NautilusQueueDevice']
+
+
+# stdlib modules releaser.py already keeps out of the import, read from there
+# so the two lists can't drift apart
+def releaserLazyModules():
+    with open(os.path.join(root, 'releaser.py')) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'lazyModules' for target in node.targets):
+            return ast.literal_eval(node.value)
+    return []
+
+
+##  Import the plugin in this interpreter and print the elapsed time, the
+#   budget and the lazy modules that got imported, as JSON.
+def probe(watched):
+    before = set(sys.modules)
+    start = time.perf_counter()
+    package = pluginstubs.loadPackage()
+    # the modules register() imports
+    for module in ('Nautilus', 'NautilusDuet', 'NautilusUpdate'):
+        importlib.import_module('Nautilus.' + module)
+    elapsed = time.perf_counter() - start
+    loaded = [name for name in watched if name in sys.modules and name not in before]
+    print(json.dumps({'elapsed': elapsed, 'budget': package.IMPORT_BUDGET, 'loaded': loaded}))
+
+
+class ImportBudgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # a fresh interpreter, so nothing imported by the test runner counts
+        watched = releaserLazyModules() + ['numpy'] + ['Nautilus.' + name for name in LazyPluginModules]
+        result = subprocess.run([sys.executable, os.path.abspath(__file__)] + watched,
+                                stdout = subprocess.PIPE, universal_newlines = True, check = True)
+        cls.result = json.loads(result.stdout.strip().splitlines()[-1])
+
+    def test_within_budget(self):
+        self.assertLessEqual(self.result['elapsed'], self.result['budget'],
+                             "Plugin import took {:.3f}s, over the {}s budget".format(self.result['elapsed'], self.result['budget']))
+
+    def test_heavy_modules_load_lazily(self):
+        self.assertEqual(self.result['loaded'], [], "Plugin import pulled in modules that should load on first use")
+
+
+if __name__ == '__main__':
+    probe(sys.argv[1:])